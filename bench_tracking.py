@@ -0,0 +1,84 @@
+"""
+Microbenchmark cho đường xử lý theo dõi hoạt động (chạy: python bench_tracking.py)
+"""
+import os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tennis.settings')
+
+import django
+django.setup()
+
+import re
+import timeit
+
+from django.conf import settings
+from home.route_classifier import RouteClassifier
+from home.user_agent import UserAgentParser
+
+# Cách cũ: duyệt lần lượt từng regex cho mỗi request
+LEGACY_EXCLUDED = [
+    r'^/static/', r'^/media/', r'^/admin/jsi18n/', r'^/favicon\.ico$', r'\.css$', r'\.js$',
+    r'\.png$', r'\.jpg$', r'\.jpeg$', r'\.gif$', r'\.ico$', r'\.woff', r'\.ttf', r'\.svg$',
+]
+LEGACY_PAGE_NAMES = {
+    r'^/$': 'Trang chủ', r'^/home/?$': 'Trang chủ', r'^/about/?$': 'Giới thiệu',
+    r'^/contact/?$': 'Liên hệ', r'^/auth/?$': 'Đăng nhập/Đăng ký User',
+    r'^/auth_admin/?$': 'Đăng nhập/Đăng ký Admin', r'^/hire/?$': 'Danh sách sân tennis',
+    r'^/detail/\d+/?$': 'Chi tiết sân', r'^/checkout/\d+/?$': 'Thanh toán',
+    r'^/booking-success/?$': 'Đặt sân thành công', r'^/my-bookings/?$': 'Đặt chỗ của tôi',
+    r'^/all-bookings/?$': 'Tất cả đặt chỗ', r'^/top-up/?$': 'Nạp tiền',
+    r'^/transaction-history/?$': 'Lịch sử giao dịch', r'^/user-profile/?$': 'Hồ sơ người dùng',
+    r'^/review/\d+/?$': 'Đánh giá sân', r'^/report/\d+/?$': 'Báo cáo sân',
+    r'^/add-tennis/?$': 'Thêm sân mới', r'^/manage-users/?$': 'Quản lý người dùng',
+    r'^/admin-reports/?$': 'Báo cáo admin', r'^/analytics/?$': 'Thống kê hoạt động',
+}
+
+
+def legacy_classify(path):
+    for pattern in LEGACY_EXCLUDED:
+        if re.search(pattern, path, re.IGNORECASE):
+            return False, path
+    for pattern, name in LEGACY_PAGE_NAMES.items():
+        if re.match(pattern, path, re.IGNORECASE):
+            return True, name
+    return True, path
+
+
+PATHS = [
+    '/home/', '/about/', '/property_list/', '/detail/', '/checkout/', '/booking/',
+    '/rent_court/3/', '/review/7/', '/analytics/', '/does-not-exist/',
+    '/static/app/css/style.css', '/media/San1.jpg', '/favicon.ico',
+]
+
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/23.0 Chrome/115.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+]
+
+
+def bench(label, func, number=2000, inputs=PATHS):
+    total = timeit.timeit(lambda: [func(value) for value in inputs], number=number)
+    per_request = total / (number * len(inputs)) * 1e6
+    print(f"{label:<32} {per_request:8.2f} µs/request")
+
+
+if __name__ == '__main__':
+    classifier = RouteClassifier(
+        excluded_prefixes=settings.ACTIVITY_TRACKING_EXCLUDED_PREFIXES,
+        excluded_extensions=settings.ACTIVITY_TRACKING_EXCLUDED_EXTENSIONS,
+        page_names=settings.ACTIVITY_TRACKING_PAGE_NAMES,
+        page_name_patterns=settings.ACTIVITY_TRACKING_PAGE_NAME_PATTERNS,
+    )
+    print("== Route classification ==")
+    bench('legacy regex loops', legacy_classify)
+    bench('RouteClassifier (cold, no memo)', classifier._classify, number=200)
+    bench('RouteClassifier (memoized)', classifier.classify)
+    print(classifier.cache_info())
+
+    parser = UserAgentParser()
+    print("== User-Agent parsing ==")
+    bench('UserAgentParser (cold, no memo)', parser._parse, inputs=USER_AGENTS)
+    bench('UserAgentParser (memoized)', parser.parse, inputs=USER_AGENTS)
+    print(parser.cache_stats())
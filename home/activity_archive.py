@@ -0,0 +1,210 @@
+"""
+Lưu trữ (archive) UserActivity cũ ra file NDJSON nén gzip.
+
+Dữ liệu "nóng" (ACTIVITY_RETENTION_DAYS ngày gần nhất) nằm trong bảng
+UserActivity; các dòng cũ hơn được chuyển theo từng lô sang các segment
+<ACTIVITY_ARCHIVE_DIR>/<YYYY-MM>/<id đầu>-<id cuối>.ndjson.gz rồi mới bị xoá
+khỏi bảng. Mỗi segment phủ một khoảng id cố định (ACTIVITY_ARCHIVE_SEGMENT_SIZE
+id, không phụ thuộc chunk_size của lần chạy) và được ghi bằng cách gộp theo id
+với nội dung đã có: chạy lại sau sự cố (đã ghi file nhưng chưa xoá dòng) chỉ
+ghi lại đúng các dòng đó vào đúng segment cũ, không sinh dữ liệu trùng.
+
+iter_activities() đọc liền mạch cả phần đã archive và phần còn trong bảng.
+"""
+import gzip
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+ARCHIVE_FIELDS = [
+    'id', 'user_id', 'activity_type', 'description', 'ip_address',
+    'user_agent', 'page_url', 'referrer', 'created_at', 'weight', 'extra_data',
+]
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'activities'))
+
+
+def get_retention_days():
+    return getattr(settings, 'ACTIVITY_RETENTION_DAYS', 90)
+
+
+def get_segment_size():
+    return getattr(settings, 'ACTIVITY_ARCHIVE_SEGMENT_SIZE', 10000)
+
+
+def _month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _serialize(row):
+    row = dict(row)
+    row['created_at'] = row['created_at'].isoformat()
+    return json.dumps(row, ensure_ascii=False, separators=(',', ':'))
+
+
+def _deserialize(line):
+    row = json.loads(line)
+    row['created_at'] = datetime.fromisoformat(row['created_at'])
+    row.setdefault('weight', 1.0)
+    return row
+
+
+def _segment_path(month, row_id):
+    size = get_segment_size()
+    first = row_id // size * size
+    return get_archive_dir() / month / f'{first:012d}-{first + size - 1:012d}.ndjson.gz'
+
+
+def _write_segment(path, rows):
+    """Gộp rows (theo id) vào segment `path` và ghi lại nguyên tử"""
+    lines = {}
+    if path.exists():
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                lines[json.loads(line)['id']] = line.rstrip('\n')
+    for row in rows:
+        lines[row['id']] = _serialize(row)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for row_id in sorted(lines):
+            f.write(lines[row_id])
+            f.write('\n')
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_activities(older_than_days=None, chunk_size=5000, max_chunks=None):
+    """
+    Chuyển các UserActivity cũ hơn older_than_days ngày sang segment file
+
+    Args:
+        older_than_days: Số ngày giữ lại trong bảng (mặc định ACTIVITY_RETENTION_DAYS)
+        chunk_size: Số dòng mỗi lô
+        max_chunks: Giới hạn số lô mỗi lần chạy (None = chạy hết)
+
+    Returns:
+        Số dòng đã được archive
+    """
+    from .models import UserActivity
+
+    days = get_retention_days() if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    chunks = 0
+    last_id = 0
+
+    while max_chunks is None or chunks < max_chunks:
+        # Keyset theo id: mỗi lô là một lần quét index, không dùng OFFSET
+        rows = list(
+            UserActivity.objects.filter(created_at__lt=cutoff, id__gt=last_id)
+            .order_by('id')
+            .values(*ARCHIVE_FIELDS)[:chunk_size]
+        )
+        if not rows:
+            break
+
+        segments = {}
+        for row in rows:
+            segments.setdefault(_segment_path(_month_key(row['created_at']), row['id']), []).append(row)
+        for path, segment_rows in segments.items():
+            _write_segment(path, segment_rows)
+
+        # Chỉ xoá sau khi segment đã được ghi xong xuống đĩa
+        ids = [row['id'] for row in rows]
+        with transaction.atomic():
+            UserActivity.objects.filter(id__in=ids).delete()
+
+        archived += len(rows)
+        chunks += 1
+        last_id = ids[-1]
+
+    return archived
+
+
+def _archived_months(start, end):
+    directory = get_archive_dir()
+    if not directory.exists():
+        return []
+    first = _month_key(start) if start else None
+    last = _month_key(end) if end else None
+    return sorted(
+        path for path in directory.iterdir()
+        if path.is_dir()
+        and (first is None or path.name >= first)
+        and (last is None or path.name <= last)
+    )
+
+
+def iter_archived_activities(start=None, end=None, user_id=None, activity_type=None):
+    """Đọc các hoạt động đã archive trong khoảng [start, end)"""
+    for month_dir in _archived_months(start, end):
+        for segment in sorted(month_dir.glob('*.ndjson.gz')):
+            with gzip.open(segment, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    row = _deserialize(line)
+                    if start and row['created_at'] < start:
+                        continue
+                    if end and row['created_at'] >= end:
+                        continue
+                    if user_id is not None and row['user_id'] != user_id:
+                        continue
+                    if activity_type and row['activity_type'] != activity_type:
+                        continue
+                    yield row
+
+
+def iter_activities(start=None, end=None, user_id=None, activity_type=None, chunk_size=2000):
+    """
+    Duyệt hoạt động trong khoảng [start, end), gồm cả phần đã archive,
+    theo thứ tự thời gian tăng dần. Mỗi phần tử là một dict ARCHIVE_FIELDS.
+    """
+    from .models import UserActivity
+
+    yield from iter_archived_activities(start, end, user_id, activity_type)
+
+    activities = UserActivity.objects.all()
+    if start:
+        activities = activities.filter(created_at__gte=start)
+    if end:
+        activities = activities.filter(created_at__lt=end)
+    if user_id is not None:
+        activities = activities.filter(user_id=user_id)
+    if activity_type:
+        activities = activities.filter(activity_type=activity_type)
+    yield from activities.order_by('created_at').values(*ARCHIVE_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def recent_activities(start=None, end=None, user_id=None, limit=1000):
+    """
+    Tối đa `limit` hoạt động mới nhất trong khoảng [start, end), gồm cả phần
+    đã archive, theo thứ tự thời gian giảm dần
+
+    Phần trong bảng được đọc bằng một truy vấn có LIMIT; chỉ khi chưa đủ mới
+    đọc archive, giữ `limit` dòng cuối trong một deque nên bộ nhớ không phụ
+    thuộc độ dài khoảng thời gian.
+    """
+    from .models import UserActivity
+
+    activities = UserActivity.objects.all()
+    if start:
+        activities = activities.filter(created_at__gte=start)
+    if end:
+        activities = activities.filter(created_at__lt=end)
+    if user_id is not None:
+        activities = activities.filter(user_id=user_id)
+    rows = list(activities.order_by('-created_at').values(*ARCHIVE_FIELDS)[:limit])
+    if len(rows) < limit:
+        archived = deque(iter_archived_activities(start, end, user_id), maxlen=limit - len(rows))
+        rows.extend(reversed(archived))
+    return rows
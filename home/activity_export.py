@@ -0,0 +1,114 @@
+"""
+Xuất UserActivity / VisitorSession ra CSV hoặc NDJSON theo luồng.
+
+Dữ liệu được đọc theo từng khoảng id (keyset: id > id cuối của lô trước,
+LIMIT chunk_size) và ghi ra ngay, nên xuất hàng triệu dòng vẫn chỉ tốn bộ nhớ
+của một lô. Với hoạt động, phần đã archive (home.activity_archive) được đọc
+trước, rồi tới phần còn trong bảng.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .activity_archive import ARCHIVE_FIELDS, iter_archived_activities
+
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+SESSION_FIELDS = [
+    'id', 'session_key', 'user_id', 'ip_address', 'user_agent', 'device_type',
+    'browser', 'os', 'country', 'city', 'started_at', 'last_activity', 'page_views',
+]
+EXPORT_KINDS = {
+    'activities': ARCHIVE_FIELDS,
+    'sessions': SESSION_FIELDS,
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def parse_date_range(start_date=None, end_date=None):
+    """Đổi ngày bắt đầu/kết thúc (bao gồm) thành khoảng thời gian [start, end)"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz) if start_date else None
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz) if end_date else None
+    return start, end
+
+
+def iter_keyset(queryset, fields, chunk_size=2000):
+    """Duyệt queryset theo id tăng dần, mỗi lô là một truy vấn id > id cuối"""
+    last_id = 0
+    while True:
+        count = 0
+        for row in queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last_id = row['id']
+            yield row
+        if count < chunk_size:
+            return
+
+
+def iter_export_rows(kind, start=None, end=None, activity_type=None, user_id=None, chunk_size=2000):
+    """
+    Các dòng cần xuất (dict) theo bộ lọc
+
+    Args:
+        kind: 'activities' hoặc 'sessions'
+        start, end: Khoảng thời gian [start, end) (created_at / started_at)
+        activity_type: Lọc loại hoạt động (chỉ với activities)
+        user_id: Lọc theo userID
+    """
+    from .models import UserActivity, VisitorSession
+
+    if kind == 'activities':
+        yield from iter_archived_activities(start, end, user_id=user_id, activity_type=activity_type)
+        queryset = UserActivity.objects.all()
+        time_field = 'created_at'
+        if activity_type:
+            queryset = queryset.filter(activity_type=activity_type)
+    elif kind == 'sessions':
+        queryset = VisitorSession.objects.all()
+        time_field = 'started_at'
+    else:
+        raise ValueError(f'Unknown export kind: {kind}')
+
+    if start:
+        queryset = queryset.filter(**{f'{time_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{time_field}__lt': end})
+    if user_id:
+        queryset = queryset.filter(user_id=user_id)
+    yield from iter_keyset(queryset, EXPORT_KINDS[kind], chunk_size)
+
+
+class _Echo:
+    """Đối tượng giả file cho csv.writer: trả lại dòng thay vì ghi"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return '' if value is None else value
+
+
+def stream_export(rows, fields, fmt='csv'):
+    """Sinh từng dòng văn bản CSV (có header) hoặc NDJSON"""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_csv_value(row.get(field)) for field in fields])
+    elif fmt == 'ndjson':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
@@ -2,8 +2,7 @@
 Utility functions để theo dõi và ghi lại hoạt động người dùng
 """
 from django.utils import timezone
-from django.db.models import Count, Sum
-from django.db.models.functions import TruncDate, TruncHour
+from django.db.models import Sum
 from datetime import timedelta
 
 
@@ -28,6 +27,8 @@ def log_activity(request, activity_type, description=None, extra_data=None):
         extra_data: Dict chứa dữ liệu bổ sung
     """
     from .models import UserActivity
+    from .rollups import record_rollup
+    from .user_stats import record_user_activity
     
     try:
         user = request.user if request.user.is_authenticated else None
@@ -45,12 +46,109 @@ def log_activity(request, activity_type, description=None, extra_data=None):
             referrer=referrer if referrer else None,
             extra_data=extra_data or {}
         )
+        record_rollup('activity_type', activity_type, activity.created_at)
+        record_user_activity(activity.user_id, activity_type, activity.created_at)
         return activity
     except Exception as e:
         print(f"Error logging activity: {e}")
         return None
 
 
+def record_tracking_events(events):
+    """
+    Ghi một lô sự kiện theo dõi (do ActivityTrackingMiddleware tạo ra)
+
+    Các sự kiện được gộp lại trước khi ghi: lượt xem của mỗi URL được cộng dồn
+    vào bộ đếm gộp (home.counters), mỗi session đi qua heartbeat có điều tiết
+    (home.session_tracking), và các UserActivity được tạo bằng một lệnh
+    bulk_create.
+
+    Args:
+        events: List các dict sự kiện
+    """
+    from .counters import get_page_view_counter
+    from .models import UserActivity
+    from .rollups import bucket_start, record_rollup
+    from .session_tracking import get_session_heartbeat
+    from .user_stats import record_user_activity
+    from .visitor_sketches import record_visitor
+
+    if not events:
+        return
+
+    page_counts = {}
+    sessions = {}
+
+    for event in events:
+        path = event['path']
+        count, page_name = page_counts.get(path, (0, event['page_name']))
+        page_counts[path] = (count + 1, page_name)
+
+        merged = sessions.get(event['session_key'])
+        if merged is None:
+            sessions[event['session_key']] = {'first': event, 'count': 1, 'last': event}
+        else:
+            merged['count'] += 1
+            merged['last'] = event
+
+    page_view_counter = get_page_view_counter()
+    for path, (count, page_name) in page_counts.items():
+        page_view_counter.add(path, count, page_name)
+
+    # Khách khác nhau theo ngày (toàn site và từng route): sketch HyperLogLog
+    for event in events:
+        record_visitor(event['timestamp'], event['ip_address'] or event['session_key'], event.get('route_name'))
+
+    session_heartbeat = get_session_heartbeat()
+
+    # Mỗi session: một lệnh upsert, và chỉ khi heartbeat đã quá ngưỡng;
+    # device/browser/os của session đã biết được dùng lại
+    for session_key, merged in sessions.items():
+        first, last = merged['first'], merged['last']
+        merged['dims'] = session_heartbeat.touch(
+            session_key,
+            merged['count'],
+            last['timestamp'],
+            user_id=last['user_id'],
+            ip_address=first['ip_address'],
+            user_agent=first['user_agent'],
+        )
+
+    activities = []
+    for event in events:
+        if not event.get('log_activity'):
+            continue
+        device_type, browser, os_name = sessions[event['session_key']]['dims']
+        activities.append(UserActivity(
+            user_id=event['user_id'],
+            activity_type='page_view',
+            description=f"Xem trang: {event['page_name']}",
+            ip_address=event['ip_address'],
+            user_agent=event['user_agent'],
+            page_url=event['page_url'],
+            referrer=event['referrer'] or None,
+            weight=event.get('weight', 1.0),
+            extra_data={
+                'path': event['path'],
+                'page_name': event['page_name'],
+                'device_type': device_type,
+                'browser': browser,
+                'os': os_name,
+            }
+        ))
+    if activities:
+        UserActivity.objects.bulk_create(activities)
+        # Cộng weight của các dòng vừa ghi vào thống kê gộp theo giờ/ngày
+        weights = {}
+        for activity in activities:
+            bucket = bucket_start(activity.created_at, 'hour')
+            weights[bucket] = weights.get(bucket, 0) + activity.weight
+        for bucket, weight in weights.items():
+            record_rollup('activity_type', 'page_view', bucket, weight)
+        for activity in activities:
+            record_user_activity(activity.user_id, 'page_view', activity.created_at, activity.weight)
+
+
 def get_analytics_data(days=30):
     """
     Lấy dữ liệu thống kê hoạt động
@@ -61,32 +159,30 @@ def get_analytics_data(days=30):
     Returns:
         Dict chứa các thống kê
     """
-    from .models import UserActivity, PageView, VisitorSession, CustomUser, Booking, Invoice
+    from .models import PageView, VisitorSession, CustomUser, Booking, Invoice
+    from .rollups import get_rollup_series, get_rollup_totals
+    from .user_agent import get_user_agent_cache_stats
+    from .visitor_sketches import count_unique_visitors
     
     now = timezone.now()
     start_date = now - timedelta(days=days)
     
-    # Thống kê hoạt động
-    activities = UserActivity.objects.filter(created_at__gte=start_date)
-    
-    # Thống kê theo loại hoạt động
-    activity_stats = activities.values('activity_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
+    # Thống kê hoạt động, thiết bị, trình duyệt: đọc từ bảng gộp ActivityRollup
+    # (vài trăm dòng) thay vì GROUP BY trên UserActivity/VisitorSession.
+    # Số liệu page_view đã tính theo weight của dữ liệu lấy mẫu.
+    activity_stats = get_rollup_totals('activity_type', start_date)
+
     # Thống kê theo ngày
-    daily_stats = activities.annotate(
-        date=TruncDate('created_at')
-    ).values('date').annotate(
-        count=Count('id')
-    ).order_by('date')
-    
-    # Thống kê theo giờ
-    hourly_stats = activities.annotate(
-        hour=TruncHour('created_at')
-    ).values('hour').annotate(
-        count=Count('id')
-    ).order_by('-hour')[:24]
+    daily_stats = [
+        {'date': timezone.localtime(item['bucket']).date(), 'count': item['count']}
+        for item in get_rollup_series('day', 'activity_type', start_date)
+    ]
+
+    # Thống kê theo giờ (24 giờ gần nhất có hoạt động)
+    hourly_stats = [
+        {'hour': item['bucket'], 'count': item['count']}
+        for item in reversed(get_rollup_series('hour', 'activity_type', start_date))
+    ][:24]
     
     # Top pages
     top_pages = PageView.objects.all().order_by('-view_count')[:10]
@@ -96,19 +192,14 @@ def get_analytics_data(days=30):
         last_activity__gte=now - timedelta(minutes=30)
     ).count()
     
-    # Thống kê thiết bị
-    device_stats = VisitorSession.objects.filter(
-        started_at__gte=start_date
-    ).values('device_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    # Thống kê thiết bị (số phiên mới)
+    device_stats = get_rollup_totals('device_type', start_date)
     
     # Thống kê trình duyệt
-    browser_stats = VisitorSession.objects.filter(
-        started_at__gte=start_date
-    ).values('browser').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    browser_stats = get_rollup_totals('browser', start_date)
+    
+    # Lượt truy cập của bot/crawler (không tính vào các số liệu khác)
+    bot_stats = get_rollup_totals('bot', start_date)
     
     # Thống kê người dùng mới
     new_users = CustomUser.objects.filter(
@@ -117,7 +208,7 @@ def get_analytics_data(days=30):
     
     # Thống kê đặt sân
     bookings = Booking.objects.filter(
-        id__gte=0  # Tất cả booking (nếu có field created_at thì dùng filter theo ngày)
+        created_at__gte=start_date
     ).count()
     
     # Thống kê doanh thu
@@ -126,23 +217,33 @@ def get_analytics_data(days=30):
         created_at__gte=start_date
     ).aggregate(total=Sum('amount'))['total'] or 0
     
+    # Số khách khác nhau trong khoảng (gộp sketch HyperLogLog theo ngày)
+    unique_visitors, unique_visitors_error = count_unique_visitors(
+        timezone.localtime(start_date).date(), timezone.localdate() + timedelta(days=1)
+    )
+    
     # Tổng số lượt xem
     total_page_views = PageView.objects.aggregate(
         total=Sum('view_count')
     )['total'] or 0
     
     return {
-        'activity_stats': list(activity_stats),
-        'daily_stats': list(daily_stats),
-        'hourly_stats': list(hourly_stats),
+        'activity_stats': activity_stats,
+        'daily_stats': daily_stats,
+        'hourly_stats': hourly_stats,
         'top_pages': top_pages,
         'active_sessions': active_sessions,
-        'device_stats': list(device_stats),
-        'browser_stats': list(browser_stats),
+        'device_stats': device_stats,
+        'browser_stats': browser_stats,
+        'bot_stats': bot_stats,
+        'bot_requests': sum(item['count'] for item in bot_stats),
         'new_users': new_users,
         'total_bookings': bookings,
         'total_revenue': total_revenue,
         'total_page_views': total_page_views,
+        'unique_visitors': unique_visitors,
+        'unique_visitors_error': round(unique_visitors_error, 4),
+        'user_agent_cache': get_user_agent_cache_stats(),
         'days': days,
     }
 
@@ -154,24 +255,15 @@ def get_recent_activities(limit=50):
 
 
 def get_online_users_count():
-    """Đếm số người dùng đang online"""
-    from django.core.cache import cache
-    from .models import CustomUser
-    
-    online_count = 0
-    users = CustomUser.objects.all()
-    
-    for user in users:
-        cache_key = f'online_user_{user.userID}'
-        if cache.get(cache_key):
-            online_count += 1
-    
-    return online_count
+    """Đếm số người dùng đang online (theo chỉ mục presence theo phút)"""
+    from .presence import get_online_count
+    return get_online_count()
 
 
 def get_user_activity_summary(user):
     """
-    Lấy tóm tắt hoạt động của một người dùng cụ thể
+    Lấy tóm tắt hoạt động của một người dùng cụ thể (đọc từ UserStats,
+    xem home.user_stats)
     
     Args:
         user: CustomUser object
@@ -179,61 +271,28 @@ def get_user_activity_summary(user):
     Returns:
         Dict chứa thống kê hoạt động của user
     """
-    from .models import UserActivity
+    from .user_stats import get_user_stats
     
-    activities = UserActivity.objects.filter(user=user)
+    stats = get_user_stats(user)
+    counts = {activity_type: round(count) for activity_type, count in stats.counts.items()}
     
     return {
-        'total_activities': activities.count(),
-        'login_count': activities.filter(activity_type='login').count(),
-        'booking_count': activities.filter(activity_type='booking').count(),
-        'page_views': activities.filter(activity_type='page_view').count(),
-        'last_activity': activities.first(),
-        'activity_by_type': list(activities.values('activity_type').annotate(
-            count=Count('id')
-        ).order_by('-count')),
+        'total_activities': sum(counts.values()),
+        'login_count': counts.get('login', 0),
+        'booking_count': counts.get('booking', 0),
+        'page_views': counts.get('page_view', 0),
+        'first_activity': stats.first_seen,
+        'last_activity': stats.last_seen,
+        'total_spend': stats.total_spend,
+        'activity_by_type': sorted(
+            ({'activity_type': activity_type, 'count': count} for activity_type, count in counts.items()),
+            key=lambda item: -item['count'],
+        ),
     }
 
 
 def update_daily_stats():
-    """Cập nhật thống kê hàng ngày"""
-    from .models import DailyStats, UserActivity, CustomUser, Booking, Invoice
-    
-    today = timezone.now().date()
-    
-    # Lấy hoặc tạo record cho ngày hôm nay
-    stats, created = DailyStats.objects.get_or_create(date=today)
-    
-    # Cập nhật thống kê
-    today_start = timezone.make_aware(
-        timezone.datetime.combine(today, timezone.datetime.min.time())
-    )
-    today_end = timezone.make_aware(
-        timezone.datetime.combine(today, timezone.datetime.max.time())
-    )
-    
-    stats.total_visits = UserActivity.objects.filter(
-        created_at__range=(today_start, today_end),
-        activity_type='page_view'
-    ).count()
-    
-    stats.unique_visitors = UserActivity.objects.filter(
-        created_at__range=(today_start, today_end)
-    ).values('ip_address').distinct().count()
-    
-    stats.new_registrations = CustomUser.objects.filter(
-        date_joined__range=(today_start, today_end)
-    ).count()
-    
-    stats.total_bookings = UserActivity.objects.filter(
-        created_at__range=(today_start, today_end),
-        activity_type='booking'
-    ).count()
-    
-    stats.total_revenue = Invoice.objects.filter(
-        status='Paid',
-        created_at__range=(today_start, today_end)
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    stats.save()
-    return stats
+    """Cập nhật thống kê hàng ngày (từ mốc đã xử lý tới hôm nay, xem home.daily_stats)"""
+    from .daily_stats import update_daily_stats as build_pending_daily_stats
+
+    return build_pending_daily_stats()
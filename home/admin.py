@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, UserActivity, PageView, DailyStats, VisitorSession
+from .models import CustomUser, UserActivity, PageView, DailyStats, VisitorSession, ActivityRollup, UserStats
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
@@ -79,5 +79,33 @@ class VisitorSessionAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'granularity', 'dimension', 'value', 'count', 'updated_at')
+    list_filter = ('granularity', 'dimension', 'bucket')
+    ordering = ('-bucket',)
+    readonly_fields = ('granularity', 'dimension', 'bucket', 'value', 'count', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_activities', 'first_seen', 'last_seen', 'total_spend', 'updated_at')
+    search_fields = ('user__username', 'user__email')
+    ordering = ('-last_seen',)
+    readonly_fields = ('user', 'counts', 'first_seen', 'last_seen', 'total_spend', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # Đăng ký vào admin
 admin.site.register(CustomUser, CustomUserAdmin)
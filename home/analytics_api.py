@@ -0,0 +1,141 @@
+"""
+Phản hồi JSON của analytics_api: ETag, 304 và nén.
+
+ETag được suy ra từ mốc thay đổi của số liệu gộp (rollups.get_rollup_watermark),
+phiên bản cache dashboard (thay đổi khi user/sân/booking thay đổi), tham số
+days/fields và một cửa sổ thời gian ANALYTICS_API_MAX_STALENESS giây (cho các
+số liệu tự trôi theo thời gian như số phiên đang hoạt động). Khi dashboard tự
+làm mới gửi lại If-None-Match trùng ETag, server trả 304 mà không tính lại gì.
+
+Nội dung JSON (đã nén) được cache theo ETag và kiểu nén, nên nhiều admin cùng
+mở dashboard chỉ tốn một lần dựng dữ liệu cho mỗi phiên bản.
+"""
+import gzip
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli là tuỳ chọn, không có thì chỉ dùng gzip
+    brotli = None
+
+
+API_FIELDS = (
+    'activity_stats', 'daily_stats', 'device_stats', 'browser_stats',
+    'bot_stats', 'bot_requests',
+    'active_sessions', 'new_users', 'total_bookings', 'total_revenue',
+    'total_page_views', 'unique_visitors', 'unique_visitors_error',
+    'top_pages', 'user_agent_cache',
+)
+MIN_COMPRESS_LENGTH = 200
+
+
+def get_max_staleness():
+    return getattr(settings, 'ANALYTICS_API_MAX_STALENESS', 60)
+
+
+def parse_fields(value):
+    """
+    Danh sách field từ tham số fields= (phân tách bằng dấu phẩy)
+
+    Raises:
+        ValueError: nếu có field không hợp lệ
+    """
+    if not value:
+        return list(API_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def get_analytics_etag(days, fields):
+    """ETag (weak) cho payload analytics với days/fields cho trước"""
+    from .dashboard import get_dashboard_version
+    from .rollups import get_rollup_watermark
+
+    window = int(time.time() // max(get_max_staleness(), 1))
+    raw = f"{get_rollup_watermark()}:{get_dashboard_version()}:{window}:{days}:{','.join(fields)}"
+    return f'W/"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+def build_analytics_payload(days, fields):
+    """Dữ liệu analytics dạng JSON-serializable, chỉ gồm các field được chọn"""
+    from .activity_tracker import get_analytics_data
+
+    analytics_data = get_analytics_data(days)
+    payload = {
+        field: analytics_data[field] for field in fields
+        if field not in ('daily_stats', 'top_pages')
+    }
+    if 'daily_stats' in fields:
+        payload['daily_stats'] = [
+            {'date': str(item['date']), 'count': item['count']}
+            for item in analytics_data['daily_stats']
+        ]
+    if 'top_pages' in fields:
+        payload['top_pages'] = [
+            {'url': page.page_url, 'name': page.page_name, 'views': page.view_count}
+            for page in analytics_data['top_pages']
+        ]
+    return payload
+
+
+def _choose_encoding(request):
+    accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encodings = {part.split(';')[0].strip().lower() for part in accept.split(',')}
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return 'identity'
+
+
+def _encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, mtime=0)
+    return body
+
+
+def _set_cache_headers(response, etag):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+
+def not_modified_response(request, etag):
+    """304 (kèm ETag/Cache-Control/Vary như phản hồi 200) nếu If-None-Match khớp, không thì None"""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        _set_cache_headers(response, etag)
+    return response
+
+
+def analytics_response(request, days, fields, etag):
+    """HttpResponse JSON cho payload analytics, nén theo Accept-Encoding nếu đủ lớn"""
+    encoding = _choose_encoding(request)
+    cache_key = f'analytics_api:{hashlib.md5(etag.encode()).hexdigest()}:{encoding}'
+
+    cached = cache.get(cache_key)
+    if cached is None:
+        body = json.dumps(build_analytics_payload(days, fields), cls=DjangoJSONEncoder).encode('utf-8')
+        used_encoding = encoding if len(body) >= MIN_COMPRESS_LENGTH else 'identity'
+        cached = (used_encoding, _encode(body, used_encoding))
+        cache.set(cache_key, cached, get_max_staleness())
+
+    used_encoding, content = cached
+    response = HttpResponse(content, content_type='application/json')
+    if used_encoding != 'identity':
+        response['Content-Encoding'] = used_encoding
+    _set_cache_headers(response, etag)
+    return response
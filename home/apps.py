@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class HomeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "home"
+
+    def ready(self):
+        from . import availability, dashboard, user_stats
+        dashboard.connect_invalidation_signals()
+        availability.connect_invalidation_signals()
+        user_stats.connect_spend_signals()
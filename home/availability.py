@@ -0,0 +1,185 @@
+"""
+Chỉ mục sân trống theo ngày dạng bitmap.
+
+Với mỗi ngày, mỗi sân có hai số nguyên 24 bit: open (bit h bật khi giờ h
+nằm trong một CourtSlot của sân) và booked (bit h bật khi slot chứa giờ h đã
+có booking hoặc đang được giữ chỗ). Câu hỏi "sân nào trống ngày D từ 18h tới
+20h" là phép AND/so sánh trên các số nguyên này, không cần đọc Booking hay
+tách chuỗi.
+
+Chỉ mục của một ngày được dựng bằng một truy vấn trên CourtSlot (index
+court, date), cache AVAILABILITY_CACHE_TTL giây và bị huỷ khi booking/slot/giữ
+chỗ của ngày đó thay đổi (connect_invalidation_signals). Việc huỷ chỉ tới
+được các process khác khi cache dùng chung (Redis); với cache riêng từng
+process (LocMem) TTL bị giới hạn ở AVAILABILITY_LOCAL_CACHE_TTL giây. Chỉ mục
+chỉ dùng cho tìm kiếm: việc đặt/giữ chỗ luôn kiểm tra lại trên DB
+(home.reservations).
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Q
+
+
+HOURS = 24
+
+
+def get_cache_ttl():
+    """TTL cache chỉ mục; ngắn lại khi cache không dùng chung giữa các process"""
+    ttl = getattr(settings, 'AVAILABILITY_CACHE_TTL', 300)
+    if isinstance(caches['default'], LocMemCache):
+        ttl = min(ttl, getattr(settings, 'AVAILABILITY_LOCAL_CACHE_TTL', 5))
+    return ttl
+
+
+def _cache_key(date):
+    return f'availability:{date.isoformat()}'
+
+
+def _end_hour(value):
+    # 00:00 ở giờ kết thúc là nửa đêm cuối ngày; phút lẻ làm tròn lên
+    if value == time(0):
+        return HOURS
+    return value.hour + (1 if value.minute or value.second else 0)
+
+
+def hour_mask(start, end):
+    """Bitmap các giờ h với start <= h < end (start/end: time hoặc số giờ)"""
+    if isinstance(start, time):
+        start = start.hour
+    if isinstance(end, time):
+        end = _end_hour(end)
+    start, end = max(int(start), 0), min(int(end), HOURS)
+    if end <= start:
+        return 0
+    return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+
+def build_day_index(date):
+    """
+    {court_id: (open, booked)} cho ngày `date`, bỏ qua sân đang sửa
+
+    Sân chưa có dòng CourtSlot cho ngày mở bán của nó (slot được tạo khi có
+    người xem) được tính theo mẫu playTime.
+    """
+    from .court_slots import court_slot_times, slots_with_status
+    from .models import CourtSlot, Tennis
+    from django.utils import timezone
+
+    index = {}
+    slots = slots_with_status(
+        CourtSlot.objects.filter(date=date).exclude(court__status='Repairing')
+    ).values_list('court_id', 'start_time', 'end_time', 'is_booked', 'is_held')
+    for court_id, start, end, is_booked, is_held in slots:
+        open_bits, booked_bits = index.get(court_id, (0, 0))
+        mask = hour_mask(start, end)
+        index[court_id] = (open_bits | mask, booked_bits | (mask if is_booked or is_held else 0))
+
+    date_filter = Q(dateTime=date)
+    if date == timezone.localdate():
+        date_filter |= Q(dateTime__isnull=True)
+    for court in Tennis.objects.filter(date_filter).exclude(status='Repairing').exclude(id__in=list(index)):
+        open_bits = 0
+        for start, end in court_slot_times(court):
+            open_bits |= hour_mask(start, end)
+        if open_bits:
+            index[court.id] = (open_bits, 0)
+    return index
+
+
+def get_day_index(date):
+    """Chỉ mục bitmap của ngày (có cache)"""
+    ttl = get_cache_ttl()
+    if ttl <= 0:
+        return build_day_index(date)
+    key = _cache_key(date)
+    index = cache.get(key)
+    if index is None:
+        index = build_day_index(date)
+        cache.set(key, index, ttl)
+    return index
+
+
+def invalidate_day(date):
+    cache.delete(_cache_key(date))
+
+
+def find_free_courts(date, start=None, end=None):
+    """
+    Id các sân còn trống trong ngày `date`
+
+    Args:
+        start, end: Khoảng giờ [start, end) cần trống hoàn toàn (time hoặc số
+            giờ); bỏ trống thì chỉ cần còn ít nhất một giờ trống trong ngày
+
+    Returns:
+        Set id sân
+    """
+    index = get_day_index(date)
+    if start is None and end is None:
+        return {court_id for court_id, (open_bits, booked_bits) in index.items() if open_bits & ~booked_bits}
+    mask = hour_mask(start if start is not None else 0, end if end is not None else HOURS)
+    if not mask:
+        return set()
+    return {
+        court_id for court_id, (open_bits, booked_bits) in index.items()
+        if (open_bits & ~booked_bits & mask) == mask
+    }
+
+
+def parse_hour(value):
+    """
+    Giờ từ chuỗi "18" hoặc "18:00" (time), None nếu rỗng/không hợp lệ
+
+    "24"/"24:00" là nửa đêm cuối ngày, trả về time(0) như giờ kết thúc của slot.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value in ('24', '24:00'):
+        return time(0)
+    for fmt in ('%H:%M', '%H'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def _slot_changed(sender, instance, **kwargs):
+    invalidate_day(instance.date)
+
+
+def _hold_changed(sender, instance, **kwargs):
+    from .models import CourtSlot
+
+    date = CourtSlot.objects.filter(pk=instance.slot_id).values_list('date', flat=True).first()
+    if date:
+        invalidate_day(date)
+
+
+def _booking_changed(sender, instance, **kwargs):
+    from .court_slots import get_slot_date
+
+    if instance.slot_id:
+        from .models import CourtSlot
+        date = CourtSlot.objects.filter(pk=instance.slot_id).values_list('date', flat=True).first()
+    else:
+        date = get_slot_date(instance.tennis_court)
+    if date:
+        invalidate_day(date)
+
+
+def connect_invalidation_signals():
+    """Huỷ chỉ mục của ngày khi slot, booking hoặc giữ chỗ của ngày đó thay đổi"""
+    from django.db.models.signals import post_delete, post_save
+    from .models import Booking, CourtSlot, SlotHold
+
+    post_save.connect(_slot_changed, sender=CourtSlot, dispatch_uid='availability_slot_save')
+    post_delete.connect(_slot_changed, sender=CourtSlot, dispatch_uid='availability_slot_delete')
+    post_save.connect(_booking_changed, sender=Booking, dispatch_uid='availability_booking_save')
+    post_delete.connect(_booking_changed, sender=Booking, dispatch_uid='availability_booking_delete')
+    post_save.connect(_hold_changed, sender=SlotHold, dispatch_uid='availability_hold_save')
+    post_delete.connect(_hold_changed, sender=SlotHold, dispatch_uid='availability_hold_delete')
@@ -0,0 +1,111 @@
+"""
+Bộ đếm gộp (coalesced counter) cho lượt xem trang.
+
+Các lượt tăng được cộng dồn theo từng URL trong bộ nhớ và chỉ ghi xuống DB
+mỗi PAGE_VIEW_COUNTER_FLUSH_SECONDS giây bằng một lệnh
+UPDATE ... view_count = view_count + n cho mỗi URL.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+class CoalescingCounter:
+    """
+    Cộng dồn các lượt tăng theo key và flush định kỳ.
+
+    flush_interval là núm chỉnh độ chính xác/độ trễ:
+    - 0: ghi ngay mỗi lần tăng (luôn chính xác, nhiều lệnh ghi nhất)
+    - N > 0: số liệu trong DB trễ tối đa N giây, mỗi key chỉ ghi 1 lần / N giây
+    max_pending giới hạn số key chờ ghi; vượt quá thì flush sớm.
+    """
+
+    def __init__(self, apply, flush_interval=5, max_pending=1000):
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.increments = 0
+        self.writes = 0
+
+    def add(self, key, count=1, meta=None):
+        """Cộng count vào key; meta (vd: page_name) giữ giá trị đầu tiên"""
+        with self._lock:
+            current, current_meta = self._pending.get(key, (0, meta))
+            self._pending[key] = (current + count, current_meta)
+            self.increments += count
+            due = (
+                self.flush_interval <= 0
+                or len(self._pending) >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush nếu đã quá flush_interval kể từ lần ghi trước"""
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Ghi mọi lượt tăng đang chờ xuống DB"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self.apply(pending)
+            self.writes += len(pending)
+        except Exception:
+            # Trả lại các lượt tăng để lần flush sau ghi tiếp
+            with self._lock:
+                for key, (count, meta) in pending.items():
+                    current, current_meta = self._pending.get(key, (0, meta))
+                    self._pending[key] = (current + count, current_meta)
+            raise
+
+    def stats(self):
+        with self._lock:
+            pending = sum(count for count, _ in self._pending.values())
+        return {
+            'increments': self.increments,
+            'writes': self.writes,
+            'pending': pending,
+            'flush_interval': self.flush_interval,
+        }
+
+
+def _apply_page_views(pending):
+    from django.db import transaction
+    from .models import PageView
+    from .rollups import mark_rollups_updated
+
+    with transaction.atomic():
+        for page_url, (count, page_name) in pending.items():
+            PageView.record_view(page_url, page_name, count=count)
+    mark_rollups_updated()
+
+
+_page_view_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_page_view_counter():
+    """Bộ đếm lượt xem trang dùng chung của process"""
+    global _page_view_counter
+    if _page_view_counter is None:
+        with _counter_lock:
+            if _page_view_counter is None:
+                _page_view_counter = CoalescingCounter(
+                    apply=_apply_page_views,
+                    flush_interval=getattr(settings, 'PAGE_VIEW_COUNTER_FLUSH_SECONDS', 5),
+                    max_pending=getattr(settings, 'PAGE_VIEW_COUNTER_MAX_PENDING', 1000),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_page_view_counter.flush_if_due)
+                register_shutdown_flusher(_page_view_counter.flush)
+    return _page_view_counter
@@ -0,0 +1,137 @@
+"""
+Khung giờ chơi theo ngày của sân (CourtSlot).
+
+Tennis.playTime là mẫu các khung giờ trong ngày ("8 hours - 10 hours, ...");
+các khung giờ thật của một ngày được tạo thành dòng CourtSlot (sân, ngày, giờ
+bắt đầu, giờ kết thúc) và Booking trỏ tới slot đã đặt. Kiểm tra còn trống là
+một truy vấn theo index (court, date) thay vì tách chuỗi.
+"""
+import re
+from datetime import datetime, time
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+
+PLAY_TIME_RE = re.compile(
+    r'^\s*(\d{1,2})(?::(\d{2}))?\s*(?:h|hours?)?\s*-\s*(\d{1,2})(?::(\d{2}))?'
+)
+
+
+def parse_play_time(label):
+    """(giờ bắt đầu, giờ kết thúc) từ nhãn dạng "8 hours -10 hours" hoặc "08:00 - 09:00", None nếu không đọc được"""
+    match = PLAY_TIME_RE.match(label or '')
+    if not match:
+        return None
+    start_hour, start_minute, end_hour, end_minute = match.groups()
+    try:
+        start = time(int(start_hour), int(start_minute or 0))
+        end = time(int(end_hour), int(end_minute or 0))
+    except ValueError:
+        return None
+    return start, end
+
+
+def _format_time(value):
+    return f'{value.hour} hours' if not value.minute else f'{value.hour}:{value.minute:02d}'
+
+
+def format_play_time(start, end):
+    """Nhãn hiển thị của khung giờ, vd: "8 hours - 10 hours" """
+    return f'{_format_time(start)} - {_format_time(end)}'
+
+
+def get_slot_date(court):
+    """Ngày có khung giờ của sân (Available Date), mặc định hôm nay"""
+    return court.dateTime or timezone.localdate()
+
+
+def court_slot_times(court):
+    """Các (giờ bắt đầu, giờ kết thúc) theo mẫu playTime của sân"""
+    labels = court.playTime.split(', ') if court.playTime else court.generate_play_times()
+    return [times for times in map(parse_play_time, labels) if times]
+
+
+def sync_court_slots(court, date=None):
+    """
+    Tạo các CourtSlot của sân trong ngày theo mẫu playTime; xoá các slot
+    chưa có booking không còn trong mẫu (vd: sau khi đổi số giờ mỗi lượt)
+    """
+    from .models import Booking, CourtSlot
+
+    date = date or get_slot_date(court)
+    times = court_slot_times(court)
+    starts = [start for start, _ in times]
+    CourtSlot.objects.filter(court=court, date=date).exclude(start_time__in=starts).exclude(
+        Exists(Booking.objects.filter(slot=OuterRef('pk')))
+    ).delete()
+    CourtSlot.objects.bulk_create(
+        [CourtSlot(court=court, date=date, start_time=start, end_time=end) for start, end in times],
+        ignore_conflicts=True,
+    )
+
+
+def slots_with_status(queryset, user=None):
+    """
+    Thêm cờ is_booked (đã có booking) và is_held (đang được giữ chỗ, trừ chỗ
+    do chính `user` giữ) cho các slot
+    """
+    from .models import Booking, SlotHold
+
+    holds = SlotHold.objects.filter(slot=OuterRef('pk'), expires_at__gt=timezone.now())
+    if user is not None and user.is_authenticated:
+        holds = holds.exclude(user=user)
+    return queryset.annotate(
+        is_booked=Exists(Booking.objects.filter(slot=OuterRef('pk'))),
+        is_held=Exists(holds),
+    )
+
+
+def get_day_slots(court, date=None, user=None):
+    """Các slot của sân trong ngày (kèm is_booked/is_held), tạo theo mẫu nếu chưa có"""
+    from .models import CourtSlot
+
+    date = date or get_slot_date(court)
+    slots = list(slots_with_status(CourtSlot.objects.filter(court=court, date=date), user))
+    if not slots and court_slot_times(court):
+        sync_court_slots(court, date)
+        slots = list(slots_with_status(CourtSlot.objects.filter(court=court, date=date), user))
+    return slots
+
+
+def attach_available_slots(bookings):
+    """
+    Gắn booking.available_slots (các slot cùng sân, cùng ngày với slot đang
+    đặt, kèm is_booked/is_held) cho danh sách booking bằng một truy vấn
+    """
+    from .models import CourtSlot
+
+    bookings = list(bookings)
+    days = {
+        (booking.tennis_court_id, booking.slot.date if booking.slot else get_slot_date(booking.tennis_court))
+        for booking in bookings
+    }
+    slots = {}
+    if days:
+        queryset = CourtSlot.objects.filter(
+            court_id__in={court_id for court_id, _ in days},
+            date__in={date for _, date in days},
+        )
+        for slot in slots_with_status(queryset):
+            slots.setdefault((slot.court_id, slot.date), []).append(slot)
+    for booking in bookings:
+        date = booking.slot.date if booking.slot else get_slot_date(booking.tennis_court)
+        booking.available_slots = slots.get((booking.tennis_court_id, date), [])
+    return bookings
+
+
+def booking_end(booking):
+    """Thời điểm kết thúc (datetime, theo TIME_ZONE) của booking, None nếu không xác định được"""
+    if booking.slot:
+        date, end = booking.slot.date, booking.slot.end_time
+    else:
+        times = parse_play_time(booking.play_time)
+        if not times or not booking.tennis_court.dateTime:
+            return None
+        date, end = booking.tennis_court.dateTime, times[1]
+    return timezone.make_aware(datetime.combine(date, end), timezone.get_current_timezone())
@@ -0,0 +1,204 @@
+"""
+Dựng DailyStats cho một khoảng ngày bất kỳ.
+
+Mỗi bảng nguồn chỉ được quét một lần cho cả khoảng, bằng một GROUP BY theo
+ngày:
+- UserActivity (kể cả phần đã archive): total_visits (tổng weight của
+  page_view) và unique_visitors (số IP khác nhau; lấy từ sketch
+  HyperLogLog của home.visitor_sketches khi ngày đó đã có sketch)
+- CustomUser: new_registrations
+- Booking: total_bookings
+- Invoice (Paid): total_revenue
+
+Kết quả được upsert theo date nên chạy lại bao nhiêu lần cũng cho cùng kết
+quả. update_daily_stats() chạy tiếp từ mốc 'daily_stats' (ProcessingWatermark);
+backfill_daily_stats() chia khoảng dài thành các đoạn, tính song song (chỉ
+đọc) rồi ghi tất cả từ thread gọi, nên SQLite không gặp "database is locked".
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .visitor_sketches import load_sketches
+
+
+WATERMARK_NAME = 'daily_stats'
+STATS_FIELDS = ['total_visits', 'unique_visitors', 'new_registrations', 'total_bookings', 'total_revenue']
+
+
+def day_start(day):
+    """Thời điểm bắt đầu ngày day theo TIME_ZONE"""
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def _grouped(queryset, time_field, aggregate):
+    rows = queryset.annotate(day=TruncDate(time_field)).values('day').annotate(total=aggregate)
+    return {row['day']: row['total'] or 0 for row in rows}
+
+
+def _activity_totals(start, end, exact_visitors=True):
+    """
+    {ngày: (tổng weight page_view, số IP khác nhau)} từ archive và bảng UserActivity
+
+    exact_visitors=False bỏ phần COUNT(DISTINCT ip_address) (số IP = 0) khi
+    đã có sketch HyperLogLog cho mọi ngày.
+    """
+    from .activity_archive import iter_archived_activities
+    from .models import UserActivity
+
+    # Phần đã archive: đọc tuần tự các segment của những tháng liên quan
+    archived_visits = {}
+    archived_ips = {}
+    for row in iter_archived_activities(start, end):
+        day = timezone.localtime(row['created_at']).date()
+        if row['activity_type'] == 'page_view':
+            archived_visits[day] = archived_visits.get(day, 0) + row['weight']
+        archived_ips.setdefault(day, set()).add(row['ip_address'])
+
+    activities = UserActivity.objects.filter(created_at__gte=start, created_at__lt=end)
+    aggregates = {'visits': Sum('weight', filter=Q(activity_type='page_view'))}
+    if exact_visitors:
+        aggregates['visitors'] = Count('ip_address', distinct=True)
+    totals = {
+        row['day']: (row['visits'] or 0, row.get('visitors', 0))
+        for row in activities.annotate(day=TruncDate('created_at')).values('day').annotate(**aggregates)
+    }
+    if not exact_visitors:
+        for day, visits in archived_visits.items():
+            totals[day] = (totals.get(day, (0, 0))[0] + visits, 0)
+        return totals
+    if not archived_ips:
+        return totals
+
+    # Ngày nằm ở ranh giới archive: gộp tập IP của hai phần để không đếm trùng
+    hot_ips = {}
+    for day, ip_address in activities.annotate(day=TruncDate('created_at')).filter(
+        day__in=list(archived_ips)
+    ).values_list('day', 'ip_address').distinct():
+        hot_ips.setdefault(day, set()).add(ip_address)
+
+    for day, ips in archived_ips.items():
+        visits, _ = totals.get(day, (0, 0))
+        ips = (ips | hot_ips.get(day, set())) - {None}
+        totals[day] = (visits + archived_visits.get(day, 0), len(ips))
+    return totals
+
+
+def compute_daily_stats(start_date, end_date):
+    """List DailyStats (chưa ghi) cho các ngày trong [start_date, end_date), chỉ đọc DB"""
+    from .models import Booking, CustomUser, DailyStats, Invoice
+
+    if end_date <= start_date:
+        return []
+    start, end = day_start(start_date), day_start(end_date)
+
+    # Số khách khác nhau lấy từ sketch HyperLogLog; chỉ đếm chính xác
+    # (COUNT DISTINCT) khi có ngày chưa có sketch, vd: dữ liệu cũ
+    sketches = load_sketches(start_date, end_date)
+    activity = _activity_totals(start, end, exact_visitors=len(sketches) < (end_date - start_date).days)
+    registrations = _grouped(
+        CustomUser.objects.filter(date_joined__gte=start, date_joined__lt=end), 'date_joined', Count('pk')
+    )
+    bookings = _grouped(
+        Booking.objects.filter(created_at__gte=start, created_at__lt=end), 'created_at', Count('id')
+    )
+    revenue = _grouped(
+        Invoice.objects.filter(status='Paid', created_at__gte=start, created_at__lt=end), 'created_at', Sum('amount')
+    )
+
+    rows = []
+    day = start_date
+    while day < end_date:
+        visits, visitors = activity.get(day, (0, 0))
+        if day in sketches:
+            visitors = sketches[day].count()
+        rows.append(DailyStats(
+            date=day,
+            total_visits=round(visits),
+            unique_visitors=visitors,
+            new_registrations=registrations.get(day, 0),
+            total_bookings=bookings.get(day, 0),
+            total_revenue=revenue.get(day, 0),
+        ))
+        day += timedelta(days=1)
+    return rows
+
+
+def _write_daily_stats(rows):
+    from .models import DailyStats
+
+    DailyStats.objects.bulk_create(
+        rows, batch_size=500,
+        update_conflicts=True, unique_fields=['date'], update_fields=STATS_FIELDS,
+    )
+    return len(rows)
+
+
+def build_daily_stats(start_date, end_date):
+    """
+    Tính và ghi DailyStats cho các ngày trong [start_date, end_date)
+
+    Returns:
+        Số ngày đã ghi
+    """
+    return _write_daily_stats(compute_daily_stats(start_date, end_date))
+
+
+def update_daily_stats():
+    """
+    Dựng DailyStats từ mốc đã xử lý tới hôm nay, rồi dời mốc về đầu hôm nay
+
+    Ngày hôm nay chưa kết thúc nên luôn được tính lại ở lần chạy sau; nếu
+    job bị gián đoạn vài ngày, lần chạy kế tiếp tự bù các ngày còn thiếu.
+
+    Returns:
+        DailyStats của hôm nay
+    """
+    from .models import DailyStats, ProcessingWatermark
+
+    today = timezone.localdate()
+    position = ProcessingWatermark.get(WATERMARK_NAME)
+    start_date = min(timezone.localtime(position).date(), today) if position else today
+
+    build_daily_stats(start_date, today + timedelta(days=1))
+    ProcessingWatermark.advance(WATERMARK_NAME, day_start(today))
+    return DailyStats.objects.get(date=today)
+
+
+def _compute_chunk(start_date, end_date):
+    try:
+        return compute_daily_stats(start_date, end_date)
+    finally:
+        # Mỗi thread có kết nối DB riêng, đóng lại khi xong đoạn của mình
+        connection.close()
+
+
+def backfill_daily_stats(start_date, end_date, chunk_days=31, workers=4):
+    """
+    Dựng DailyStats cho một khoảng dài (vd: cả năm) theo từng đoạn chunk_days
+    ngày, chạy song song trên `workers` thread
+
+    Các thread chỉ đọc; kết quả được ghi bằng một lệnh upsert từ thread gọi
+    sau khi mọi đoạn đã tính xong (SQLite chỉ cho một writer). Chạy lại sau
+    khi bị ngắt là an toàn.
+
+    Returns:
+        Số ngày đã ghi
+    """
+    chunks = []
+    day = start_date
+    while day < end_date:
+        chunk_end = min(day + timedelta(days=chunk_days), end_date)
+        chunks.append((day, chunk_end))
+        day = chunk_end
+
+    if workers <= 1 or len(chunks) <= 1:
+        return sum(build_daily_stats(start, end) for start, end in chunks)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda chunk: _compute_chunk(*chunk), chunks))
+    return _write_daily_stats([row for rows in results for row in rows])
@@ -0,0 +1,160 @@
+"""
+Dữ liệu cho trang thống kê admin (analytics_dashboard).
+
+Toàn bộ số liệu được gom bằng các truy vấn gộp (aggregate/GROUP BY) nên số
+truy vấn không phụ thuộc lượng dữ liệu, và được cache theo từng giá trị
+`days` trong DASHBOARD_CACHE_TTL giây:
+- Chống dồn request (stampede): khi hết hạn, chỉ request giành được khoá
+  (cache.add) dựng lại dữ liệu; các request khác dùng tạm bản cũ, hoặc chờ
+  ngắn nếu chưa có bản nào.
+- Huỷ cache: invalidate_dashboard() tăng số phiên bản trong key, mọi giá trị
+  `days` cùng hết hiệu lực. Được gọi tự động khi CustomUser/Tennis/Booking
+  thay đổi (connect_invalidation_signals).
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+VERSION_KEY = 'dashboard:version'
+CHART_DAYS = 7
+
+
+def get_cache_ttl():
+    return getattr(settings, 'DASHBOARD_CACHE_TTL', 60)
+
+
+def get_dashboard_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY) or 1
+    return version
+
+
+def invalidate_dashboard():
+    """Làm mọi bản cache của dashboard hết hiệu lực"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 2, None)
+
+
+def _chart(counts, today):
+    return [
+        {'date': (today - timedelta(days=i)).strftime('%d/%m'), 'count': counts.get(today - timedelta(days=i), 0)}
+        for i in range(CHART_DAYS - 1, -1, -1)
+    ]
+
+
+def build_dashboard_data(days):
+    """Dựng dữ liệu dashboard (không qua cache)"""
+    from .activity_tracker import get_analytics_data
+    from .leaderboard import get_top_users
+    from .models import CustomUser, Tennis
+    from .rollups import get_rollup_series
+
+    analytics_data = get_analytics_data(days)
+    analytics_data['top_pages'] = list(analytics_data['top_pages'])
+
+    users = CustomUser.objects.aggregate(
+        total=Count('pk'),
+        admins=Count('pk', filter=Q(role='admin')),
+        regular=Count('pk', filter=Q(role='user')),
+    )
+    courts = Tennis.objects.aggregate(
+        total=Count('id'),
+        available=Count('id', filter=Q(status='Available')),
+        repairing=Count('id', filter=Q(status='Repairing')),
+    )
+
+    # Biểu đồ 7 ngày gần nhất: đặt sân đọc từ bảng gộp, đăng ký bằng một GROUP BY
+    today = timezone.localdate()
+    chart_start = timezone.now() - timedelta(days=CHART_DAYS - 1)
+    booking_counts = {
+        timezone.localtime(item['bucket']).date(): item['count']
+        for item in get_rollup_series('day', 'activity_type', chart_start, value='booking')
+    }
+    register_counts = {
+        row['date']: row['count']
+        for row in CustomUser.objects.filter(
+            date_joined__date__gte=today - timedelta(days=CHART_DAYS - 1)
+        ).annotate(date=TruncDate('date_joined')).values('date').annotate(count=Count('pk'))
+    }
+
+    # Bảng xếp hạng theo đúng khoảng `days` đang chọn, đọc từ bộ đếm theo ngày
+    top_active_users = get_top_users(days, limit=10)
+
+    return {
+        'analytics_data': analytics_data,
+        'total_users': users['total'],
+        'total_admins': users['admins'],
+        'total_regular_users': users['regular'],
+        'total_courts': courts['total'],
+        'available_courts': courts['available'],
+        'repairing_courts': courts['repairing'],
+        'booking_chart_data': _chart(booking_counts, today),
+        'register_chart_data': _chart(register_counts, today),
+        'top_active_users': top_active_users,
+        'days': days,
+    }
+
+
+def get_dashboard_data(days, wait_timeout=5.0, poll_interval=0.05):
+    """
+    Dữ liệu dashboard cho `days` ngày, lấy từ cache nếu còn hạn
+
+    Giá trị được lưu kèm hạn mềm (soft expiry) và giữ trong cache gấp đôi
+    TTL, để khi hết hạn mềm vẫn còn bản cũ phục vụ trong lúc một request
+    dựng lại.
+    """
+    ttl = get_cache_ttl()
+    if ttl <= 0:
+        return build_dashboard_data(days)
+
+    version = get_dashboard_version()
+    key = f'dashboard:v{version}:{days}'
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + wait_timeout
+
+    while True:
+        cached = cache.get(key)
+        if cached is not None and cached['expires_at'] > time.time():
+            return cached['data']
+
+        if cache.add(lock_key, 1, max(int(wait_timeout), 1)):
+            try:
+                data = build_dashboard_data(days)
+                cache.set(key, {'data': data, 'expires_at': time.time() + ttl}, ttl * 2)
+                return data
+            finally:
+                cache.delete(lock_key)
+
+        # Một request khác đang dựng lại: dùng bản cũ nếu có, không thì chờ
+        if cached is not None:
+            return cached['data']
+        if time.monotonic() >= deadline:
+            return build_dashboard_data(days)
+        time.sleep(poll_interval)
+
+
+def _invalidate_on_change(sender, update_fields=None, **kwargs):
+    # Bỏ qua các lần lưu chỉ cập nhật last_login (mỗi lần đăng nhập)
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_dashboard()
+
+
+def connect_invalidation_signals():
+    """Huỷ cache dashboard khi user, sân hoặc booking thay đổi"""
+    from django.db.models.signals import post_delete, post_save
+    from .models import Booking, CustomUser, Tennis
+
+    for model in (CustomUser, Tennis, Booking):
+        post_save.connect(_invalidate_on_change, sender=model, dispatch_uid=f'dashboard_{model.__name__}_save')
+        post_delete.connect(_invalidate_on_change, sender=model, dispatch_uid=f'dashboard_{model.__name__}_delete')
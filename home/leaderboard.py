@@ -0,0 +1,195 @@
+"""
+Bảng xếp hạng user hoạt động nhiều nhất.
+
+Mỗi hoạt động của user được cộng vào bộ đếm (user, ngày) UserDailyActivity
+qua một CoalescingCounter (mỗi cặp một lệnh upsert mỗi USER_STATS_FLUSH_SECONDS
+giây). Top N của `days` ngày gần nhất là một GROUP BY trên các dòng theo ngày
+của khoảng đó (tối đa số user x số ngày, không phụ thuộc lượng UserActivity);
+top N mọi thời điểm đọc thẳng index UserStats.total_activities. Kết quả được
+cache LEADERBOARD_CACHE_TTL giây.
+
+rebuild_user_days() dựng lại bộ đếm theo ngày từ dữ liệu gốc (lệnh
+rebuild_leaderboard).
+"""
+import threading
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import CoalescingCounter
+from .rollups import UPSERT_VENDORS
+
+
+def get_cache_ttl():
+    return getattr(settings, 'LEADERBOARD_CACHE_TTL', 60)
+
+
+def _existing_user_ids(user_ids):
+    from .models import CustomUser
+
+    return set(CustomUser.objects.filter(pk__in=list(user_ids)).values_list('pk', flat=True))
+
+
+def _upsert_user_days(pending):
+    """Cộng các lượt đang chờ vào UserDailyActivity bằng một lệnh upsert (executemany)"""
+    from .models import UserDailyActivity
+
+    # User đã bị xoá trong lúc chờ: bỏ phần của họ (khoá ngoại)
+    users = _existing_user_ids({user_id for user_id, _ in pending})
+    pending = {key: value for key, value in pending.items() if key[0] in users}
+    if not pending:
+        return
+
+    if connection.vendor not in UPSERT_VENDORS:
+        with transaction.atomic():
+            for (user_id, date), (count, _) in pending.items():
+                if not UserDailyActivity.objects.filter(user_id=user_id, date=date).update(
+                    count=F('count') + count, updated_at=timezone.now()
+                ):
+                    UserDailyActivity.objects.create(user_id=user_id, date=date, count=count)
+        return
+
+    meta = UserDailyActivity._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = ['user', 'date', 'count', 'updated_at']
+    fields = {name: meta.get_field(name) for name in columns}
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(fields[c].column) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({qn(fields['user'].column)}, {qn('date')}) DO UPDATE SET "
+        f"{qn('count')} = {table}.{qn('count')} + excluded.{qn('count')}, "
+        f"{qn('updated_at')} = excluded.{qn('updated_at')}"
+    )
+
+    now = timezone.now()
+    params = []
+    for (user_id, date), (count, _) in pending.items():
+        values = {'user': user_id, 'date': date, 'count': count, 'updated_at': now}
+        params.append([fields[c].get_db_prep_value(values[c], connection) for c in columns])
+
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_user_day_counter():
+    """Bộ đếm gộp (user, ngày) dùng chung của process"""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = CoalescingCounter(
+                    apply=_upsert_user_days,
+                    flush_interval=getattr(settings, 'USER_STATS_FLUSH_SECONDS', 5),
+                    max_pending=getattr(settings, 'USER_STATS_MAX_PENDING', 1000),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_counter.flush_if_due)
+                register_shutdown_flusher(_counter.flush)
+    return _counter
+
+
+def record_user_day(user_id, timestamp, count=1):
+    """Cộng count (weight) vào bộ đếm của user trong ngày chứa timestamp"""
+    if not user_id:
+        return
+    get_user_day_counter().add((user_id, timezone.localtime(timestamp).date()), count)
+
+
+def _ranking(rows, limit):
+    return [
+        {'user__username': username, 'user__userID': user_id, 'activity_count': round(count)}
+        for username, user_id, count in rows[:limit]
+    ]
+
+
+def build_top_users(days=None, limit=10):
+    """Top `limit` user theo số hoạt động trong `days` ngày gần nhất (None: mọi thời điểm), không qua cache"""
+    from .models import UserDailyActivity, UserStats
+
+    if days is None:
+        rows = UserStats.objects.filter(total_activities__gt=0).order_by('-total_activities').values_list(
+            'user__username', 'user__userID', 'total_activities'
+        )
+        return _ranking(rows, limit)
+
+    start_date = timezone.localdate() - timedelta(days=max(days, 1) - 1)
+    rows = UserDailyActivity.objects.filter(date__gte=start_date).values_list(
+        'user__username', 'user__userID'
+    ).annotate(total=Sum('count')).order_by('-total')
+    return _ranking(rows, limit)
+
+
+def get_top_users(days=None, limit=10):
+    """
+    Bảng xếp hạng user hoạt động nhiều nhất (có cache)
+
+    Args:
+        days: Số ngày gần nhất (tính cả hôm nay); None cho mọi thời điểm
+        limit: Số user
+
+    Returns:
+        List dict user__username, user__userID, activity_count
+    """
+    ttl = get_cache_ttl()
+    if ttl <= 0:
+        return build_top_users(days, limit)
+
+    key = f"leaderboard:{timezone.localdate()}:{days or 'all'}:{limit}"
+    ranking = cache.get(key)
+    if ranking is None:
+        ranking = build_top_users(days, limit)
+        cache.set(key, ranking, ttl)
+    return ranking
+
+
+def rebuild_user_days(start_date, end_date):
+    """
+    Dựng lại UserDailyActivity cho các ngày trong [start_date, end_date) từ
+    UserActivity và phần đã archive
+
+    Returns:
+        Số dòng đã ghi
+    """
+    from .activity_archive import iter_archived_activities
+    from .models import UserActivity, UserDailyActivity
+
+    get_user_day_counter().flush()
+
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date, time.min), tz)
+
+    totals = {}
+    for row in iter_archived_activities(start, end):
+        if row['user_id']:
+            key = (row['user_id'], timezone.localtime(row['created_at']).date())
+            totals[key] = totals.get(key, 0) + row['weight']
+
+    for row in UserActivity.objects.filter(
+        user__isnull=False, created_at__gte=start, created_at__lt=end
+    ).annotate(date=TruncDate('created_at')).values('user_id', 'date').annotate(
+        total=Sum('weight')
+    ).order_by():
+        key = (row['user_id'], row['date'])
+        totals[key] = totals.get(key, 0) + (row['total'] or 0)
+
+    users = _existing_user_ids({user_id for user_id, _ in totals})
+    rows = [
+        UserDailyActivity(user_id=user_id, date=date, count=count)
+        for (user_id, date), count in totals.items() if user_id in users
+    ]
+    with transaction.atomic():
+        UserDailyActivity.objects.filter(date__gte=start_date, date__lt=end_date).delete()
+        UserDailyActivity.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
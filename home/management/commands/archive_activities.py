@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.activity_archive import archive_activities, get_archive_dir, get_retention_days
+
+
+class Command(BaseCommand):
+    help = 'Chuyển UserActivity cũ sang file archive NDJSON nén (gzip)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Số ngày dữ liệu được giữ lại trong bảng (mặc định ACTIVITY_RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Số dòng mỗi lô')
+        parser.add_argument('--loop', action='store_true',
+                            help='Chạy định kỳ thay vì chạy một lần')
+        parser.add_argument('--interval', type=int, default=3600,
+                            help='Số giây giữa hai lần chạy khi dùng --loop')
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else get_retention_days()
+        while True:
+            archived = archive_activities(older_than_days=days, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Đã archive {archived} hoạt động cũ hơn {days} ngày vào {get_archive_dir()}'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from home.daily_stats import backfill_daily_stats, update_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Dựng DailyStats: chạy tiếp từ mốc đã xử lý, hoặc backfill một khoảng ngày'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=str, default=None,
+                            help='Backfill từ ngày (YYYY-MM-DD)')
+        parser.add_argument('--end', type=str, default=None,
+                            help='Backfill tới ngày, không bao gồm (YYYY-MM-DD, mặc định ngày mai)')
+        parser.add_argument('--days', type=int, default=None,
+                            help='Backfill N ngày gần nhất, thay cho --start')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Số thread khi backfill')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Số ngày mỗi đoạn khi backfill')
+        parser.add_argument('--loop', action='store_true',
+                            help='Chạy định kỳ (chỉ với chế độ chạy tiếp)')
+        parser.add_argument('--interval', type=int, default=300,
+                            help='Số giây giữa hai lần chạy khi dùng --loop')
+
+    def handle(self, *args, **options):
+        if options['start'] or options['days']:
+            self.backfill(options)
+            return
+
+        while True:
+            stats = update_daily_stats()
+            self.stdout.write(self.style.SUCCESS(
+                f'Đã cập nhật DailyStats tới {stats.date}: {stats.total_visits} lượt xem, '
+                f'{stats.total_bookings} đặt sân'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def backfill(self, options):
+        end = parse_date(options['end']) if options['end'] else timezone.localdate() + timedelta(days=1)
+        start = parse_date(options['start']) if options['start'] else end - timedelta(days=options['days'])
+        if start is None or end is None or start >= end:
+            raise CommandError('Khoảng ngày không hợp lệ')
+
+        written = backfill_daily_stats(start, end, chunk_days=options['chunk_days'], workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng DailyStats cho {written} ngày ({start} -> {end})'))
@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from home.activity_export import EXPORT_FORMATS, EXPORT_KINDS, iter_export_rows, parse_date_range, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Xuất UserActivity/VisitorSession ra CSV hoặc NDJSON (đọc theo lô, bộ nhớ không đổi)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(EXPORT_KINDS), default='activities')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', type=str, default=None, help='Từ ngày (YYYY-MM-DD)')
+        parser.add_argument('--end', type=str, default=None, help='Tới ngày, bao gồm (YYYY-MM-DD)')
+        parser.add_argument('--type', dest='activity_type', default=None, help='Loại hoạt động')
+        parser.add_argument('--user', default=None, help='userID')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Số dòng mỗi lô')
+        parser.add_argument('--output', '-o', default=None, help='File đích (mặc định stdout)')
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options['start']) if options['start'] else None
+        end_date = parse_date(options['end']) if options['end'] else None
+        if (options['start'] and start_date is None) or (options['end'] and end_date is None):
+            raise CommandError('Ngày không hợp lệ, dùng định dạng YYYY-MM-DD')
+        start, end = parse_date_range(start_date, end_date)
+
+        rows = iter_export_rows(
+            options['kind'], start, end,
+            activity_type=options['activity_type'],
+            user_id=options['user'],
+            chunk_size=options['chunk_size'],
+        )
+        lines = stream_export(rows, EXPORT_KINDS[options['kind']], options['format'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                for line in lines:
+                    f.write(line)
+        else:
+            for line in lines:
+                sys.stdout.write(line)
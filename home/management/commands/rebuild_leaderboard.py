@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from home.leaderboard import rebuild_user_days
+from home.user_stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bộ đếm hoạt động theo user/ngày (và UserStats) cho bảng xếp hạng'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help='Số ngày gần nhất cần dựng lại (mặc định: 90, tính cả hôm nay)')
+        parser.add_argument('--start', type=str, default=None,
+                            help='Ngày bắt đầu (YYYY-MM-DD), thay cho --days')
+        parser.add_argument('--end', type=str, default=None,
+                            help='Ngày kết thúc, không bao gồm (YYYY-MM-DD, mặc định ngày mai)')
+        parser.add_argument('--skip-user-stats', action='store_true',
+                            help='Không dựng lại UserStats (bảng xếp hạng mọi thời điểm)')
+
+    def handle(self, *args, **options):
+        end = parse_date(options['end']) if options['end'] else timezone.localdate() + timedelta(days=1)
+        start = parse_date(options['start']) if options['start'] else end - timedelta(days=options['days'])
+
+        written = rebuild_user_days(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng lại {written} dòng hoạt động theo ngày cho {start} -> {end}'))
+        if not options['skip_user_stats']:
+            users = rebuild_user_stats()
+            self.stdout.write(self.style.SUCCESS(f'Đã dựng lại thống kê cho {users} user'))
@@ -0,0 +1,38 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from home.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng thống kê gộp ActivityRollup từ UserActivity/VisitorSession'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help='Số ngày đã kết thúc gần nhất cần dựng lại (mặc định: hôm qua)')
+        parser.add_argument('--start', type=str, default=None,
+                            help='Ngày bắt đầu (YYYY-MM-DD), thay cho --days')
+        parser.add_argument('--end', type=str, default=None,
+                            help='Ngày kết thúc, không bao gồm (YYYY-MM-DD, mặc định hôm nay)')
+
+    def handle(self, *args, **options):
+        try:
+            end = parse_date(options['end']) if options['end'] else timezone.localdate()
+            start = parse_date(options['start']) if options['start'] else end and end - timedelta(days=options['days'])
+        except ValueError:
+            # Đúng định dạng nhưng không phải ngày có thật, vd: 2026-02-30
+            start = end = None
+        if start is None or end is None or start >= end:
+            raise CommandError('Khoảng ngày không hợp lệ')
+
+        tz = timezone.get_current_timezone()
+        written = rebuild_rollups(
+            timezone.make_aware(datetime.combine(start, time.min), tz),
+            timezone.make_aware(datetime.combine(end, time.min), tz),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã dựng lại {written} dòng thống kê gộp cho {start} -> {end}'
+        ))
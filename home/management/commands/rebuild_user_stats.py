@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from home.user_stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại bảng thống kê theo user UserStats từ UserActivity/Invoice'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', default=None,
+                            help='userID cần dựng lại (có thể lặp lại; mặc định: mọi user)')
+
+    def handle(self, *args, **options):
+        written = rebuild_user_stats(options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng lại thống kê cho {written} user'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.reservations import get_sweep_interval, sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Xoá các giữ chỗ slot (SlotHold) đã hết hạn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Chạy định kỳ thay vì chạy một lần')
+        parser.add_argument('--interval', type=int, default=None,
+                            help='Số giây giữa hai lần chạy khi dùng --loop (mặc định SLOT_HOLD_SWEEP_SECONDS)')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] if options['interval'] is not None else get_sweep_interval()
+        while True:
+            released = sweep_expired_holds()
+            self.stdout.write(self.style.SUCCESS(f'Đã xoá {released} giữ chỗ hết hạn'))
+            if not options['loop']:
+                break
+            time.sleep(max(interval, 1))
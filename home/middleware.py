@@ -1,9 +1,19 @@
 """
 Middleware để theo dõi hoạt động người dùng và lượt truy cập trang
 """
+import random
+import re
+import uuid
+
+from django.conf import settings
 from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
-import re
+from .route_classifier import POLICY_ALWAYS, get_route_classifier
+from .user_agent import parse_user_agent
+
+
+VISITOR_ID_SALT = 'home.middleware.visitor_id'
+VISITOR_ID_RE = re.compile(r'^[0-9a-f]{32}$')
 
 
 class ActivityTrackingMiddleware(MiddlewareMixin):
@@ -12,64 +22,27 @@ class ActivityTrackingMiddleware(MiddlewareMixin):
     - Lượt xem trang
     - Phiên truy cập
     - Hoạt động người dùng
-    """
     
-    # Các URL pattern không cần theo dõi
-    EXCLUDED_PATHS = [
-        r'^/static/',
-        r'^/media/',
-        r'^/admin/jsi18n/',
-        r'^/favicon\.ico$',
-        r'\.css$',
-        r'\.js$',
-        r'\.png$',
-        r'\.jpg$',
-        r'\.jpeg$',
-        r'\.gif$',
-        r'\.ico$',
-        r'\.woff',
-        r'\.ttf',
-        r'\.svg$',
-    ]
+    Khách được nhận diện bằng cookie mã khách đã ký (ACTIVITY_VISITOR_COOKIE_NAME),
+    dùng làm session_key của VisitorSession. Session DB của Django chỉ được tạo
+    khi ứng dụng thật sự lưu dữ liệu vào session (đăng nhập, temp_booking...),
+    nên lượt xem của khách vãng lai không ghi gì vào bảng session.
+    """
     
-    # Mapping URL patterns to page names
-    PAGE_NAMES = {
-        r'^/$': 'Trang chủ',
-        r'^/home/?$': 'Trang chủ',
-        r'^/about/?$': 'Giới thiệu',
-        r'^/contact/?$': 'Liên hệ',
-        r'^/auth/?$': 'Đăng nhập/Đăng ký User',
-        r'^/auth_admin/?$': 'Đăng nhập/Đăng ký Admin',
-        r'^/hire/?$': 'Danh sách sân tennis',
-        r'^/detail/\d+/?$': 'Chi tiết sân',
-        r'^/checkout/\d+/?$': 'Thanh toán',
-        r'^/booking-success/?$': 'Đặt sân thành công',
-        r'^/my-bookings/?$': 'Đặt chỗ của tôi',
-        r'^/all-bookings/?$': 'Tất cả đặt chỗ',
-        r'^/top-up/?$': 'Nạp tiền',
-        r'^/transaction-history/?$': 'Lịch sử giao dịch',
-        r'^/user-profile/?$': 'Hồ sơ người dùng',
-        r'^/review/\d+/?$': 'Đánh giá sân',
-        r'^/report/\d+/?$': 'Báo cáo sân',
-        r'^/add-tennis/?$': 'Thêm sân mới',
-        r'^/manage-users/?$': 'Quản lý người dùng',
-        r'^/admin-reports/?$': 'Báo cáo admin',
-        r'^/analytics/?$': 'Thống kê hoạt động',
-    }
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # Danh sách loại trừ và tên trang được khai báo trong settings
+        # (ACTIVITY_TRACKING_EXCLUDED_*, ACTIVITY_TRACKING_PAGE_NAMES...)
+        # và được dựng sẵn thành RouteClassifier khi khởi động
+        get_route_classifier()
     
     def should_track(self, path):
         """Kiểm tra xem path có cần được theo dõi không"""
-        for pattern in self.EXCLUDED_PATHS:
-            if re.search(pattern, path, re.IGNORECASE):
-                return False
-        return True
+        return get_route_classifier().classify(path).tracked
     
     def get_page_name(self, path):
         """Lấy tên trang từ URL"""
-        for pattern, name in self.PAGE_NAMES.items():
-            if re.match(pattern, path, re.IGNORECASE):
-                return name
-        return path
+        return get_route_classifier().classify(path).page_name
     
     def get_client_ip(self, request):
         """Lấy địa chỉ IP của client"""
@@ -80,123 +53,110 @@ class ActivityTrackingMiddleware(MiddlewareMixin):
             ip = request.META.get('REMOTE_ADDR')
         return ip
     
+    def read_visitor_id(self, request):
+        """Mã khách từ cookie đã ký, None nếu chưa có hoặc sai chữ ký"""
+        visitor_id = request.get_signed_cookie(
+            getattr(settings, 'ACTIVITY_VISITOR_COOKIE_NAME', 'vid'), default=None, salt=VISITOR_ID_SALT
+        )
+        if visitor_id is None or not VISITOR_ID_RE.match(visitor_id):
+            return None
+        return visitor_id
+    
+    def get_visitor_id(self, request):
+        """Mã khách từ cookie đã ký; tạo mã mới (gửi cookie ở response) nếu chưa có hoặc sai chữ ký"""
+        visitor_id = self.read_visitor_id(request)
+        if visitor_id is None:
+            visitor_id = uuid.uuid4().hex
+            request.new_visitor_id = visitor_id
+        return visitor_id
+    
     def get_device_info(self, user_agent):
         """Phân tích thông tin thiết bị từ User-Agent"""
-        user_agent_lower = user_agent.lower() if user_agent else ''
-        
-        # Detect device type
-        if 'mobile' in user_agent_lower or 'android' in user_agent_lower:
-            if 'tablet' in user_agent_lower or 'ipad' in user_agent_lower:
-                device_type = 'tablet'
-            else:
-                device_type = 'mobile'
-        elif 'tablet' in user_agent_lower or 'ipad' in user_agent_lower:
-            device_type = 'tablet'
-        else:
-            device_type = 'desktop'
-        
-        # Detect browser
-        if 'chrome' in user_agent_lower and 'edg' not in user_agent_lower:
-            browser = 'Chrome'
-        elif 'firefox' in user_agent_lower:
-            browser = 'Firefox'
-        elif 'safari' in user_agent_lower and 'chrome' not in user_agent_lower:
-            browser = 'Safari'
-        elif 'edg' in user_agent_lower:
-            browser = 'Edge'
-        elif 'opera' in user_agent_lower or 'opr' in user_agent_lower:
-            browser = 'Opera'
-        else:
-            browser = 'Other'
-        
-        # Detect OS
-        if 'windows' in user_agent_lower:
-            os_name = 'Windows'
-        elif 'mac os' in user_agent_lower or 'macintosh' in user_agent_lower:
-            os_name = 'macOS'
-        elif 'linux' in user_agent_lower:
-            os_name = 'Linux'
-        elif 'android' in user_agent_lower:
-            os_name = 'Android'
-        elif 'iphone' in user_agent_lower or 'ipad' in user_agent_lower:
-            os_name = 'iOS'
-        else:
-            os_name = 'Other'
-        
-        return device_type, browser, os_name
+        info = parse_user_agent(user_agent)
+        return info.device_type, info.browser, info.os
     
     def process_request(self, request):
         """Xử lý request và ghi lại hoạt động"""
         path = request.path
+        route = get_route_classifier().classify(path)
         
         # Bỏ qua các static files và assets
-        if not self.should_track(path):
+        if not route.tracked:
             return None
         
-        # Import models ở đây để tránh circular import
-        from .models import PageView, UserActivity, VisitorSession
+        from .session_tracking import get_session_heartbeat
+        from .tracking_buffer import submit_tracking_event
         
         try:
-            ip_address = self.get_client_ip(request)
             user_agent = request.META.get('HTTP_USER_AGENT', '')
-            referrer = request.META.get('HTTP_REFERER', '')
-            
-            # Lấy hoặc tạo session key
-            if not request.session.session_key:
-                request.session.create()
-            session_key = request.session.session_key
             
-            # Ghi lại lượt xem trang
-            page_name = self.get_page_name(path)
-            PageView.record_view(path, page_name)
+            # Bot/crawler/uptime probe: chỉ cộng vào bộ đếm gộp theo họ bot,
+            # không tạo session, VisitorSession hay lượt xem trang.
+            # Khách đã có session với đúng UA này là người dùng thật, không cần phân tích lại
+            visitor_id = self.read_visitor_id(request)
+            if visitor_id is None or not get_session_heartbeat().knows(visitor_id, user_agent):
+                agent = parse_user_agent(user_agent)
+                if agent.is_bot:
+                    from .rollups import record_rollup
+                    record_rollup('bot', agent.browser, timezone.now())
+                    return None
             
-            # Cập nhật hoặc tạo visitor session
-            device_type, browser, os_name = self.get_device_info(user_agent)
+            ip_address = self.get_client_ip(request)
+            referrer = request.META.get('HTTP_REFERER', '')
             
-            session, created = VisitorSession.objects.get_or_create(
-                session_key=session_key,
-                defaults={
-                    'ip_address': ip_address,
-                    'user_agent': user_agent,
-                    'device_type': device_type,
-                    'browser': browser,
-                    'os': os_name,
-                }
-            )
+            # Mã khách từ cookie đã ký (không tạo session DB)
+            session_key = visitor_id or self.get_visitor_id(request)
             
-            # Cập nhật user nếu đã đăng nhập
-            if request.user.is_authenticated:
-                session.user = request.user
+            page_name = route.page_name
             
-            session.page_views += 1
-            session.last_activity = timezone.now()
-            session.save()
+            # Ghi lại hoạt động xem trang theo chính sách của route
+            # (ACTIVITY_TRACKING_POLICIES): luôn ghi, lấy mẫu, hoặc chỉ đếm
+            weight = 1.0
+            if route.policy == POLICY_ALWAYS:
+                log_activity = True
+            elif isinstance(route.policy, float):
+                log_activity = random.random() < route.policy
+                weight = 1.0 / route.policy
+            else:
+                log_activity = False
             
-            # Ghi lại hoạt động xem trang (chỉ cho các trang quan trọng)
-            important_pages = ['/', '/home', '/hire', '/about', '/contact']
-            if path in important_pages or path.startswith('/detail/'):
-                user = request.user if request.user.is_authenticated else None
-                UserActivity.objects.create(
-                    user=user,
-                    activity_type='page_view',
-                    description=f'Xem trang: {page_name}',
-                    ip_address=ip_address,
-                    user_agent=user_agent,
-                    page_url=request.build_absolute_uri(),
-                    referrer=referrer if referrer else None,
-                    extra_data={
-                        'path': path,
-                        'page_name': page_name,
-                        'device_type': device_type,
-                        'browser': browser,
-                        'os': os_name,
-                    }
-                )
+            # Mọi dữ liệu phụ thuộc request được thu thập ngay tại đây,
+            # phần ghi DB được thực hiện (trực tiếp hoặc trễ) bởi tracking_buffer.
+            # User-Agent chỉ được phân tích khi tạo VisitorSession mới
+            submit_tracking_event({
+                'timestamp': timezone.now(),
+                'path': path,
+                'page_name': page_name,
+                'route_name': route.route_name,
+                'session_key': session_key,
+                'user_id': request.user.pk if request.user.is_authenticated else None,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'referrer': referrer,
+                'page_url': request.build_absolute_uri() if log_activity else None,
+                'log_activity': log_activity,
+                'weight': weight,
+            })
         except Exception as e:
             # Log lỗi nhưng không làm gián đoạn request
             print(f"Activity tracking error: {e}")
         
         return None
+    
+    def process_response(self, request, response):
+        """Gửi cookie mã khách cho khách mới"""
+        visitor_id = getattr(request, 'new_visitor_id', None)
+        if visitor_id:
+            response.set_signed_cookie(
+                getattr(settings, 'ACTIVITY_VISITOR_COOKIE_NAME', 'vid'),
+                visitor_id,
+                salt=VISITOR_ID_SALT,
+                max_age=getattr(settings, 'ACTIVITY_VISITOR_COOKIE_AGE', 365 * 24 * 60 * 60),
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
 
 
 class OnlineUsersMiddleware(MiddlewareMixin):
@@ -205,21 +165,12 @@ class OnlineUsersMiddleware(MiddlewareMixin):
     """
     
     def process_request(self, request):
-        from django.core.cache import cache
-        from .models import CustomUser
-        
-        # Thời gian timeout (5 phút)
-        ONLINE_TIMEOUT = 300
+        from .presence import record_presence
         
         if request.user.is_authenticated:
-            # Lưu user vào cache với timestamp
-            cache_key = f'online_user_{request.user.userID}'
-            cache.set(cache_key, timezone.now(), ONLINE_TIMEOUT)
-            
-            # Cập nhật last_login
-            if hasattr(request.user, 'last_login'):
-                request.user.last_login = timezone.now()
-                request.user.save(update_fields=['last_login'])
+            # Lưu user vào cache; last_login chỉ được ghi xuống DB
+            # khi đã cũ hơn PRESENCE_PERSIST_INTERVAL
+            record_presence(request.user)
         
         return None
 
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:07
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_page_urls(apps, schema_editor):
+    """
+    Gộp các dòng PageView trùng page_url (get_or_create cũ không an toàn khi
+    chạy song song) vào dòng có id nhỏ nhất: cộng view_count, giữ số khách
+    lớn nhất và mốc xem gần nhất
+    """
+    PageView = apps.get_model('home', 'PageView')
+
+    duplicated = PageView.objects.values('page_url').annotate(total=Count('id')).filter(total__gt=1)
+    for page_url in list(duplicated.values_list('page_url', flat=True)):
+        rows = list(PageView.objects.filter(page_url=page_url).order_by('id'))
+        keep, others = rows[0], rows[1:]
+        for row in others:
+            keep.view_count += row.view_count
+            keep.unique_visitors = max(keep.unique_visitors, row.unique_visitors)
+            keep.page_name = keep.page_name or row.page_name
+            if row.last_viewed and (keep.last_viewed is None or row.last_viewed > keep.last_viewed):
+                keep.last_viewed = row.last_viewed
+            if row.created_at and (keep.created_at is None or row.created_at < keep.created_at):
+                keep.created_at = row.created_at
+        PageView.objects.filter(pk__in=[row.pk for row in others]).delete()
+        # update() để last_viewed (auto_now) không bị ghi đè bằng thời điểm migrate
+        PageView.objects.filter(pk=keep.pk).update(
+            view_count=keep.view_count, unique_visitors=keep.unique_visitors, page_name=keep.page_name,
+            last_viewed=keep.last_viewed, created_at=keep.created_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0016_invoice_card_last_four_invoice_payment_method_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_page_urls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='pageview',
+            name='page_url',
+            field=models.CharField(max_length=500, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_pageview_page_url_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useractivity',
+            name='weight',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
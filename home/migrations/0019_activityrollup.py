@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:15
+
+import gzip
+import json
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+
+def _bucket_start(value, granularity):
+    value = timezone.localtime(value)
+    if granularity == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _iter_archived_rows():
+    """
+    (created_at, activity_type, weight) của các hoạt động đã archive
+
+    Bản đóng băng của home.activity_archive.iter_archived_activities tại thời
+    điểm viết migration: đọc thẳng các segment NDJSON, không import code app.
+    """
+    directory = Path(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'activities'))
+    if not directory.exists():
+        return
+    for segment in sorted(directory.glob('*/*.ndjson.gz')):
+        with gzip.open(segment, 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                yield datetime.fromisoformat(row['created_at']), row['activity_type'], row.get('weight', 1.0)
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Dựng ActivityRollup cho toàn bộ lịch sử có sẵn (UserActivity, phần đã
+    archive và VisitorSession) để dashboard/API có số liệu ngay sau khi deploy
+    """
+    UserActivity = apps.get_model('home', 'UserActivity')
+    VisitorSession = apps.get_model('home', 'VisitorSession')
+    ActivityRollup = apps.get_model('home', 'ActivityRollup')
+
+    totals = {}
+
+    def add(granularity, dimension, bucket, value, count):
+        key = (granularity, dimension, bucket, value or 'Unknown')
+        totals[key] = totals.get(key, 0) + (count or 0)
+
+    for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+        for item in UserActivity.objects.annotate(bucket=trunc('created_at')).values(
+            'bucket', 'activity_type'
+        ).annotate(total=Sum('weight')).order_by():
+            add(granularity, 'activity_type', item['bucket'], item['activity_type'], item['total'])
+        for dimension in ('device_type', 'browser'):
+            for item in VisitorSession.objects.annotate(bucket=trunc('started_at')).values(
+                'bucket', dimension
+            ).annotate(total=Count('id')).order_by():
+                add(granularity, dimension, item['bucket'], item[dimension], item['total'])
+
+    for created_at, activity_type, weight in _iter_archived_rows():
+        for granularity in ('hour', 'day'):
+            add(granularity, 'activity_type', _bucket_start(created_at, granularity), activity_type, weight)
+
+    now = timezone.now()
+    ActivityRollup.objects.bulk_create([
+        ActivityRollup(granularity=granularity, dimension=dimension, bucket=bucket, value=value, count=count, updated_at=now)
+        for (granularity, dimension, bucket, value), count in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_useractivity_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Giờ'), ('day', 'Ngày')], max_length=10)),
+                ('dimension', models.CharField(choices=[('activity_type', 'Loại hoạt động'), ('device_type', 'Thiết bị'), ('browser', 'Trình duyệt')], max_length=20)),
+                ('bucket', models.DateTimeField()),
+                ('value', models.CharField(max_length=100)),
+                ('count', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Thống kê gộp',
+                'verbose_name_plural': 'Thống kê gộp',
+                'ordering': ['-bucket'],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'dimension', 'bucket', 'value'), name='unique_activity_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
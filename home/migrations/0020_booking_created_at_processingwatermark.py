@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_booking_created_at(apps, schema_editor):
+    """
+    Booking cũ lấy thời điểm tạo từ hoá đơn đầu tiên của nó; booking không có
+    hoá đơn giữ NULL (không rõ thời điểm, không được tính vào thống kê theo
+    ngày) thay vì thời điểm chạy migration
+    """
+    Booking = apps.get_model('home', 'Booking')
+    Invoice = apps.get_model('home', 'Invoice')
+    first_invoice = Invoice.objects.filter(
+        booking=models.OuterRef('pk')
+    ).order_by('created_at').values('created_at')[:1]
+    Booking.objects.filter(
+        pk__in=Invoice.objects.filter(booking__isnull=False).values('booking_id')
+    ).update(
+        created_at=models.Subquery(first_invoice)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0019_activityrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Mốc xử lý',
+                'verbose_name_plural': 'Mốc xử lý',
+            },
+        ),
+        # Thêm cột không có default để các dòng cũ là NULL, backfill rồi mới đặt default
+        migrations.AddField(
+            model_name='booking',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_booking_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='booking',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+    ]
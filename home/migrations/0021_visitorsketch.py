@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0020_booking_created_at_processingwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('page_url', models.CharField(blank=True, default='', max_length=500)),
+                ('sketch', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sketch khách truy cập',
+                'verbose_name_plural': 'Sketch khách truy cập',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'page_url'), name='unique_visitor_sketch')],
+            },
+        ),
+    ]
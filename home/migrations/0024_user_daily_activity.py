@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_total_activities(apps, schema_editor):
+    """Tổng hoạt động của các dòng UserStats đã có, từ counts"""
+    UserStats = apps.get_model('home', 'UserStats')
+    rows = list(UserStats.objects.all())
+    for stats in rows:
+        stats.total_activities = sum(stats.counts.values())
+    UserStats.objects.bulk_update(rows, ['total_activities'], batch_size=1000)
+
+
+def backfill_user_days(apps, schema_editor):
+    """Bộ đếm (user, ngày) cho bảng xếp hạng, từ UserActivity còn trong bảng"""
+    UserActivity = apps.get_model('home', 'UserActivity')
+    UserDailyActivity = apps.get_model('home', 'UserDailyActivity')
+
+    rows = UserActivity.objects.filter(user__isnull=False).annotate(
+        date=TruncDate('created_at')
+    ).values('user_id', 'date').annotate(total=Sum('weight')).order_by()
+    UserDailyActivity.objects.bulk_create([
+        UserDailyActivity(user_id=row['user_id'], date=row['date'], count=row['total'] or 0)
+        for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0023_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='total_activities',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_total_activities, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='UserDailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Hoạt động người dùng theo ngày',
+                'verbose_name_plural': 'Hoạt động người dùng theo ngày',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='user_daily_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='unique_user_daily_activity')],
+            },
+        ),
+        migrations.RunPython(backfill_user_days, migrations.RunPython.noop),
+    ]
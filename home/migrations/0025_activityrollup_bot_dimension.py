@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0024_user_daily_activity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activityrollup',
+            name='dimension',
+            field=models.CharField(choices=[('activity_type', 'Loại hoạt động'), ('device_type', 'Thiết bị'), ('browser', 'Trình duyệt'), ('bot', 'Bot')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+import re
+from datetime import time
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+PLAY_TIME_RE = re.compile(r'^\s*(\d{1,2})(?::(\d{2}))?\s*(?:h|hours?)?\s*-\s*(\d{1,2})(?::(\d{2}))?')
+
+
+def parse_play_time(label):
+    match = PLAY_TIME_RE.match(label or '')
+    if not match:
+        return None
+    start_hour, start_minute, end_hour, end_minute = match.groups()
+    try:
+        return time(int(start_hour), int(start_minute or 0)), time(int(end_hour), int(end_minute or 0))
+    except ValueError:
+        return None
+
+
+def convert_play_times(apps, schema_editor):
+    """
+    Tạo CourtSlot từ chuỗi playTime của từng sân (cho ngày Available Date,
+    mặc định hôm nay) và gắn mỗi Booking với slot tương ứng với play_time
+    """
+    Tennis = apps.get_model('home', 'Tennis')
+    CourtSlot = apps.get_model('home', 'CourtSlot')
+    Booking = apps.get_model('home', 'Booking')
+
+    slots = {}
+
+    def get_slot(court_id, date, times):
+        key = (court_id, date, times[0])
+        if key not in slots:
+            slots[key], _ = CourtSlot.objects.get_or_create(
+                court_id=court_id, date=date, start_time=times[0], defaults={'end_time': times[1]}
+            )
+        return slots[key]
+
+    today = timezone.localdate()
+    court_dates = {}
+    for court in Tennis.objects.all():
+        court_dates[court.id] = court.dateTime or today
+        for label in (court.playTime or '').split(', '):
+            times = parse_play_time(label)
+            if times:
+                get_slot(court.id, court_dates[court.id], times)
+
+    for booking in Booking.objects.filter(slot__isnull=True).iterator():
+        times = parse_play_time(booking.play_time)
+        if not times:
+            continue
+        date = court_dates.get(booking.tennis_court_id) or timezone.localdate(booking.created_at)
+        booking.slot = get_slot(booking.tennis_court_id, date, times)
+        booking.save(update_fields=['slot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0025_activityrollup_bot_dimension'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourtSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('court', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='home.tennis')),
+            ],
+            options={
+                'ordering': ['date', 'start_time'],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='slot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to='home.courtslot'),
+        ),
+        migrations.AddIndex(
+            model_name='courtslot',
+            index=models.Index(fields=['court', 'date'], name='slot_court_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='courtslot',
+            constraint=models.UniqueConstraint(fields=('court', 'date', 'start_time'), name='unique_court_slot'),
+        ),
+        migrations.RunPython(convert_play_times, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='tennis',
+            name='booked_times',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def detach_duplicate_slot_bookings(apps, schema_editor):
+    """
+    Slot có nhiều booking (đặt trùng trước khi có ràng buộc): giữ booking
+    sớm nhất, các booking còn lại bỏ liên kết slot (vẫn giữ nhãn play_time)
+    """
+    Booking = apps.get_model('home', 'Booking')
+
+    duplicated = Booking.objects.filter(slot__isnull=False).values('slot_id').annotate(
+        total=Count('id')
+    ).filter(total__gt=1).values_list('slot_id', flat=True)
+    for slot_id in list(duplicated):
+        keep = Booking.objects.filter(slot_id=slot_id).order_by('created_at', 'id').values_list('id', flat=True).first()
+        Booking.objects.filter(slot_id=slot_id).exclude(id=keep).update(slot=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0026_court_slots"),
+    ]
+
+    operations = [
+        migrations.RunPython(detach_duplicate_slot_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="booking",
+            constraint=models.UniqueConstraint(fields=("slot",), name="unique_booking_slot"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0028_slot_holds'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_court_time_idx',
+        ),
+    ]
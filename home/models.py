@@ -132,8 +132,8 @@ class Tennis(models.Model):
     hours = models.IntegerField()  
     brief = models.CharField(max_length=100000, null=True)
     
+    # Các khung giờ trong ngày (mẫu để tạo CourtSlot, xem home.court_slots)
     playTime = models.CharField(max_length=255, null=True, blank=True)
-    booked_times = models.JSONField(default=list) 
     dateTime = models.DateField(null=True, blank=True)  
     
     @property
@@ -164,25 +164,62 @@ class Tennis(models.Model):
             self.playTime = ', '.join(self.generate_play_times())
         super().save(*args, **kwargs)
 
-    def book_time(self, play_time):
-        if play_time not in self.booked_times:
-            self.booked_times.append(play_time)
-            self.save()
-
-    def cancel_booking(self, play_time):
-        if play_time in self.booked_times:
-            self.booked_times.remove(play_time)
-            self.save()
-            
     def average_rating(self):
         reviews = self.reviews.all()
         if reviews:
             return round(sum([review.rating for review in reviews]) / len(reviews), 1)
         return 0
+
+
+class CourtSlot(models.Model):
+    """Một khung giờ chơi của sân trong một ngày"""
+    court = models.ForeignKey(Tennis, on_delete=models.CASCADE, related_name='slots')
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ['date', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['court', 'date', 'start_time'], name='unique_court_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['court', 'date'], name='slot_court_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.court_id} {self.date} {self.label}'
+
+    @property
+    def label(self):
+        from .court_slots import format_play_time
+        return format_play_time(self.start_time, self.end_time)
+
+
+class SlotHold(models.Model):
+    """Giữ chỗ ngắn hạn một slot trong lúc user thanh toán"""
+    slot = models.OneToOneField(CourtSlot, on_delete=models.CASCADE, related_name='hold')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='slot_holds')
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user_id} holds {self.slot_id} until {self.expires_at}'
+
+
 class Booking(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     tennis_court = models.ForeignKey(Tennis, on_delete=models.CASCADE)
-    play_time = models.CharField(max_length=100)
+    slot = models.ForeignKey(CourtSlot, on_delete=models.SET_NULL, null=True, blank=True, related_name='bookings')
+    play_time = models.CharField(max_length=100)  # Nhãn khung giờ để hiển thị (slot.label)
+    # NULL: booking tạo trước khi có cột này và không có hoá đơn (không rõ thời điểm)
+    created_at = models.DateTimeField(default=now, null=True, db_index=True)
+    
+    class Meta:
+        constraints = [
+            # Mỗi slot chỉ có một booking (chặn hai người cùng trả tiền cho một slot)
+            models.UniqueConstraint(fields=['slot'], name='unique_booking_slot'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} booked {self.tennis_court.name} at {self.play_time}'
@@ -248,10 +285,19 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Doanh thu: status='Paid' trong một khoảng created_at
+            models.Index(fields=['status', 'created_at'], name='invoice_status_created_idx'),
+        ]
+
     def pay(self):
         if self.status == 'Pending' and self.user.deduct(self.amount):
+            from .user_stats import record_user_spend
+
             self.status = 'Paid'
             self.save()
+            record_user_spend(self.user_id, self.amount)
             system_account = SystemAccount.objects.first() 
             if system_account:
                 system_account.add_funds(self.amount)
@@ -340,6 +386,10 @@ class TransactionHistory(models.Model):
 
     class Meta:
         ordering = ['-timestamp'] 
+        indexes = [
+            # Hạn mức nạp tiền theo ngày: user + loại giao dịch + thời gian
+            models.Index(fields=['user', 'transaction_type', 'timestamp'], name='txn_user_type_time_idx'),
+        ]
         
 class PasswordResetRequest(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -376,6 +426,8 @@ class UserActivity(models.Model):
     page_url = models.URLField(max_length=500, blank=True, null=True)
     referrer = models.URLField(max_length=500, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Trọng số khi dòng được ghi theo lấy mẫu (xác suất p -> weight = 1/p)
+    weight = models.FloatField(default=1.0)
     
     # Thông tin bổ sung (JSON field để lưu dữ liệu linh hoạt)
     extra_data = models.JSONField(default=dict, blank=True)
@@ -384,6 +436,11 @@ class UserActivity(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Hoạt động người dùng'
         verbose_name_plural = 'Hoạt động người dùng'
+        indexes = [
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+            models.Index(fields=['activity_type', 'created_at'], name='activity_type_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='activity_user_created_idx'),
+        ]
     
     def __str__(self):
         username = self.user.username if self.user else 'Anonymous'
@@ -392,7 +449,7 @@ class UserActivity(models.Model):
 
 class PageView(models.Model):
     """Model để theo dõi số lượt xem của từng trang"""
-    page_url = models.CharField(max_length=500)
+    page_url = models.CharField(max_length=500, unique=True)
     page_name = models.CharField(max_length=255, blank=True, null=True)
     view_count = models.PositiveIntegerField(default=0)
     unique_visitors = models.PositiveIntegerField(default=0)
@@ -408,17 +465,31 @@ class PageView(models.Model):
         return f"{self.page_name or self.page_url} - {self.view_count} lượt xem"
     
     @classmethod
-    def record_view(cls, page_url, page_name=None):
-        """Ghi lại lượt xem trang"""
+    def record_view(cls, page_url, page_name=None, count=1):
+        """
+        Ghi lại lượt xem trang (count: số lượt xem đã gộp)
+
+        Dùng UPDATE ... SET view_count = view_count + n nên không mất lượt xem
+        khi nhiều worker cùng ghi, và không phải đọc/ghi lại cả dòng.
+        """
+        from django.db.models import F
+        from django.utils import timezone
+
+        updated = cls.objects.filter(page_url=page_url).update(
+            view_count=F('view_count') + count,
+            last_viewed=timezone.now(),
+        )
+        if updated:
+            return
         page, created = cls.objects.get_or_create(
             page_url=page_url,
-            defaults={'page_name': page_name, 'view_count': 0}
+            defaults={'page_name': page_name, 'view_count': count}
         )
-        page.view_count += 1
-        if page_name and not page.page_name:
-            page.page_name = page_name
-        page.save()
-        return page
+        if not created:
+            cls.objects.filter(pk=page.pk).update(
+                view_count=F('view_count') + count,
+                last_viewed=timezone.now(),
+            )
 
 
 class DailyStats(models.Model):
@@ -439,6 +510,30 @@ class DailyStats(models.Model):
         return f"Stats for {self.date}"
 
 
+class VisitorSketch(models.Model):
+    """
+    Sketch HyperLogLog số khách truy cập khác nhau trong một ngày, cho toàn
+    site (page_url rỗng) hoặc cho một route (page_url là tên route, xem
+    visitor_sketches.page_scope). Gộp được qua nhiều ngày, xem
+    home.visitor_sketches.
+    """
+    date = models.DateField()
+    page_url = models.CharField(max_length=500, blank=True, default='')
+    sketch = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Sketch khách truy cập'
+        verbose_name_plural = 'Sketch khách truy cập'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'page_url'], name='unique_visitor_sketch'),
+        ]
+
+    def __str__(self):
+        return f"Visitors {self.date} {self.page_url or '(site)'}"
+
+
 class VisitorSession(models.Model):
     """Model để theo dõi phiên truy cập (visitor session)"""
     session_key = models.CharField(max_length=40, unique=True)
@@ -458,7 +553,123 @@ class VisitorSession(models.Model):
         ordering = ['-last_activity']
         verbose_name = 'Phiên truy cập'
         verbose_name_plural = 'Phiên truy cập'
+        indexes = [
+            models.Index(fields=['last_activity'], name='session_last_activity_idx'),
+            models.Index(fields=['started_at'], name='session_started_idx'),
+        ]
     
     def __str__(self):
         username = self.user.username if self.user else 'Anonymous'
         return f"Session {self.session_key[:8]}... - {username}"
+
+
+class ActivityRollup(models.Model):
+    """
+    Số liệu hoạt động đã gộp sẵn theo giờ/ngày, cho dashboard thống kê.
+
+    Mỗi dòng là tổng của một giá trị (vd: activity_type='login',
+    device_type='mobile') trong một bucket; được cộng dồn khi ghi sự kiện
+    (home.rollups) hoặc dựng lại bằng lệnh rebuild_rollups.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Giờ'),
+        ('day', 'Ngày'),
+    ]
+
+    DIMENSION_CHOICES = [
+        ('activity_type', 'Loại hoạt động'),
+        ('device_type', 'Thiết bị'),
+        ('browser', 'Trình duyệt'),
+        ('bot', 'Bot'),
+    ]
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    bucket = models.DateTimeField()  # Thời điểm bắt đầu giờ/ngày
+    value = models.CharField(max_length=100)
+    count = models.FloatField(default=0)  # Tổng weight (xem UserActivity.weight)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-bucket']
+        verbose_name = 'Thống kê gộp'
+        verbose_name_plural = 'Thống kê gộp'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'dimension', 'bucket', 'value'],
+                name='unique_activity_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket:%Y-%m-%d %H:%M} {self.dimension}={self.value}: {self.count:g}"
+
+
+class ProcessingWatermark(models.Model):
+    """Vị trí đã xử lý xong của một job định kỳ (vd: daily_stats), để chạy tiếp từ đó"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Mốc xử lý'
+        verbose_name_plural = 'Mốc xử lý'
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+    @classmethod
+    def get(cls, name):
+        """Vị trí hiện tại của job, None nếu chưa chạy lần nào"""
+        return cls.objects.filter(name=name).values_list('position', flat=True).first()
+
+    @classmethod
+    def advance(cls, name, position):
+        """Cập nhật vị trí của job (chỉ tiến, không lùi)"""
+        watermark, created = cls.objects.get_or_create(name=name, defaults={'position': position})
+        if not created and position > watermark.position:
+            cls.objects.filter(pk=watermark.pk, position__lt=position).update(position=position, updated_at=now())
+
+
+class UserStats(models.Model):
+    """
+    Thống kê hoạt động của một user: số hoạt động theo loại, lần đầu/cuối
+    xuất hiện và tổng chi tiêu. Được cộng dồn khi ghi hoạt động hoặc dựng lại
+    bằng lệnh rebuild_user_stats (xem home.user_stats).
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    counts = models.JSONField(default=dict, blank=True)  # {activity_type: tổng weight}
+    total_activities = models.FloatField(default=0, db_index=True)  # Tổng counts, cho bảng xếp hạng
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    total_spend = models.FloatField(default=0.0)  # Tổng Invoice đã thanh toán
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Thống kê người dùng'
+        verbose_name_plural = 'Thống kê người dùng'
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+
+class UserDailyActivity(models.Model):
+    """Số hoạt động (tổng weight) của một user trong một ngày, cho bảng xếp hạng theo khoảng ngày"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='daily_activity')
+    date = models.DateField()
+    count = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Hoạt động người dùng theo ngày'
+        verbose_name_plural = 'Hoạt động người dùng theo ngày'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_user_daily_activity'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='user_daily_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.date}: {self.count}"
@@ -0,0 +1,141 @@
+"""
+Theo dõi người dùng đang online.
+
+Mỗi request của user đăng nhập chỉ ghi vào cache; last_login trong DB chỉ
+được cập nhật khi giá trị đang lưu cũ hơn PRESENCE_PERSIST_INTERVAL giây,
+nên việc duyệt web khi đã đăng nhập không còn tốn một lệnh ghi DB mỗi click.
+
+Chỉ mục presence chia thời gian thành các bucket 1 phút. Lần đầu một user
+xuất hiện trong một phút, cache.add() giành chỗ cho user đó và cache.incr()
+cấp một số thứ tự trong bucket; user ID được lưu ở key
+presence:<bucket>:<số thứ tự>. "Ai đang online trong 5 phút qua" chỉ cần
+đọc tối đa 5 bucket bằng hai lệnh get_many, không phụ thuộc tổng số user.
+add/incr là nguyên tử trên Redis/Memcached nên chỉ mục dùng được cho nhiều
+worker khi CACHES trỏ tới một cache dùng chung.
+
+Khi cache mặc định là RedisCache (REDIS_URL), mỗi bucket là một Redis set
+(SADD, đọc bằng SUNION) kèm một HyperLogLog (PFADD): get_online_count() chỉ
+là một lệnh PFCOUNT trên tối đa `minutes` key, không phụ thuộc số user online.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.utils import timezone
+
+
+BUCKET_SECONDS = 60
+
+
+def get_online_timeout():
+    return getattr(settings, 'PRESENCE_ONLINE_TIMEOUT', 300)
+
+
+def get_persist_interval():
+    return getattr(settings, 'PRESENCE_PERSIST_INTERVAL', 300)
+
+
+def get_window_minutes():
+    return max(1, math.ceil(get_online_timeout() / BUCKET_SECONDS))
+
+
+def _bucket(now):
+    return int(now.timestamp() // BUCKET_SECONDS)
+
+
+def _bucket_ttl():
+    # Giữ bucket lâu hơn cửa sổ một chút để lần đọc ở cuối phút vẫn thấy đủ
+    return (get_window_minutes() + 2) * BUCKET_SECONDS
+
+
+def _redis_client():
+    """Client redis-py của cache mặc định nếu là RedisCache, None với backend khác"""
+    backend = caches['default']
+    if not isinstance(backend, RedisCache):
+        return None
+    # RedisCache không có API công khai cho set/HyperLogLog nên dùng thẳng client của nó
+    return backend._cache.get_client(write=True)
+
+
+def _redis_keys(buckets, kind):
+    return [cache.make_key(f'presence:{kind}:{bucket}') for bucket in buckets]
+
+
+def _mark_bucket(user_id, now):
+    bucket = _bucket(now)
+    ttl = _bucket_ttl()
+    client = _redis_client()
+    if client is not None:
+        members_key, = _redis_keys([bucket], 'set')
+        sketch_key, = _redis_keys([bucket], 'hll')
+        pipe = client.pipeline()
+        pipe.sadd(members_key, user_id)
+        pipe.pfadd(sketch_key, user_id)
+        pipe.expire(members_key, ttl)
+        pipe.expire(sketch_key, ttl)
+        return bool(pipe.execute()[0])
+
+    if not cache.add(f'presence:{bucket}:u:{user_id}', 1, ttl):
+        return False
+    counter_key = f'presence:{bucket}:n'
+    cache.add(counter_key, 0, ttl)
+    slot = cache.incr(counter_key)
+    cache.set(f'presence:{bucket}:{slot}', user_id, ttl)
+    return True
+
+
+def record_presence(user, now=None):
+    """
+    Ghi nhận user vừa hoạt động
+
+    Returns:
+        True nếu last_login đã được ghi xuống DB
+    """
+    from .models import CustomUser
+
+    now = now or timezone.now()
+    _mark_bucket(user.userID, now)
+
+    last_seen = getattr(user, 'last_login', None)
+    if last_seen is not None and now - last_seen < timedelta(seconds=get_persist_interval()):
+        return False
+
+    # update() thay vì save(): chỉ ghi đúng một cột, không chạy lại logic role
+    CustomUser.objects.filter(pk=user.pk).update(last_login=now)
+    user.last_login = now
+    return True
+
+
+def _window(minutes, now):
+    minutes = minutes or get_window_minutes()
+    current = _bucket(now or timezone.now())
+    return range(current - minutes + 1, current + 1)
+
+
+def get_online_user_ids(minutes=None, now=None):
+    """Tập userID hoạt động trong `minutes` phút gần nhất (gộp tối đa `minutes` bucket)"""
+    buckets = _window(minutes, now)
+    client = _redis_client()
+    if client is not None:
+        return {member.decode() for member in client.sunion(_redis_keys(buckets, 'set'))}
+
+    counts = cache.get_many([f'presence:{bucket}:n' for bucket in buckets])
+    slot_keys = [
+        f'presence:{bucket}:{slot}'
+        for bucket in buckets
+        for slot in range(1, (counts.get(f'presence:{bucket}:n') or 0) + 1)
+    ]
+    if not slot_keys:
+        return set()
+    return set(cache.get_many(slot_keys).values())
+
+
+def get_online_count(minutes=None, now=None):
+    """Số user online trong `minutes` phút gần nhất"""
+    client = _redis_client()
+    if client is not None:
+        # PFCOUNT nhiều key = số phần tử của hợp các HyperLogLog (sai số ~0.8%)
+        return client.pfcount(*_redis_keys(_window(minutes, now), 'hll'))
+    return len(get_online_user_ids(minutes, now))
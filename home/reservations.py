@@ -0,0 +1,323 @@
+"""
+Giữ chỗ slot an toàn khi nhiều người cùng đặt.
+
+Mỗi slot chỉ có một booking (ràng buộc unique_booking_slot). Việc nhận slot
+chạy trong transaction: khoá dòng CourtSlot (select_for_update, chỉ khoá
+đúng slot đó nên các sân/slot khác không phải chờ nhau), kiểm tra còn trống
+rồi ghi Booking; nếu vẫn thua cuộc đua thì ràng buộc unique chặn lại. Người
+thua nhận SlotUnavailable và không bị trừ tiền (phần thanh toán nằm trong
+cùng transaction, sau bước nhận slot).
+
+Từ lúc chọn giờ (rent_court) tới lúc thanh toán, slot được giữ chỗ
+SLOT_HOLD_SECONDS giây bằng một dòng SlotHold: người khác thấy slot là không
+còn trống. Giữ chỗ hết hạn không còn tác dụng ngay (mọi truy vấn lọc theo
+expires_at) và được xoá định kỳ bằng một lệnh DELETE theo index expires_at
+(sweep_expired_holds): bởi thread HoldSweeper riêng của mỗi process web, hoặc
+bởi lệnh python manage.py sweep_slot_holds --loop chạy riêng/cron khi tắt
+SLOT_HOLD_SWEEP_THREAD.
+
+book_recurring() đặt cùng khung giờ của sân cho nhiều ngày (hằng tuần hoặc
+các ngày chỉ định): kiểm tra mọi ngày bằng một truy vấn, ghi Booking/Invoice
+bằng bulk_create và một lần thanh toán gộp, tất cả trong một transaction.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+
+class SlotUnavailable(Exception):
+    """Slot không tồn tại, không thuộc sân, đã có người đặt hoặc người khác đang giữ chỗ"""
+
+
+class InsufficientBalance(Exception):
+    """Số dư tài khoản không đủ cho lần thanh toán"""
+
+
+def get_hold_seconds():
+    return getattr(settings, 'SLOT_HOLD_SECONDS', 300)
+
+
+def _lock_free_slot(court, slot_id, user, exclude_booking=None):
+    from .models import CourtSlot, SlotHold
+
+    slot = CourtSlot.objects.select_for_update().filter(court=court, pk=slot_id or 0).first()
+    if slot is None:
+        raise SlotUnavailable('The selected play time does not exist.')
+    starts_at = timezone.make_aware(datetime.combine(slot.date, slot.start_time), timezone.get_current_timezone())
+    if starts_at <= timezone.now():
+        raise SlotUnavailable('This play time has already started. Please choose another time.')
+    bookings = slot.bookings.all()
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=exclude_booking.pk)
+    if bookings.exists():
+        raise SlotUnavailable('The selected play time is already booked. Please choose another time.')
+    if SlotHold.objects.filter(slot=slot, expires_at__gt=timezone.now()).exclude(user=user).exists():
+        raise SlotUnavailable('Someone else is checking out this play time. Please choose another time.')
+    return slot
+
+
+def hold_slot(user, court, slot_id):
+    """
+    Giữ chỗ slot cho user trong SLOT_HOLD_SECONDS giây (gia hạn nếu user đang
+    giữ), thay cho giữ chỗ khác của user
+
+    Returns:
+        SlotHold
+
+    Raises:
+        SlotUnavailable: Slot không hợp lệ, đã có người đặt hoặc người khác đang giữ
+    """
+    from .models import SlotHold
+
+    get_hold_sweeper()
+    expires_at = timezone.now() + timedelta(seconds=get_hold_seconds())
+    with transaction.atomic():
+        slot = _lock_free_slot(court, slot_id, user)
+        # Mỗi user chỉ giữ một slot; giữ chỗ đã hết hạn của người khác được ghi đè
+        SlotHold.objects.filter(user=user).exclude(slot=slot).delete()
+        try:
+            with transaction.atomic():
+                hold, _ = SlotHold.objects.update_or_create(
+                    slot=slot, defaults={'user': user, 'expires_at': expires_at}
+                )
+        except IntegrityError:
+            raise SlotUnavailable('Someone else is checking out this play time. Please choose another time.')
+    return hold
+
+
+def release_hold(user, slot_id):
+    """Bỏ giữ chỗ slot của user (huỷ thanh toán)"""
+    from .models import SlotHold
+
+    SlotHold.objects.filter(user=user, slot_id=slot_id or 0).delete()
+
+
+def reserve_slot(user, court, slot_id):
+    """
+    Nhận slot cho user và tạo Booking
+
+    Gọi trong transaction.atomic() của phần thanh toán để khi thanh toán lỗi
+    thì slot được trả lại.
+
+    Raises:
+        SlotUnavailable: Slot không hợp lệ hoặc đã có người đặt
+    """
+    from .models import Booking
+
+    with transaction.atomic():
+        slot = _lock_free_slot(court, slot_id, user)
+        try:
+            with transaction.atomic():
+                booking = Booking.objects.create(tennis_court=court, user=user, slot=slot, play_time=slot.label)
+        except IntegrityError:
+            raise SlotUnavailable('The selected play time is already booked. Please choose another time.')
+        release_hold(user, slot.pk)
+    return booking
+
+
+def move_booking(booking, slot_id):
+    """
+    Đổi booking sang slot khác của cùng sân
+
+    Raises:
+        SlotUnavailable: Slot không hợp lệ hoặc đã có người khác đặt
+    """
+    with transaction.atomic():
+        slot = _lock_free_slot(booking.tennis_court, slot_id, booking.user, exclude_booking=booking)
+        booking.slot = slot
+        booking.play_time = slot.label
+        try:
+            with transaction.atomic():
+                booking.save(update_fields=['slot', 'play_time'])
+        except IntegrityError:
+            raise SlotUnavailable('The selected play time is already booked. Please choose another time.')
+    return booking
+
+
+def weekly_dates(first_date, weeks):
+    """Các ngày cùng thứ trong `weeks` tuần liên tiếp, bắt đầu từ first_date"""
+    return [first_date + timedelta(weeks=week) for week in range(weeks)]
+
+
+def get_max_occurrences():
+    return getattr(settings, 'RECURRING_BOOKING_MAX_OCCURRENCES', 12)
+
+
+def book_recurring(user, court, slot_id, dates):
+    """
+    Đặt khung giờ của slot `slot_id` cho sân vào mọi ngày trong `dates`,
+    thanh toán gộp một lần bằng số dư tài khoản
+
+    Slot của các ngày chưa có được tạo bằng một lệnh bulk_create; trạng thái
+    mọi ngày được kiểm tra bằng một truy vấn (khoá các slot đó). Booking,
+    Invoice và RevenueHistory được ghi bằng bulk_create; TransactionHistory
+    và số dư (user, SystemAccount) được cập nhật một lần cho tổng số tiền.
+
+    Returns:
+        List Booking đã tạo (theo ngày)
+
+    Raises:
+        SlotUnavailable: Slot mẫu không hợp lệ hoặc có ngày đã bị đặt/giữ chỗ
+        InsufficientBalance: Số dư không đủ cho tổng số tiền
+    """
+    from .availability import invalidate_day
+    from .court_slots import slots_with_status
+    from .dashboard import invalidate_dashboard
+    from .models import (
+        Booking, CourtSlot, CustomUser, Invoice, RevenueHistory, SlotHold, SystemAccount, TransactionHistory,
+    )
+    from .user_stats import record_user_spend
+
+    template = CourtSlot.objects.filter(court=court, pk=slot_id or 0).first()
+    if template is None:
+        raise SlotUnavailable('The selected play time does not exist.')
+    dates = sorted(set(dates))
+    if not dates:
+        raise SlotUnavailable('Please choose at least one date.')
+    if dates[0] < timezone.localdate():
+        raise SlotUnavailable('Bookings cannot be made for past dates.')
+    if len(dates) > get_max_occurrences():
+        raise SlotUnavailable(f'At most {get_max_occurrences()} dates can be booked at once.')
+
+    total = court.price * len(dates)
+    with transaction.atomic():
+        CourtSlot.objects.bulk_create(
+            [CourtSlot(court=court, date=date, start_time=template.start_time, end_time=template.end_time) for date in dates],
+            ignore_conflicts=True,
+        )
+        slots = list(slots_with_status(
+            CourtSlot.objects.select_for_update().filter(court=court, date__in=dates, start_time=template.start_time),
+            user,
+        ))
+        taken = [slot.date for slot in slots if slot.is_booked or slot.is_held]
+        if taken:
+            raise SlotUnavailable(
+                'The selected play time is already booked on ' + ', '.join(d.strftime('%Y-%m-%d') for d in taken) + '.'
+            )
+
+        if total > 0:
+            payer = CustomUser.objects.select_for_update().get(pk=user.pk)
+            if not payer.deduct(total):
+                raise InsufficientBalance('Insufficient balance. Please top up your account.')
+            user.balance = payer.balance
+
+        try:
+            with transaction.atomic():
+                bookings = Booking.objects.bulk_create([
+                    Booking(tennis_court=court, user=user, slot=slot, play_time=slot.label) for slot in slots
+                ])
+        except IntegrityError:
+            raise SlotUnavailable('The selected play time is already booked. Please choose another time.')
+
+        invoices = Invoice.objects.bulk_create([
+            Invoice(
+                user=user, booking=booking, amount=court.price, status='Paid',
+                payment_method='balance' if total > 0 else 'free',
+            )
+            for booking in bookings
+        ])
+        if total > 0:
+            RevenueHistory.objects.bulk_create([
+                RevenueHistory(invoice=invoice, amount=invoice.amount, transaction_type='Payment')
+                for invoice in invoices
+            ])
+            TransactionHistory.objects.create(
+                user=user, transaction_type='Payment', payment_method='balance', amount=total
+            )
+            system_account = SystemAccount.objects.first()
+            if system_account:
+                system_account.add_funds(total)
+        SlotHold.objects.filter(user=user, slot__in=slots).delete()
+        # bulk_create không gửi post_save: cộng chi tiêu cho UserStats thủ công
+        record_user_spend(user.pk, total)
+
+    # bulk_create không gửi post_save: huỷ cache theo cách thủ công
+    for date in dates:
+        invalidate_day(date)
+    invalidate_dashboard()
+    return bookings
+
+
+def sweep_expired_holds():
+    """Xoá các giữ chỗ đã hết hạn (quét theo index expires_at), trả về số dòng đã xoá"""
+    from .models import SlotHold
+
+    expired = SlotHold.objects.filter(expires_at__lte=timezone.now())
+    # delete() của queryset vẫn gửi post_delete (huỷ cache sân trống của ngày đó)
+    deleted, _ = expired.delete()
+    return deleted
+
+
+def get_sweep_interval():
+    return getattr(settings, 'SLOT_HOLD_SWEEP_SECONDS', 30)
+
+
+def is_sweep_thread_enabled():
+    return getattr(settings, 'SLOT_HOLD_SWEEP_THREAD', True) and get_sweep_interval() > 0
+
+
+class HoldSweeper:
+    """Thread nền riêng chạy sweep_expired_holds mỗi `interval` giây"""
+
+    def __init__(self, sweep=sweep_expired_holds, interval=30):
+        self.sweep = sweep
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.released = 0
+        self.errors = 0
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='slot-hold-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.interval * 2, 1))
+
+    def run_once(self):
+        """Xoá giữ chỗ hết hạn một lần; trả về số dòng đã xoá (0 nếu lỗi)"""
+        try:
+            released = self.sweep()
+        except Exception as e:
+            self.errors += 1
+            print(f"Slot hold sweep error: {e}")
+            return 0
+        self.released += released
+        return released
+
+    def _run(self):
+        from django.db import close_old_connections
+
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            finally:
+                close_old_connections()
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def get_hold_sweeper():
+    """Bộ xoá giữ chỗ hết hạn dùng chung của process (thread chỉ chạy khi bật SLOT_HOLD_SWEEP_THREAD)"""
+    global _sweeper
+    if _sweeper is None:
+        with _sweeper_lock:
+            if _sweeper is None:
+                _sweeper = HoldSweeper(interval=get_sweep_interval())
+    if is_sweep_thread_enabled():
+        _sweeper.ensure_started()
+    return _sweeper
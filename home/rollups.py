@@ -0,0 +1,247 @@
+"""
+Bảng thống kê gộp (ActivityRollup) theo giờ và theo ngày.
+
+Mỗi sự kiện cộng weight của nó vào bucket giờ và bucket ngày chứa nó, cho
+các chiều activity_type (UserActivity) và device_type/browser (phiên mới
+của VisitorSession). Các lượt cộng đi qua một CoalescingCounter nên mỗi
+(bucket, chiều, giá trị) chỉ tốn một lệnh upsert mỗi
+ACTIVITY_ROLLUP_FLUSH_SECONDS giây.
+
+Dashboard đọc vài trăm dòng đã gộp thay vì GROUP BY trên bảng sự kiện;
+rebuild_rollups() dựng lại một khoảng ngày từ dữ liệu gốc khi cần.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .counters import CoalescingCounter
+
+
+GRANULARITIES = ('hour', 'day')
+# Các chiều dựng lại được từ dữ liệu gốc; chiều 'bot' chỉ có bộ đếm
+REBUILT_DIMENSIONS = ('activity_type', 'device_type', 'browser')
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+WATERMARK_KEY = 'analytics:watermark'
+
+
+def bucket_start(value, granularity):
+    """Thời điểm bắt đầu giờ/ngày (theo TIME_ZONE) chứa value"""
+    value = timezone.localtime(value)
+    if granularity == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def mark_rollups_updated():
+    """Ghi lại thời điểm số liệu thống kê vừa thay đổi (mốc cho ETag của analytics_api)"""
+    cache.set(WATERMARK_KEY, time.time(), None)
+
+
+def get_rollup_watermark():
+    """Thời điểm (timestamp) số liệu thống kê thay đổi gần nhất"""
+    from .models import ActivityRollup
+
+    watermark = cache.get(WATERMARK_KEY)
+    if watermark is None:
+        latest = ActivityRollup.objects.aggregate(latest=Max('updated_at'))['latest']
+        watermark = latest.timestamp() if latest else 0
+        cache.add(WATERMARK_KEY, watermark, None)
+    return watermark
+
+
+def _upsert_rollups(pending):
+    """Cộng các giá trị đang chờ vào ActivityRollup bằng một lệnh upsert (executemany)"""
+    from .models import ActivityRollup
+
+    if connection.vendor not in UPSERT_VENDORS:
+        _update_or_create_rollups(pending)
+        return
+
+    meta = ActivityRollup._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = ['granularity', 'dimension', 'bucket', 'value', 'count', 'updated_at']
+    fields = {name: meta.get_field(name) for name in columns}
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(fields[c].column) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({', '.join(qn(c) for c in columns[:4])}) DO UPDATE SET "
+        f"{qn('count')} = {table}.{qn('count')} + excluded.{qn('count')}, "
+        f"{qn('updated_at')} = excluded.{qn('updated_at')}"
+    )
+
+    now = timezone.now()
+    params = []
+    for (granularity, dimension, bucket, value), (count, _) in pending.items():
+        values = {
+            'granularity': granularity, 'dimension': dimension, 'bucket': bucket,
+            'value': value, 'count': count, 'updated_at': now,
+        }
+        params.append([fields[c].get_db_prep_value(values[c], connection) for c in columns])
+
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+    mark_rollups_updated()
+
+
+def _update_or_create_rollups(pending):
+    """Dự phòng cho DB không hỗ trợ ON CONFLICT"""
+    from .models import ActivityRollup
+
+    with transaction.atomic():
+        for (granularity, dimension, bucket, value), (count, _) in pending.items():
+            lookup = {'granularity': granularity, 'dimension': dimension, 'bucket': bucket, 'value': value}
+            if ActivityRollup.objects.filter(**lookup).update(count=F('count') + count, updated_at=timezone.now()):
+                continue
+            rollup, created = ActivityRollup.objects.get_or_create(defaults={'count': count}, **lookup)
+            if not created:
+                ActivityRollup.objects.filter(pk=rollup.pk).update(count=F('count') + count, updated_at=timezone.now())
+    mark_rollups_updated()
+
+
+_rollup_counter = None
+_rollup_lock = threading.Lock()
+
+
+def get_rollup_counter():
+    """Bộ đếm gộp cho ActivityRollup dùng chung của process"""
+    global _rollup_counter
+    if _rollup_counter is None:
+        with _rollup_lock:
+            if _rollup_counter is None:
+                _rollup_counter = CoalescingCounter(
+                    apply=_upsert_rollups,
+                    flush_interval=getattr(settings, 'ACTIVITY_ROLLUP_FLUSH_SECONDS', 5),
+                    max_pending=getattr(settings, 'ACTIVITY_ROLLUP_MAX_PENDING', 1000),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_rollup_counter.flush_if_due)
+                register_shutdown_flusher(_rollup_counter.flush)
+    return _rollup_counter
+
+
+def record_rollup(dimension, value, timestamp, count=1):
+    """
+    Cộng count vào bucket giờ và bucket ngày chứa timestamp
+
+    Args:
+        dimension: 'activity_type', 'device_type', 'browser' hoặc 'bot'
+        value: Giá trị của chiều (vd: 'login', 'mobile')
+        timestamp: Thời điểm xảy ra sự kiện
+        count: Số lượng (hoặc tổng weight với dữ liệu lấy mẫu)
+    """
+    counter = get_rollup_counter()
+    value = value or 'Unknown'
+    for granularity in GRANULARITIES:
+        counter.add((granularity, dimension, bucket_start(timestamp, granularity), value), count)
+
+
+def record_session_starts(rows):
+    """Ghi nhận các phiên mới vào chiều device_type/browser"""
+    for row in rows:
+        record_rollup('device_type', row['device_type'], row['last_activity'])
+        record_rollup('browser', row['browser'], row['last_activity'])
+
+
+def rebuild_rollups(start, end):
+    """
+    Dựng lại ActivityRollup cho các ngày trong [start, end) từ UserActivity
+    (kèm phần đã archive, home.activity_archive) và VisitorSession
+
+    start/end được làm tròn xuống đầu ngày, nên nên gọi với các ngày đã kết
+    thúc: bucket của ngày hiện tại vẫn đang được cộng dồn bởi các worker.
+
+    Returns:
+        Số dòng ActivityRollup đã ghi
+    """
+    from .activity_archive import iter_archived_activities
+    from .models import ActivityRollup, UserActivity, VisitorSession
+
+    start = bucket_start(start, 'day')
+    end = bucket_start(end, 'day')
+    if end <= start:
+        return 0
+
+    # Đẩy các lượt cộng đang chờ của process này trước để không bị tính hai lần
+    get_rollup_counter().flush()
+
+    activities = UserActivity.objects.filter(created_at__gte=start, created_at__lt=end)
+    sessions = VisitorSession.objects.filter(started_at__gte=start, started_at__lt=end)
+    truncs = {'hour': TruncHour, 'day': TruncDay}
+
+    totals = {}
+
+    def add(granularity, dimension, bucket, value, count):
+        key = (granularity, dimension, bucket, value or 'Unknown')
+        totals[key] = totals.get(key, 0) + (count or 0)
+
+    for granularity, trunc in truncs.items():
+        sources = [
+            ('activity_type', activities, 'created_at', Sum('weight')),
+            ('device_type', sessions, 'started_at', Count('id')),
+            ('browser', sessions, 'started_at', Count('id')),
+        ]
+        for dimension, queryset, time_field, aggregate in sources:
+            grouped = queryset.annotate(
+                bucket=trunc(time_field)
+            ).values('bucket', dimension).annotate(total=aggregate).order_by()
+            for item in grouped:
+                add(granularity, dimension, item['bucket'], item[dimension], item['total'])
+
+    # Các ngày cũ hơn ACTIVITY_RETENTION_DAYS chỉ còn trong archive
+    for row in iter_archived_activities(start, end):
+        for granularity in GRANULARITIES:
+            add(granularity, 'activity_type', bucket_start(row['created_at'], granularity), row['activity_type'], row['weight'])
+
+    now = timezone.now()
+    rows = [
+        ActivityRollup(
+            granularity=granularity, dimension=dimension, bucket=bucket, value=value, count=count, updated_at=now,
+        )
+        for (granularity, dimension, bucket, value), count in totals.items()
+    ]
+    with transaction.atomic():
+        ActivityRollup.objects.filter(
+            bucket__gte=start, bucket__lt=end, dimension__in=REBUILT_DIMENSIONS
+        ).delete()
+        ActivityRollup.objects.bulk_create(rows, batch_size=500)
+    mark_rollups_updated()
+    return len(rows)
+
+
+def _rollup_rows(granularity, dimension, start):
+    from .models import ActivityRollup
+
+    return ActivityRollup.objects.filter(
+        granularity=granularity,
+        dimension=dimension,
+        bucket__gte=bucket_start(start, granularity),
+    )
+
+
+def get_rollup_totals(dimension, start):
+    """Tổng theo từng giá trị của một chiều từ start tới nay: [{dimension: value, 'count': n}]"""
+    totals = _rollup_rows('day', dimension, start).values('value').annotate(
+        total=Sum('count')
+    ).order_by('-total')
+    return [{dimension: item['value'], 'count': round(item['total'])} for item in totals]
+
+
+def get_rollup_series(granularity, dimension, start, value=None):
+    """
+    Chuỗi thời gian theo bucket từ start tới nay: [{'bucket': ..., 'count': n}]
+
+    value=None cộng mọi giá trị của chiều trong cùng bucket.
+    """
+    rows = _rollup_rows(granularity, dimension, start)
+    if value is not None:
+        rows = rows.filter(value=value)
+    series = rows.values('bucket').annotate(total=Sum('count')).order_by('bucket')
+    return [{'bucket': item['bucket'], 'count': round(item['total'])} for item in series]
@@ -0,0 +1,133 @@
+"""
+Phân loại route cho ActivityTrackingMiddleware: có theo dõi hay không và
+tên trang hiển thị trong thống kê.
+
+Bộ phân loại được dựng một lần từ settings (prefix/đuôi file bị loại trừ,
+map tên route -> tên trang, các regex dự phòng gộp thành một alternation)
+và ghi nhớ kết quả theo path bằng một LRU có giới hạn.
+"""
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.urls import Resolver404, resolve
+
+
+Route = namedtuple('Route', ['tracked', 'page_name', 'route_name', 'policy'])
+
+DEFAULT_EXCLUDED_PREFIXES = ('/static/', '/media/', '/admin/jsi18n/', '/favicon.ico')
+DEFAULT_EXCLUDED_EXTENSIONS = ('css', 'js', 'png', 'jpg', 'jpeg', 'gif', 'ico', 'woff', 'woff2', 'ttf', 'svg')
+
+# Chính sách ghi UserActivity cho một route:
+# - 'always': luôn ghi
+# - số thực p trong (0, 1): ghi ngẫu nhiên với xác suất p, dòng được ghi có weight = 1/p
+# - 'counters': chỉ cập nhật PageView/VisitorSession, không ghi UserActivity
+# - 'never': không theo dõi
+POLICY_ALWAYS = 'always'
+POLICY_COUNTERS = 'counters'
+POLICY_NEVER = 'never'
+
+
+def normalize_policy(policy):
+    """Kiểm tra và chuẩn hoá một chính sách theo dõi"""
+    if policy in (POLICY_ALWAYS, POLICY_COUNTERS, POLICY_NEVER):
+        return policy
+    if isinstance(policy, (int, float)) and not isinstance(policy, bool):
+        if policy >= 1:
+            return POLICY_ALWAYS
+        if policy <= 0:
+            return POLICY_COUNTERS
+        return float(policy)
+    raise ValueError(f'Invalid tracking policy: {policy!r}')
+
+
+class RouteClassifier:
+    """Phân loại path theo prefix, đuôi file, tên route Django và regex dự phòng"""
+
+    def __init__(self, excluded_prefixes=DEFAULT_EXCLUDED_PREFIXES,
+                 excluded_extensions=DEFAULT_EXCLUDED_EXTENSIONS,
+                 page_names=None, page_name_patterns=None, policies=None,
+                 default_policy=POLICY_COUNTERS, cache_size=2048):
+        self.excluded_prefixes = tuple(p.lower() for p in excluded_prefixes)
+        self.page_names = dict(page_names or {})
+        # Key của policies là tên route, hoặc path với các trang không có route
+        self.policies = {key: normalize_policy(value) for key, value in (policies or {}).items()}
+        self.default_policy = normalize_policy(default_policy)
+
+        extensions = '|'.join(re.escape(ext.lstrip('.')) for ext in excluded_extensions)
+        self._excluded_re = re.compile(rf'\.(?:{extensions})$', re.IGNORECASE) if extensions else None
+
+        # Gộp các regex dự phòng thành một alternation, nhóm nào khớp
+        # (match.lastgroup) cho biết tên trang
+        self._fallback_names = {}
+        alternatives = []
+        for index, (pattern, name) in enumerate((page_name_patterns or {}).items()):
+            group = f'p{index}'
+            self._fallback_names[group] = name
+            alternatives.append(f'(?P<{group}>{pattern})')
+        self._fallback_re = re.compile('|'.join(alternatives), re.IGNORECASE) if alternatives else None
+
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, path):
+        lower_path = path.lower()
+        if lower_path.startswith(self.excluded_prefixes):
+            return Route(False, path, None, POLICY_NEVER)
+        if self._excluded_re is not None and self._excluded_re.search(path):
+            return Route(False, path, None, POLICY_NEVER)
+
+        try:
+            route_name = resolve(path).url_name
+        except Resolver404:
+            route_name = None
+
+        policy = self.policies.get(route_name or path, self.default_policy)
+        if policy == POLICY_NEVER:
+            return Route(False, path, route_name, policy)
+
+        if route_name in self.page_names:
+            return Route(True, self.page_names[route_name], route_name, policy)
+
+        if self._fallback_re is not None:
+            match = self._fallback_re.match(path)
+            if match:
+                return Route(True, self._fallback_names[match.lastgroup], route_name, policy)
+
+        return Route(True, path, route_name, policy)
+
+    def cache_info(self):
+        return self.classify.cache_info()
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_route_classifier():
+    """Bộ phân loại dùng chung, được dựng một lần từ settings"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = RouteClassifier(
+                    excluded_prefixes=getattr(settings, 'ACTIVITY_TRACKING_EXCLUDED_PREFIXES', DEFAULT_EXCLUDED_PREFIXES),
+                    excluded_extensions=getattr(settings, 'ACTIVITY_TRACKING_EXCLUDED_EXTENSIONS', DEFAULT_EXCLUDED_EXTENSIONS),
+                    page_names=getattr(settings, 'ACTIVITY_TRACKING_PAGE_NAMES', {}),
+                    page_name_patterns=getattr(settings, 'ACTIVITY_TRACKING_PAGE_NAME_PATTERNS', {}),
+                    policies=getattr(settings, 'ACTIVITY_TRACKING_POLICIES', {}),
+                    default_policy=getattr(settings, 'ACTIVITY_TRACKING_DEFAULT_POLICY', POLICY_COUNTERS),
+                    cache_size=getattr(settings, 'ACTIVITY_TRACKING_ROUTE_CACHE_SIZE', 2048),
+                )
+    return _classifier
+
+
+def _reset_classifier(setting, **kwargs):
+    global _classifier
+    if setting.startswith('ACTIVITY_TRACKING_') or setting == 'ROOT_URLCONF':
+        _classifier = None
+
+
+setting_changed.connect(_reset_classifier)
@@ -0,0 +1,284 @@
+"""
+Theo dõi VisitorSession bằng upsert một câu lệnh và heartbeat có điều tiết.
+
+Mỗi lần ghi là một lệnh INSERT ... ON CONFLICT (session_key) DO UPDATE với
+page_views = page_views + n. last_activity/page_views của một session chỉ
+được ghi khi lần ghi trước đã cũ hơn VISITOR_SESSION_HEARTBEAT_SECONDS;
+trong khoảng đó các lượt xem được cộng dồn trong bộ nhớ, nên một loạt 20
+trang liên tiếp chỉ tốn một lần ghi.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from .rollups import record_session_starts
+from .user_agent import parse_user_agent
+
+
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+
+def upsert_visitor_sessions(rows):
+    """
+    Ghi các dòng VisitorSession bằng một lệnh upsert (executemany)
+
+    Args:
+        rows: List dict gồm session_key, user_id, ip_address, user_agent,
+              device_type, browser, os, page_views, last_activity
+    """
+    from .models import VisitorSession
+
+    if not rows:
+        return
+    if connection.vendor not in UPSERT_VENDORS:
+        _update_or_create_sessions(rows)
+        return
+
+    # Các session chưa có trong DB là phiên mới, được cộng vào thống kê gộp
+    # theo thiết bị/trình duyệt
+    existing = set(VisitorSession.objects.filter(
+        session_key__in=[row['session_key'] for row in rows]
+    ).values_list('session_key', flat=True))
+
+    meta = VisitorSession._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = ['session_key', 'user_id', 'ip_address', 'user_agent', 'device_type',
+               'browser', 'os', 'started_at', 'last_activity', 'page_views']
+    fields = {name: meta.get_field(name.removesuffix('_id')) for name in columns}
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(fields[c].column) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({qn('session_key')}) DO UPDATE SET "
+        f"{qn('page_views')} = {table}.{qn('page_views')} + excluded.{qn('page_views')}, "
+        f"{qn('user_id')} = COALESCE(excluded.{qn('user_id')}, {table}.{qn('user_id')}), "
+        f"{qn('last_activity')} = CASE WHEN excluded.{qn('last_activity')} > {table}.{qn('last_activity')} "
+        f"THEN excluded.{qn('last_activity')} ELSE {table}.{qn('last_activity')} END"
+    )
+
+    params = []
+    for row in rows:
+        values = dict(row, started_at=row['last_activity'])
+        params.append([
+            fields[c].get_db_prep_value(values[c], connection) for c in columns
+        ])
+
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+    record_session_starts([row for row in rows if row['session_key'] not in existing])
+
+
+def _update_or_create_sessions(rows):
+    """Dự phòng cho DB không hỗ trợ ON CONFLICT: UPDATE nguyên tử rồi mới INSERT"""
+    from .models import VisitorSession
+
+    started = []
+    for row in rows:
+        changes = {
+            'page_views': F('page_views') + row['page_views'],
+            'last_activity': row['last_activity'],
+        }
+        if row['user_id']:
+            changes['user_id'] = row['user_id']
+        if VisitorSession.objects.filter(session_key=row['session_key']).update(**changes):
+            continue
+        session, created = VisitorSession.objects.get_or_create(
+            session_key=row['session_key'],
+            defaults={
+                'user_id': row['user_id'],
+                'ip_address': row['ip_address'],
+                'user_agent': row['user_agent'],
+                'device_type': row['device_type'],
+                'browser': row['browser'],
+                'os': row['os'],
+                'page_views': row['page_views'],
+            }
+        )
+        if created:
+            started.append(row)
+        else:
+            VisitorSession.objects.filter(pk=session.pk).update(**changes)
+    record_session_starts(started)
+
+
+class _SessionState:
+    __slots__ = ('ip_address', 'user_agent', 'dims', 'user_id', 'pending',
+                 'last_activity', 'last_written', 'user_changed')
+
+    def __init__(self, ip_address, user_agent, dims):
+        self.ip_address = ip_address
+        self.user_agent = user_agent
+        self.dims = dims
+        self.user_id = None
+        self.pending = 0
+        self.last_activity = None
+        self.last_written = None
+        self.user_changed = False
+
+
+class SessionHeartbeat:
+    """
+    Trạng thái session trong process: số lượt xem chưa ghi, thời điểm ghi
+    gần nhất và device/browser/os đã biết (không cần phân tích lại UA).
+    """
+
+    def __init__(self, write=upsert_visitor_sessions, threshold=60, max_entries=50000):
+        self.write = write
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.writes = 0
+
+    def touch(self, session_key, count, timestamp, user_id=None, ip_address=None, user_agent=''):
+        """
+        Ghi nhận count lượt xem cho session; trả về (device_type, browser, os)
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._entries.get(session_key)
+            if state is None:
+                ua_info = parse_user_agent(user_agent)
+                state = _SessionState(ip_address, user_agent, (ua_info.device_type, ua_info.browser, ua_info.os))
+                self._entries[session_key] = state
+            else:
+                self._entries.move_to_end(session_key)
+
+            state.pending += count
+            if state.last_activity is None or timestamp > state.last_activity:
+                state.last_activity = timestamp
+            if user_id and user_id != state.user_id:
+                state.user_id = user_id
+                state.user_changed = True
+            self.hits += count
+
+            due = (
+                state.last_written is None
+                or state.user_changed
+                or now - state.last_written >= self.threshold
+            )
+            rows = [self._take(session_key, state, now)] if due else []
+            rows.extend(self._evict(now))
+            dims = state.dims
+
+        self._write(rows)
+        return dims
+
+    def knows(self, session_key, user_agent):
+        """Session đã được ghi nhận với đúng User-Agent này (tức đã phân loại là người dùng thật)"""
+        with self._lock:
+            state = self._entries.get(session_key)
+            return state is not None and state.user_agent == user_agent
+
+    def flush_due(self):
+        """Ghi các session có lượt xem đang chờ và đã quá ngưỡng heartbeat"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [
+                self._take(key, state, now)
+                for key, state in self._entries.items()
+                if state.pending and (
+                    state.last_written is None or now - state.last_written >= self.threshold
+                )
+            ]
+        self._write(rows)
+
+    def flush(self):
+        """Ghi mọi lượt xem đang chờ (dùng khi tắt worker)"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [
+                self._take(key, state, now)
+                for key, state in self._entries.items()
+                if state.pending
+            ]
+        self._write(rows)
+
+    def stats(self):
+        with self._lock:
+            pending = sum(state.pending for state in self._entries.values())
+            tracked = len(self._entries)
+        return {
+            'hits': self.hits,
+            'writes': self.writes,
+            'pending': pending,
+            'sessions': tracked,
+            'threshold': self.threshold,
+        }
+
+    def _take(self, session_key, state, now):
+        row = {
+            'session_key': session_key,
+            'user_id': state.user_id,
+            'ip_address': state.ip_address,
+            'user_agent': state.user_agent,
+            'device_type': state.dims[0],
+            'browser': state.dims[1],
+            'os': state.dims[2],
+            'page_views': state.pending,
+            'last_activity': state.last_activity,
+        }
+        state.pending = 0
+        state.user_changed = False
+        state.last_written = now
+        return row
+
+    def _evict(self, now):
+        # Bỏ các session cũ nhất khi vượt giới hạn bộ nhớ; lượt xem còn chờ
+        # của chúng được trả về để ghi ngay
+        rows = []
+        while len(self._entries) > self.max_entries:
+            key, state = self._entries.popitem(last=False)
+            if state.pending:
+                rows.append(self._take(key, state, now))
+        return rows
+
+    def _write(self, rows):
+        if not rows:
+            return
+        try:
+            self.write(rows)
+            self.writes += len(rows)
+        except Exception:
+            # Trả lại lượt xem để lần ghi sau cộng tiếp
+            with self._lock:
+                for row in rows:
+                    state = self._entries.get(row['session_key'])
+                    if state is None:
+                        # Session đã bị bỏ khỏi bộ nhớ khi vượt giới hạn
+                        state = _SessionState(
+                            row['ip_address'], row['user_agent'], (row['device_type'], row['browser'], row['os'])
+                        )
+                        state.user_id = row['user_id']
+                        state.last_activity = row['last_activity']
+                        self._entries[row['session_key']] = state
+                    state.pending += row['page_views']
+                    state.last_written = None
+            raise
+
+
+_heartbeat = None
+_heartbeat_lock = threading.Lock()
+
+
+def get_session_heartbeat():
+    """Heartbeat VisitorSession dùng chung của process"""
+    global _heartbeat
+    if _heartbeat is None:
+        with _heartbeat_lock:
+            if _heartbeat is None:
+                _heartbeat = SessionHeartbeat(
+                    threshold=getattr(settings, 'VISITOR_SESSION_HEARTBEAT_SECONDS', 60),
+                    max_entries=getattr(settings, 'VISITOR_SESSION_MAX_TRACKED', 50000),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_heartbeat.flush_due)
+                register_shutdown_flusher(_heartbeat.flush)
+    return _heartbeat
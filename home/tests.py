@@ -1,3 +1,1251 @@
-from django.test import TestCase
+import gzip
+import json
+import re
+import tempfile
+from importlib import import_module
+from io import StringIO
+from datetime import time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .activity_archive import ARCHIVE_FIELDS, archive_activities, iter_archived_activities
+from .activity_export import iter_export_rows, iter_keyset
+from .activity_tracker import get_analytics_data, get_recent_activities, get_user_activity_summary
+from .availability import find_free_courts, hour_mask
+from .counters import CoalescingCounter, _apply_page_views, get_page_view_counter
+from .daily_stats import STATS_FIELDS, WATERMARK_NAME, backfill_daily_stats, day_start, update_daily_stats
+from .dashboard import get_dashboard_data, get_dashboard_version
+from .hyperloglog import HyperLogLog
+from .leaderboard import get_top_users
+from .middleware import VISITOR_ID_RE, VISITOR_ID_SALT
+from .presence import get_online_count, get_online_user_ids, record_presence
+from .models import (
+    ActivityRollup, Booking, CourtSlot, CustomUser, DailyStats, Invoice, PageView, ProcessingWatermark, SlotHold,
+    Tennis, TransactionHistory, UserActivity, UserDailyActivity, UserStats, VisitorSession,
+)
+from .reservations import (
+    HoldSweeper, InsufficientBalance, SlotUnavailable, book_recurring, hold_slot, reserve_slot, sweep_expired_holds,
+    weekly_dates,
+)
+from .rollups import _upsert_rollups, bucket_start, get_rollup_counter, rebuild_rollups
+from .route_classifier import POLICY_ALWAYS, POLICY_COUNTERS, POLICY_NEVER, Route, RouteClassifier, normalize_policy
+from .session_tracking import SessionHeartbeat, get_session_heartbeat, upsert_visitor_sessions
+from .tracking_buffer import PeriodicRunner, TrackingBuffer
+from .user_agent import EMPTY_USER_AGENT, UserAgentParser, parse_user_agent
+from .user_stats import UserStatsBuffer, _build_entries, get_user_stats, get_user_stats_buffer, rebuild_user_stats
+from .visitor_sketches import OTHER_SCOPE, SITE_SCOPE, VisitorSketchBuffer, page_scope
+
+
+# Các bảng lớn dần theo thời gian: truy vấn trên các bảng này không được quét toàn bộ
+LARGE_TABLES = {
+    UserActivity._meta.db_table,
+    VisitorSession._meta.db_table,
+    Booking._meta.db_table,
+    CourtSlot._meta.db_table,
+    TransactionHistory._meta.db_table,
+    Invoice._meta.db_table,
+}
+
+BROWSER_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+)
+
+GOOGLEBOT_USER_AGENT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+CUBOT_USER_AGENT = (
+    'Mozilla/5.0 (Linux; Android 10; CUBOT KINGKONG 5 Pro) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/90.0 Mobile Safari/537.36'
+)
+
+# "SCAN <bảng>" không kèm "USING ... INDEX" là quét toàn bảng
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class QueryPlanTests(TestCase):
+    """
+    Chạy các view/hàm nóng trên dữ liệu mẫu, lấy EXPLAIN QUERY PLAN của mọi
+    câu SELECT và báo lỗi khi có quét toàn bảng trên LARGE_TABLES.
+    """
+
+    USERS = 40
+    COURTS = 30
+    SLOT_DAYS = 60
+    BOOKINGS = 1500
+    TRANSACTIONS = 1500
+    ACTIVITIES = 4000
+    SESSIONS = 1500
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        password = make_password('secret123')
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                userID=f'U{i:07d}', username=f'user{i}', email=f'user{i}@example.com',
+                password=password, role='admin' if i == 0 else 'user', balance=1000,
+            )
+            for i in range(cls.USERS)
+        ])
+        cls.admin = users[0]
+        cls.user = users[1]
+
+        courts = Tennis.objects.bulk_create([
+            Tennis(
+                name=f'Court {i}', price=100 + i, squared=200, limit=4,
+                court_address=f'{i} Tennis Street', hours=1,
+                playTime='08:00 - 09:00, 09:00 - 10:00',
+            )
+            for i in range(cls.COURTS)
+        ])
+        cls.court = courts[0]
+
+        today = timezone.localdate()
+        slots = CourtSlot.objects.bulk_create([
+            CourtSlot(court=court, date=today + timedelta(days=day), start_time=time(hour), end_time=time(hour + 1))
+            for court in courts
+            for day in range(cls.SLOT_DAYS)
+            for hour in (8, 9)
+        ])
+        Booking.objects.bulk_create([
+            Booking(
+                user=users[i % cls.USERS], tennis_court=slots[i].court, slot=slots[i],
+                play_time=slots[i].label, created_at=now - timedelta(hours=i),
+            )
+            for i in range(cls.BOOKINGS)
+        ])
+        TransactionHistory.objects.bulk_create([
+            TransactionHistory(
+                user=users[i % cls.USERS],
+                transaction_type='Deposit' if i % 2 else 'Payment',
+                amount=10,
+            )
+            for i in range(cls.TRANSACTIONS)
+        ])
+        Invoice.objects.bulk_create([
+            Invoice(user=users[i % cls.USERS], amount=100, status='Paid' if i % 3 else 'Pending')
+            for i in range(cls.TRANSACTIONS)
+        ])
+        UserActivity.objects.bulk_create([
+            UserActivity(
+                user=users[i % cls.USERS] if i % 4 else None,
+                activity_type=('page_view', 'login', 'booking', 'top_up')[i % 4],
+                ip_address=f'10.0.{i % 250}.{i % 200}',
+            )
+            for i in range(cls.ACTIVITIES)
+        ])
+        VisitorSession.objects.bulk_create([
+            VisitorSession(session_key=f'session{i:08d}', ip_address='10.0.0.1', device_type='desktop')
+            for i in range(cls.SESSIONS)
+        ])
+
+        # Cập nhật thống kê để bộ lập kế hoạch của SQLite chọn index như trên dữ liệu thật
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN checks are written for SQLite')
+        # Client mặc định không gửi User-Agent (bị coi là bot, bỏ qua theo dõi)
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScans(self, func):
+        """Chạy func và kiểm tra kế hoạch của mọi câu SELECT nó sinh ra"""
+        with CaptureQueriesContext(connection) as context:
+            context.response = func()
+
+        problems = []
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            # SQL đã được điền sẵn tham số (last_executed_query của SQLite có quote)
+            for detail in self.explain(sql):
+                match = FULL_SCAN_RE.match(detail.strip())
+                if match and match.group(1) in LARGE_TABLES:
+                    problems.append(f'{detail}\n    {sql}')
+        self.assertFalse(problems, 'Full table scans:\n' + '\n'.join(problems))
+        return context
+
+    def assertPage(self, context, template, model):
+        """Trang trả về 200 với template và đã đọc bảng của model"""
+        self.assertEqual(context.response.status_code, 200)
+        self.assertTemplateUsed(context.response, template)
+        table = model._meta.db_table
+        self.assertTrue(
+            any(f'FROM "{table}"' in query['sql'] for query in context.captured_queries),
+            f'{table} was not queried',
+        )
+
+    def login(self, user):
+        self.client.force_login(user)
+
+    def test_get_analytics_data(self):
+        self.assertNoFullScans(lambda: get_analytics_data(30))
+
+    def test_recent_activities(self):
+        self.assertNoFullScans(lambda: list(get_recent_activities(50)))
+
+    def test_user_activity_summary(self):
+        self.assertNoFullScans(lambda: get_user_activity_summary(self.user))
+        # Khi đã có UserStats: một lần đọc theo khoá chính
+        with self.assertNumQueries(1):
+            get_user_activity_summary(self.user)
+
+    def test_top_up_daily_limit(self):
+        self.login(self.user)
+        # Dữ liệu sai: view chạy đủ các bước kiểm tra (kể cả hạn mức ngày) rồi trả lỗi
+        self.assertNoFullScans(lambda: self.client.post('/top_up', {'payment_type': 'wallet', 'amount': '20'}))
+
+    def test_detail(self):
+        self.login(self.user)
+        context = self.assertNoFullScans(lambda: self.client.get('/detail/', {'id': self.court.id}))
+        self.assertPage(context, 'apps/detail.html', CourtSlot)
+        self.assertTrue(context.response.context['tennis_courts'][0].slot_list)
+
+    def test_rent_court(self):
+        self.login(self.user)
+        context = self.assertNoFullScans(lambda: self.client.get(f'/rent_court/{self.court.id}/'))
+        self.assertPage(context, 'apps/detail.html', CourtSlot)
+
+    def test_my_bookings(self):
+        self.login(self.user)
+        context = self.assertNoFullScans(lambda: self.client.get('/booking/'))
+        self.assertPage(context, 'apps/my_bookings.html', Booking)
+        bookings = context.response.context['bookings']
+        self.assertEqual(len(bookings), Booking.objects.filter(user=self.user).count())
+
+    def test_search_courts(self):
+        self.login(self.user)
+        context = self.assertNoFullScans(lambda: self.client.get('/search/', {'name': 'Court 1'}))
+        self.assertPage(context, 'apps/property-list.html', Tennis)
+        names = {court.name for court in context.response.context['tennis_courts']}
+        self.assertEqual(names, set(Tennis.objects.filter(name__icontains='Court 1').values_list('name', flat=True)))
+
+    @override_settings(ACTIVITY_DETAIL_MAX_ROWS=30)
+    def test_user_activity_detail_range(self):
+        self.login(self.admin)
+        today = timezone.localdate()
+        response = self.assertNoFullScans(lambda: self.client.get(
+            f'/analytics/user/{self.user.userID}/', {'start': (today - timedelta(days=7)).isoformat(), 'end': today.isoformat()}
+        )).response
+        self.assertEqual(response.status_code, 200)
+        # Khoảng thời gian có nhiều hoạt động hơn giới hạn: chỉ đọc ACTIVITY_DETAIL_MAX_ROWS dòng mới nhất
+        self.assertEqual(response.context['activities'].paginator.count, 30)
+
+    def test_search_free_courts(self):
+        from .availability import find_free_courts
+
+        self.login(self.user)
+        date = timezone.localdate() + timedelta(days=1)
+        response = self.assertNoFullScans(
+            lambda: self.client.get('/search/', {'date': date.isoformat(), 'start': '8', 'end': '10'})
+        ).response
+        self.assertEqual(response.status_code, 200)
+        booked = set(CourtSlot.objects.filter(date=date, bookings__isnull=False).values_list('court_id', flat=True))
+        free = set(CourtSlot.objects.filter(date=date).values_list('court_id', flat=True)) - booked
+        self.assertTrue(booked)
+        self.assertTrue(free)
+        self.assertEqual(find_free_courts(date, time(8), time(10)), free)
+        self.assertEqual({court.id for court in response.context['tennis_courts']}, free)
+
+
+class TrackingBufferTests(SimpleTestCase):
+    @override_settings(ACTIVITY_TRACKING_BACKGROUND=True)
+    def test_writer_error_counted_as_failed(self):
+        def writer(batch):
+            raise RuntimeError('db down')
+
+        buffer = TrackingBuffer(writer, overflow_policy='sync', maxsize=1)
+        buffer._ensure_started = lambda: None
+        self.assertTrue(buffer.put({'n': 1}))
+        self.assertFalse(buffer.put({'n': 2}))  # Hàng đợi đầy: ghi trực tiếp và lỗi
+        stats = buffer.stats()
+        self.assertEqual((stats['enqueued'], stats['dropped'], stats['failed']), (1, 0, 1))
+        self.assertIn('db down', stats['last_error'])
+
+    @override_settings(ACTIVITY_TRACKING_BACKGROUND=False)
+    def test_writes_directly_without_background_thread(self):
+        written = []
+        buffer = TrackingBuffer(written.extend)
+        self.assertTrue(buffer.put({'n': 1}))
+        self.assertEqual(written, [{'n': 1}])
+        self.assertIsNone(buffer._thread)
+        self.assertEqual(buffer.stats()['pending'], 0)
+
+    def test_periodic_runner_runs_every_hook(self):
+        calls = []
+
+        def broken():
+            raise RuntimeError('boom')
+
+        runner = PeriodicRunner([broken, lambda: calls.append(1)])
+        runner.run_once()
+        self.assertEqual(calls, [1])
+
+
+class CoalescingCounterTests(TestCase):
+    def test_adds_for_same_key_coalesce_into_one_write(self):
+        flushed = []
+        counter = CoalescingCounter(apply=flushed.append, flush_interval=60)
+        for _ in range(3):
+            counter.add('/home/', meta='Trang chủ')
+        counter.add('/home/', count=2, meta='Khác')
+        counter.add('/courts/')
+        self.assertEqual(flushed, [])
+
+        counter.flush()
+        self.assertEqual(flushed, [{'/home/': (5, 'Trang chủ'), '/courts/': (1, None)}])
+        self.assertEqual(counter.stats()['writes'], 2)
+        self.assertEqual(counter.stats()['increments'], 6)
+
+    def test_failed_flush_requeues_increments(self):
+        def broken(pending):
+            raise RuntimeError('db down')
+
+        counter = CoalescingCounter(apply=broken, flush_interval=60)
+        counter.add('/home/', count=2, meta='Trang chủ')
+        with self.assertRaises(RuntimeError):
+            counter.flush()
+        counter.add('/home/')
+        self.assertEqual(counter.stats()['pending'], 3)
+
+        flushed = []
+        counter.apply = flushed.append
+        counter.flush()
+        self.assertEqual(flushed, [{'/home/': (3, 'Trang chủ')}])
+        self.assertEqual(counter.stats()['pending'], 0)
+
+    def test_apply_upserts_page_views(self):
+        counter = CoalescingCounter(apply=_apply_page_views, flush_interval=60)
+        counter.add('/home/', count=2, meta='Trang chủ')
+        counter.flush()
+        counter.add('/home/', count=3, meta='Khác')
+        counter.flush()
+
+        page = PageView.objects.get(page_url='/home/')
+        self.assertEqual((page.view_count, page.page_name), (5, 'Trang chủ'))
+
+    def test_record_view_when_row_created_concurrently(self):
+        # Dòng được tạo giữa UPDATE (0 dòng) và get_or_create: vẫn cộng đủ lượt xem
+        PageView.objects.create(page_url='/home/', view_count=4)
+        real_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update):
+            PageView.record_view('/home/', count=2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(PageView.objects.get(page_url='/home/').view_count, 6)
+
+
+class RollupRebuildTests(TestCase):
+    def test_rebuild_keeps_archived_days(self):
+        old = timezone.now() - timedelta(days=200)
+        activities = UserActivity.objects.bulk_create([
+            UserActivity(activity_type='login', ip_address='10.0.0.1') for _ in range(3)
+        ])
+        UserActivity.objects.filter(pk__in=[a.pk for a in activities]).update(created_at=old)
+
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(ACTIVITY_ARCHIVE_DIR=archive_dir):
+            self.assertEqual(archive_activities(), 3)
+            self.assertFalse(UserActivity.objects.exists())
+            rebuild_rollups(old - timedelta(days=1), old + timedelta(days=1))
+
+        day = ActivityRollup.objects.get(
+            granularity='day', dimension='activity_type', value='login', bucket=bucket_start(old, 'day')
+        )
+        self.assertEqual(day.count, 3)
+
+    def test_migration_reads_archive_without_app_code(self):
+        backfill = import_module('home.migrations.0019_activityrollup')
+        old = timezone.now() - timedelta(days=200)
+        activity = UserActivity.objects.create(activity_type='login', ip_address='10.0.0.1', weight=2.0)
+        UserActivity.objects.filter(pk=activity.pk).update(created_at=old)
+
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(ACTIVITY_ARCHIVE_DIR=archive_dir):
+            archive_activities()
+            with mock.patch('home.activity_archive.iter_archived_activities', side_effect=AssertionError):
+                self.assertEqual(list(backfill._iter_archived_rows()), [(old, 'login', 2.0)])
+
+    def test_command_rejects_invalid_dates(self):
+        for options in ({'start': 'hôm qua'}, {'end': '2026-02-30'}, {'start': '2026-03-02', 'end': '2026-03-01'}):
+            with self.subTest(**options), self.assertRaises(CommandError):
+                call_command('rebuild_rollups', stdout=StringIO(), **options)
+
+
+class VisitorSketchTests(SimpleTestCase):
+    def test_estimate_within_error(self):
+        sketch = HyperLogLog()
+        for n in range(20000):
+            sketch.add(f'10.0.{n // 256}.{n % 256}-{n}')
+        self.assertLess(abs(sketch.count() - 20000) / 20000, 3 * sketch.relative_error)
+        self.assertEqual(HyperLogLog.from_bytes(sketch.to_bytes()).count(), sketch.count())
+
+    def test_merge_is_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for n in range(6000):
+            first.add(f'visitor-{n}')
+        for n in range(3000, 9000):
+            second.add(f'visitor-{n}')
+        union = HyperLogLog.union([first, second])
+        self.assertLess(abs(union.count() - 9000) / 9000, 3 * union.relative_error)
+        # Gộp lại cùng một sketch không làm thay đổi ước lượng
+        self.assertEqual(HyperLogLog.union([union, first, second]).count(), union.count())
+
+    def test_unknown_paths_share_one_sketch(self):
+        buffer = VisitorSketchBuffer()
+        day = timezone.localdate()
+        for n in range(100):
+            buffer.add(day, f'10.0.0.{n}', page_scope(None))
+        buffer.add(day, '10.0.0.1', page_scope('court-detail'))
+        self.assertEqual(
+            set(buffer._pending), {(day, SITE_SCOPE), (day, OTHER_SCOPE), (day, 'court-detail')}
+        )
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(userID='U9000001', username='stats', email='stats@example.com')
+
+    def test_spend_comes_from_paid_invoices(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(user=self.user, amount=150, status='Paid')
+            Invoice.objects.create(user=self.user, amount=50, status='Pending')
+        get_user_stats_buffer().flush()
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).total_spend, 150)
+        rebuild_user_stats([self.user.pk])
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).total_spend, 150)
+
+    def test_flush_of_new_users_skips_archive(self):
+        other = CustomUser.objects.create(userID='U9000002', username='stats2', email='stats2@example.com')
+        UserActivity.objects.bulk_create([
+            UserActivity(user=user, activity_type='login', ip_address='10.0.0.1') for user in (self.user, other)
+        ])
+        buffer = UserStatsBuffer(flush_interval=60)
+        for user in (self.user, other):
+            buffer.add(user.pk, 'login', timezone.now())
+        with mock.patch('home.activity_archive.iter_archived_activities', side_effect=AssertionError):
+            buffer.flush()
+        self.assertEqual(UserStats.objects.get(pk=other.pk).counts, {'login': 1})
+
+    def test_concurrent_first_flush_is_not_double_counted(self):
+        UserActivity.objects.create(user=self.user, activity_type='login', ip_address='10.0.0.1')
+
+        def build_after_other_worker(*args, **kwargs):
+            entries = _build_entries(*args, **kwargs)
+            # Worker khác tạo dòng của user ngay trước bulk_create của worker này
+            UserStats.objects.create(user=self.user, counts={'login': 1}, total_activities=1)
+            return entries
+
+        buffer = UserStatsBuffer(flush_interval=60)
+        buffer.add(self.user.pk, 'login', timezone.now())
+        with mock.patch('home.user_stats._build_entries', build_after_other_worker):
+            buffer.flush()
+        self.assertEqual(buffer.stats()['pending_users'], 0)
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).counts, {'login': 1})
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(userID='U9100001', username='player', email='player@example.com', balance=150)
+        self.court = Tennis.objects.create(
+            name='Court A', price=100, squared=200, limit=4, court_address='1 Tennis Street', hours=1,
+            playTime='08:00 - 09:00',
+        )
+        self.slot = CourtSlot.objects.create(
+            court=self.court, date=timezone.localdate() + timedelta(days=1), start_time=time(8), end_time=time(9)
+        )
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+        self.client.force_login(self.user)
+
+    def checkout_with_balance(self):
+        response = self.client.post(f'/rent_court/{self.court.id}/', {'slot_id': self.slot.id})
+        self.assertRedirects(response, '/checkout/', fetch_redirect_response=False)
+        return self.client.post('/checkout/', {'pay': '1', 'payment_method': 'balance'})
+
+    def test_checkout_deducts_balance(self):
+        response = self.checkout_with_balance()
+        self.assertRedirects(response, '/booking_success', fetch_redirect_response=False)
+        self.assertTrue(Booking.objects.filter(slot=self.slot, user=self.user).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 50)
+
+    def test_checkout_rechecks_balance_under_lock(self):
+        # Số dư bị tiêu ở nơi khác sau khi đã giữ chỗ
+        self.client.post(f'/rent_court/{self.court.id}/', {'slot_id': self.slot.id})
+        CustomUser.objects.filter(pk=self.user.pk).update(balance=40)
+        response = self.client.post('/checkout/', {'pay': '1', 'payment_method': 'balance'})
+        self.assertRedirects(response, '/checkout/', fetch_redirect_response=False)
+        self.assertFalse(Booking.objects.filter(slot=self.slot).exists())
+        self.assertFalse(Invoice.objects.filter(user=self.user).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 40)
+
+    def expire_holds(self):
+        SlotHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_past_slots_cannot_be_held_or_booked(self):
+        started = CourtSlot.objects.create(
+            court=self.court, date=timezone.localdate() - timedelta(days=1), start_time=time(8), end_time=time(9)
+        )
+        with self.assertRaises(SlotUnavailable):
+            hold_slot(self.user, self.court, started.id)
+        with self.assertRaises(SlotUnavailable):
+            reserve_slot(self.user, self.court, started.id)
+        self.assertFalse(SlotHold.objects.exists())
+        self.assertFalse(Booking.objects.exists())
+
+    def test_detail_shows_slots_of_requested_date(self):
+        date = timezone.localdate() + timedelta(days=3)
+        response = self.client.get('/detail/', {'id': self.court.id, 'date': date.isoformat()})
+        self.assertEqual(response.context['slot_date'], date)
+        self.assertEqual([slot.date for slot in response.context['tennis_courts'][0].slot_list], [date])
+
+        # Ngày đã qua hoặc sai định dạng: quay về ngày mặc định của sân
+        for value in ((timezone.localdate() - timedelta(days=1)).isoformat(), '2026-02-30', 'mai'):
+            response = self.client.get('/detail/', {'id': self.court.id, 'date': value})
+            self.assertEqual(response.context['slot_date'], timezone.localdate())
+
+    def test_expired_hold_can_be_taken_over(self):
+        other = CustomUser.objects.create(userID='U9100002', username='rival', email='rival@example.com', balance=150)
+        hold_slot(self.user, self.court, self.slot.id)
+        with self.assertRaises(SlotUnavailable):
+            hold_slot(other, self.court, self.slot.id)
+        self.expire_holds()
+        self.assertEqual(hold_slot(other, self.court, self.slot.id).user, other)
+
+    def test_sweep_removes_only_expired_holds(self):
+        other_slot = CourtSlot.objects.create(
+            court=self.court, date=self.slot.date, start_time=time(9), end_time=time(10)
+        )
+        hold_slot(self.user, self.court, self.slot.id)
+        self.expire_holds()
+        other = CustomUser.objects.create(userID='U9100002', username='rival', email='rival@example.com')
+        hold_slot(other, self.court, other_slot.id)
+
+        sweeper = HoldSweeper(interval=60)
+        self.assertEqual(sweeper.run_once(), 1)
+        self.assertEqual(sweeper.released, 1)
+        self.assertEqual(list(SlotHold.objects.values_list('slot_id', flat=True)), [other_slot.id])
+
+        self.expire_holds()
+        out = StringIO()
+        call_command('sweep_slot_holds', stdout=out)
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_losing_checkout_is_not_charged(self):
+        other = CustomUser.objects.create(userID='U9100002', username='rival', email='rival@example.com')
+        # Người dùng giữ chỗ đã hết hạn, người khác đặt mất slot trước khi thanh toán
+        self.client.post(f'/rent_court/{self.court.id}/', {'slot_id': self.slot.id})
+        self.expire_holds()
+        reserve_slot(other, self.court, self.slot.id)
+
+        response = self.client.post('/checkout/', {'pay': '1', 'payment_method': 'balance'})
+        self.assertRedirects(response, f'/detail/?id={self.court.id}', fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.get(slot=self.slot).user, other)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 150)
+        self.assertNotIn('temp_booking', self.client.session)
+
+
+@override_settings(AVAILABILITY_CACHE_TTL=300, AVAILABILITY_LOCAL_CACHE_TTL=300)
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(userID='U9400001', username='finder', email='finder@example.com')
+        self.date = timezone.localdate() + timedelta(days=1)
+        self.hourly = self.court('Court Hourly', [(8, 9), (9, 10)])
+        self.double = self.court('Court Double', [(8, 10)])
+        self.late = self.court('Court Late', [(22, 0)])
+        self.slot = CourtSlot.objects.get(court=self.hourly, start_time=time(9))
+
+    def court(self, name, hours):
+        court = Tennis.objects.create(
+            name=name, price=100, squared=200, limit=4, court_address='1 Tennis Street', hours=1, playTime='08:00 - 09:00',
+        )
+        CourtSlot.objects.bulk_create([
+            CourtSlot(court=court, date=self.date, start_time=time(start), end_time=time(end)) for start, end in hours
+        ])
+        return court
+
+    def book(self):
+        return Booking.objects.create(user=self.user, tennis_court=self.hourly, slot=self.slot, play_time='09:00 - 10:00')
+
+    def test_hour_mask(self):
+        self.assertEqual(hour_mask(8, 10), 0b11 << 8)
+        self.assertEqual(hour_mask(time(8, 30), time(9, 15)), 0b11 << 8)  # Giờ lẻ phủ cả giờ chứa nó
+        self.assertEqual(hour_mask(time(22), time(0)), 0b11 << 22)  # 00:00 là nửa đêm cuối ngày
+        self.assertEqual(hour_mask(0, 24), (1 << 24) - 1)
+        self.assertEqual(hour_mask(10, 8), 0)
+
+    def test_find_free_courts(self):
+        self.book()
+        everything = {self.hourly.id, self.double.id, self.late.id}
+        self.assertEqual(find_free_courts(self.date), everything)
+        self.assertEqual(find_free_courts(self.date, time(8), time(9)), {self.hourly.id, self.double.id})
+        self.assertEqual(find_free_courts(self.date, time(8), time(10)), {self.double.id})
+        # Chạm một phần vào giờ đã đặt cũng không còn trống
+        self.assertEqual(find_free_courts(self.date, time(8, 30), time(9, 30)), {self.double.id})
+        self.assertEqual(find_free_courts(self.date, time(23), time(0)), {self.late.id})
+        self.assertEqual(find_free_courts(self.date, 22, 24), {self.late.id})
+        self.assertEqual(find_free_courts(self.date, time(21), time(0)), set())
+
+    def test_cache_is_invalidated_by_bookings(self):
+        self.assertIn(self.hourly.id, find_free_courts(self.date, time(9), time(10)))
+        booking = self.book()
+        self.assertNotIn(self.hourly.id, find_free_courts(self.date, time(9), time(10)))
+        booking.delete()
+        self.assertIn(self.hourly.id, find_free_courts(self.date, time(9), time(10)))
+
+    def test_cache_is_invalidated_by_expired_holds(self):
+        hold_slot(self.user, self.hourly, self.slot.id)
+        self.assertNotIn(self.hourly.id, find_free_courts(self.date, time(9), time(10)))
+        SlotHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(sweep_expired_holds(), 1)
+        self.assertIn(self.hourly.id, find_free_courts(self.date, time(9), time(10)))
+
+    def test_search_filters(self):
+        self.book()
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+
+        def found(**params):
+            response = self.client.get('/search/', {'date': self.date.isoformat(), **params})
+            self.assertEqual(response.status_code, 200)
+            return {court.id for court in response.context['tennis_courts']}
+
+        self.assertEqual(found(), {self.hourly.id, self.double.id, self.late.id})
+        self.assertEqual(found(start='9', end='10'), {self.double.id})
+        self.assertEqual(found(start='8:00', end='9:00'), {self.hourly.id, self.double.id})
+        self.assertEqual(found(start='23'), {self.late.id})  # Không có giờ kết thúc: tới hết ngày
+        self.assertEqual(found(start='22', end='24'), {self.late.id})
+
+        for params in ({'date': '2026-02-30'}, {'date': 'mai'}, {'start': '10', 'end': '9'}, {'start': '25'}):
+            with self.subTest(**params):
+                response = self.client.get('/search/', {'date': self.date.isoformat(), **params})
+                self.assertRedirects(response, '/property_list/', fetch_redirect_response=False)
+
+
+class RouteClassifierTests(SimpleTestCase):
+    def setUp(self):
+        self.classifier = RouteClassifier(
+            page_names={'detail': 'Chi tiết sân'},
+            page_name_patterns={r'^/blog/\d+/$': 'Bài viết'},
+            policies={'checkout': POLICY_NEVER, 'detail': 0.25},
+        )
+
+    def test_static_files_are_excluded(self):
+        for path in ('/static/css/site.css', '/media/court.jpg', '/favicon.ico', '/anything/logo.PNG'):
+            self.assertEqual(self.classifier.classify(path), Route(False, path, None, POLICY_NEVER))
+
+    def test_page_names_and_policies(self):
+        self.assertEqual(self.classifier.classify('/detail/'), Route(True, 'Chi tiết sân', 'detail', 0.25))
+        self.assertEqual(self.classifier.classify('/checkout/').tracked, False)
+        # Không có route: tên trang theo regex dự phòng, rồi theo path
+        self.assertEqual(self.classifier.classify('/blog/12/'), Route(True, 'Bài viết', None, POLICY_COUNTERS))
+        self.assertEqual(self.classifier.classify('/no-such-page/'), Route(True, '/no-such-page/', None, POLICY_COUNTERS))
+
+    def test_results_are_cached(self):
+        self.classifier.classify('/detail/')
+        self.classifier.classify('/detail/')
+        self.assertEqual(self.classifier.cache_info().hits, 1)
+
+    def test_normalize_policy(self):
+        self.assertEqual(normalize_policy(1), POLICY_ALWAYS)
+        self.assertEqual(normalize_policy(0), POLICY_COUNTERS)
+        self.assertEqual(normalize_policy(0.1), 0.1)
+        with self.assertRaises(ValueError):
+            normalize_policy('sometimes')
+
+
+class UserAgentTests(SimpleTestCase):
+    def test_classification(self):
+        parser = UserAgentParser()
+        cases = {
+            BROWSER_USER_AGENT: ('desktop', 'Chrome', False),
+            GOOGLEBOT_USER_AGENT: ('bot', 'Googlebot', True),
+            'Mozilla/5.0 (compatible; bingbot/2.0)': ('bot', 'Bingbot', True),
+            'Mozilla/5.0 (compatible; UptimeRobot/2.0; http://www.uptimerobot.com/)': ('bot', 'Uptime monitor', True),
+            'curl/8.4.0': ('bot', 'HTTP client', True),
+            # Hãng điện thoại có "bot" trong tên và UA có chữ "monitor" không phải bot
+            CUBOT_USER_AGENT: ('mobile', 'Chrome', False),
+            BROWSER_USER_AGENT + ' NetMonitor/2.1': ('desktop', 'Chrome', False),
+        }
+        for user_agent, expected in cases.items():
+            with self.subTest(user_agent=user_agent):
+                info = parser.parse(user_agent)
+                self.assertEqual((info.device_type, info.browser, info.is_bot), expected)
+
+    def test_allow_and_deny_patterns(self):
+        parser = UserAgentParser(deny_patterns=['netmonitor'], allow_patterns=['partnerbot'], empty_is_bot=True)
+        self.assertTrue(parser.parse(BROWSER_USER_AGENT + ' NetMonitor/2.1').is_bot)
+        self.assertFalse(parser.parse('PartnerBot/1.0 ' + BROWSER_USER_AGENT).is_bot)
+        self.assertEqual(parser.parse('').browser, EMPTY_USER_AGENT)
+
+    def test_cache_counts_hits(self):
+        parser = UserAgentParser(cache_size=2)
+        for user_agent in (BROWSER_USER_AGENT, BROWSER_USER_AGENT, CUBOT_USER_AGENT, BROWSER_USER_AGENT):
+            parser.parse(user_agent)
+        stats = parser.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class BotDetectionReuseTests(TestCase):
+    def test_known_session_is_not_parsed_again(self):
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+        with mock.patch('home.middleware.parse_user_agent', wraps=parse_user_agent) as parse:
+            self.client.get('/contact/')
+            self.assertEqual(parse.call_count, 1)
+            self.client.get('/contact/')
+            self.client.get('/about/')
+            self.assertEqual(parse.call_count, 1)
+
+            # Cùng cookie nhưng đổi UA: phân loại lại
+            self.client.get('/contact/', HTTP_USER_AGENT='curl/8.4.0')
+            self.assertEqual(parse.call_count, 2)
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class BotTrackingTests(TestCase):
+    def setUp(self):
+        # Bộ đếm và heartbeat riêng cho test, không lẫn dữ liệu chờ ghi của test khác
+        for target, value in (
+            ('home.session_tracking._heartbeat', SessionHeartbeat()),
+            ('home.counters._page_view_counter', CoalescingCounter(apply=_apply_page_views)),
+            ('home.rollups._rollup_counter', CoalescingCounter(apply=_upsert_rollups)),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def flush(self):
+        get_session_heartbeat().flush()
+        get_page_view_counter().flush()
+        get_rollup_counter().flush()
+
+    def test_crawler_counted_only_as_bot(self):
+        with mock.patch('home.visitor_sketches.record_visitor') as record_visitor:
+            for user_agent in (GOOGLEBOT_USER_AGENT, GOOGLEBOT_USER_AGENT, 'curl/8.4.0'):
+                response = self.client.get('/contact/', HTTP_USER_AGENT=user_agent)
+        self.flush()
+
+        self.assertNotIn('vid', response.cookies)
+        self.assertFalse(PageView.objects.exists())
+        self.assertFalse(VisitorSession.objects.exists())
+        self.assertFalse(UserActivity.objects.exists())
+        record_visitor.assert_not_called()
+
+        data = get_analytics_data(days=1)
+        self.assertEqual(data['bot_requests'], 3)
+        self.assertIn({'bot': 'Googlebot', 'count': 2}, data['bot_stats'])
+
+    def test_browsers_are_not_bots(self):
+        with mock.patch('home.visitor_sketches.record_visitor') as record_visitor:
+            for user_agent in (BROWSER_USER_AGENT, CUBOT_USER_AGENT):
+                self.client.cookies.clear()
+                self.client.get('/contact/', HTTP_USER_AGENT=user_agent)
+        self.flush()
+
+        self.assertEqual(PageView.objects.get(page_url='/contact/').view_count, 2)
+        self.assertEqual(VisitorSession.objects.count(), 2)
+        self.assertEqual(record_visitor.call_count, 2)
+        self.assertEqual(get_analytics_data(days=1)['bot_requests'], 0)
+
+
+class SessionTrackingTests(TestCase):
+    def row(self, session_key, page_views, last_activity, user_id=None):
+        return {
+            'session_key': session_key, 'user_id': user_id, 'ip_address': '10.0.0.1', 'user_agent': BROWSER_USER_AGENT,
+            'device_type': 'desktop', 'browser': 'Chrome', 'os': 'Windows', 'page_views': page_views,
+            'last_activity': last_activity,
+        }
+
+    def test_upsert_accumulates_page_views(self):
+        user = CustomUser.objects.create(userID='U9200001', username='visitor', email='visitor@example.com')
+        now = timezone.now()
+        upsert_visitor_sessions([self.row('s1', 3, now, user.pk)])
+        upsert_visitor_sessions([self.row('s1', 2, now - timedelta(minutes=5)), self.row('s2', 1, now)])
+        session = VisitorSession.objects.get(session_key='s1')
+        self.assertEqual(session.page_views, 5)
+        self.assertEqual(session.last_activity, now)  # Không lùi về lần ghi cũ hơn
+        self.assertEqual(session.user_id, user.pk)  # user_id NULL không ghi đè
+        self.assertEqual(VisitorSession.objects.count(), 2)
+
+    def test_heartbeat_throttles_writes(self):
+        written = []
+        heartbeat = SessionHeartbeat(write=written.extend, threshold=60)
+        now = timezone.now()
+        for n in range(20):
+            heartbeat.touch('s1', 1, now + timedelta(seconds=n), user_agent=BROWSER_USER_AGENT)
+        self.assertEqual([row['page_views'] for row in written], [1])
+        heartbeat.flush()
+        self.assertEqual([row['page_views'] for row in written], [1, 19])
+        self.assertEqual(written[-1]['last_activity'], now + timedelta(seconds=19))
+
+    def test_eviction_writes_pending_views(self):
+        written = []
+        heartbeat = SessionHeartbeat(write=written.extend, threshold=60, max_entries=2)
+        now = timezone.now()
+        for key in ('s1', 's2'):
+            heartbeat.touch(key, 1, now)
+            heartbeat.touch(key, 1, now)  # Lượt thứ hai còn chờ
+        written.clear()
+        heartbeat.touch('s3', 1, now)
+        self.assertEqual(heartbeat.stats()['sessions'], 2)
+        self.assertEqual({(row['session_key'], row['page_views']) for row in written}, {('s3', 1), ('s1', 1)})
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create(userID='U9300001', username='alice', email='alice@example.com')
+        self.bob = CustomUser.objects.create(userID='U9300002', username='bob', email='bob@example.com')
+        self.now = timezone.now().replace(second=0, microsecond=0)
+
+    @override_settings(PRESENCE_PERSIST_INTERVAL=300)
+    def test_last_login_is_persisted_at_most_once_per_interval(self):
+        self.assertTrue(record_presence(self.alice, now=self.now))
+        self.assertFalse(record_presence(self.alice, now=self.now + timedelta(seconds=299)))
+        self.assertTrue(record_presence(self.alice, now=self.now + timedelta(seconds=300)))
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.last_login, self.now + timedelta(seconds=300))
+
+    @override_settings(PRESENCE_ONLINE_TIMEOUT=300)
+    def test_online_users_across_minute_buckets(self):
+        record_presence(self.alice, now=self.now)
+        record_presence(self.bob, now=self.now + timedelta(seconds=90))
+        record_presence(self.alice, now=self.now + timedelta(seconds=130))
+
+        later = self.now + timedelta(seconds=150)
+        self.assertEqual(get_online_user_ids(now=later), {'U9300001', 'U9300002'})
+        self.assertEqual(get_online_count(now=later), 2)
+        self.assertEqual(get_online_user_ids(minutes=1, now=later), {'U9300001'})
+
+    @override_settings(PRESENCE_ONLINE_TIMEOUT=300)
+    def test_users_expire_after_timeout(self):
+        record_presence(self.alice, now=self.now)
+        record_presence(self.bob, now=self.now + timedelta(minutes=3))
+        self.assertEqual(get_online_count(now=self.now + timedelta(minutes=4)), 2)
+        self.assertEqual(get_online_user_ids(now=self.now + timedelta(minutes=6)), {'U9300002'})
+        self.assertEqual(get_online_count(now=self.now + timedelta(minutes=9)), 0)
+
+
+@override_settings(
+    ACTIVITY_TRACKING_MODE='sync',
+    ACTIVITY_TRACKING_POLICIES={'about': 0.25, 'contact': 'always', 'home': 'counters'},
+)
+class SamplingPolicyTests(TestCase):
+    def setUp(self):
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+
+    def page_views(self, path):
+        return list(UserActivity.objects.filter(activity_type='page_view', extra_data__path=path).values_list('weight', flat=True))
+
+    def test_sampled_rows_carry_inverse_weight(self):
+        with mock.patch('home.middleware.random.random', side_effect=[0.1, 0.9, 0.2]):
+            for _ in range(3):
+                self.client.get('/about/')
+        self.assertEqual(self.page_views('/about/'), [4.0, 4.0])
+
+    def test_always_and_counters_policies(self):
+        self.client.get('/contact/')
+        self.client.get('/home/')
+        self.assertEqual(self.page_views('/contact/'), [1.0])
+        self.assertEqual(self.page_views('/home/'), [])
+
+
+@override_settings(DASHBOARD_CACHE_TTL=60)
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(userID='U9300001', username='fan', email='fan@example.com')
+
+    def test_cached_until_data_changes(self):
+        first = get_dashboard_data(30)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_data(30), first)
+
+        Tennis.objects.create(name='New Court', price=100, squared=200, limit=4, court_address='2 Tennis Street', hours=1)
+        self.assertEqual(get_dashboard_data(30)['total_courts'], first['total_courts'] + 1)
+
+    def test_last_login_update_keeps_cache(self):
+        get_dashboard_data(30)
+        version = get_dashboard_version()
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            get_dashboard_data(30)
+        self.user.save()
+        self.assertGreater(get_dashboard_version(), version)
+
+    def test_stale_copy_served_while_rebuilding(self):
+        first = get_dashboard_data(30)
+        key = f'dashboard:v{get_dashboard_version()}:30'
+        cache.set(key, {'data': first, 'expires_at': 0}, 60)
+        cache.add(f'{key}:lock', 1, 5)  # Một request khác đang dựng lại
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_data(30), first)
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class AnalyticsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create(userID='U9400001', username='boss', email='boss@example.com', role='admin')
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+        self.client.force_login(admin)
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get('/analytics/api/', {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('total_page_views', json.loads(response.content))
+
+        response = self.client.get('/analytics/api/', {'days': 7}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        # Tham số khác: ETag khác
+        response = self.client.get('/analytics/api/', {'days': 7, 'fields': 'new_users'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(json.loads(response.content)), {'new_users'})
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get('/analytics/api/', {'days': 7}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('total_page_views', json.loads(gzip.decompress(response.content)))
+
+    def test_unknown_field_rejected(self):
+        response = self.client.get('/analytics/api/', {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class ActivityExportTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(userID='U9500001', username='exporter', email='exporter@example.com', role='admin')
+        UserActivity.objects.bulk_create([
+            UserActivity(user=self.admin, activity_type='login', ip_address='10.0.0.1') for _ in range(5)
+        ])
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+
+    def test_keyset_batches(self):
+        ids = list(UserActivity.objects.order_by('id').values_list('id', flat=True))
+        with self.assertNumQueries(3):
+            rows = list(iter_keyset(UserActivity.objects.all(), ['id'], chunk_size=2))
+        self.assertEqual([row['id'] for row in rows], ids)
+
+    def test_archived_rows_come_first(self):
+        old = timezone.now() - timedelta(days=200)
+        archived = UserActivity.objects.create(activity_type='register', ip_address='10.0.0.2')
+        UserActivity.objects.filter(pk=archived.pk).update(created_at=old)
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(ACTIVITY_ARCHIVE_DIR=archive_dir):
+            archive_activities()
+            rows = list(iter_export_rows('activities'))
+        self.assertEqual([row['activity_type'] for row in rows], ['register'] + ['login'] * 5)
+
+    def test_streaming_view(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/analytics/export/', {'kind': 'activities', 'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), ARCHIVE_FIELDS)
+        self.assertEqual(len(lines), 6)
+
+        response = self.client.get('/analytics/export/', {'kind': 'activities', 'format': 'ndjson', 'activity_type': 'login'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+
+        self.assertEqual(self.client.get('/analytics/export/', {'format': 'xml'}).status_code, 400)
+
+
+@override_settings(ACTIVITY_TRACKING_MODE='sync')
+class VisitorCookieTests(TestCase):
+    def setUp(self):
+        self.client.defaults['HTTP_USER_AGENT'] = BROWSER_USER_AGENT
+
+    def test_anonymous_visit_uses_signed_cookie(self):
+        response = self.client.get('/about/')
+        cookie = response.cookies['vid']
+        self.assertTrue(cookie['httponly'])
+        request = RequestFactory().get('/', HTTP_COOKIE=f'vid={cookie.value}')
+        visitor_id = request.get_signed_cookie('vid', salt=VISITOR_ID_SALT)
+        self.assertRegex(visitor_id, VISITOR_ID_RE)
+        # Không tạo session DB cho khách vãng lai
+        self.assertFalse(Session.objects.exists())
+        self.assertTrue(VisitorSession.objects.filter(session_key=visitor_id).exists())
+
+        # Lần sau: dùng lại mã khách, không gửi cookie mới
+        response = self.client.get('/contact/')
+        self.assertNotIn('vid', response.cookies)
+        self.assertEqual(VisitorSession.objects.count(), 1)
+
+    def test_tampered_cookie_is_replaced(self):
+        self.client.cookies['vid'] = 'f' * 32
+        response = self.client.get('/about/')
+        self.assertIn('vid', response.cookies)
+        self.assertNotEqual(response.cookies['vid'].value, 'f' * 32)
+
+
+class RecurringBookingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(userID='U9600001', username='regular', email='regular@example.com', balance=1000)
+        self.rival = CustomUser.objects.create(userID='U9600002', username='rival2', email='rival2@example.com')
+        self.court = Tennis.objects.create(
+            name='Court R', price=100, squared=200, limit=4, court_address='3 Tennis Street', hours=1,
+            playTime='18:00 - 19:00',
+        )
+        first = timezone.localdate() + timedelta(days=1)
+        self.slot = CourtSlot.objects.create(court=self.court, date=first, start_time=time(18), end_time=time(19))
+        self.dates = weekly_dates(first, 3)
+
+    def assertNothingBooked(self):
+        self.assertFalse(Booking.objects.filter(user=self.user).exists())
+        self.assertFalse(Invoice.objects.filter(user=self.user).exists())
+        self.assertFalse(TransactionHistory.objects.filter(user=self.user).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+
+    def test_one_aggregated_payment(self):
+        bookings = book_recurring(self.user, self.court, self.slot.id, self.dates)
+        self.assertEqual([booking.slot.date for booking in bookings], self.dates)
+        self.assertEqual(Invoice.objects.filter(user=self.user, status='Paid', amount=100).count(), 3)
+        self.assertEqual(list(TransactionHistory.objects.filter(user=self.user).values_list('amount', flat=True)), [300])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 700)
+
+    def test_taken_date_rolls_back_whole_batch(self):
+        reserve_slot(self.rival, self.court, CourtSlot.objects.create(
+            court=self.court, date=self.dates[2], start_time=time(18), end_time=time(19)
+        ).id)
+        with self.assertRaises(SlotUnavailable):
+            book_recurring(self.user, self.court, self.slot.id, self.dates)
+        self.assertNothingBooked()
+
+    def test_lost_race_rolls_back_whole_batch(self):
+        def stale_status(queryset, user=None):
+            # Trạng thái đọc trước khi người khác kịp ghi booking
+            slots = list(queryset)
+            for slot in slots:
+                slot.is_booked = slot.is_held = False
+            return slots
+
+        taken = CourtSlot.objects.create(court=self.court, date=self.dates[1], start_time=time(18), end_time=time(19))
+        reserve_slot(self.rival, self.court, taken.id)
+        with mock.patch('home.court_slots.slots_with_status', stale_status), self.assertRaises(SlotUnavailable):
+            book_recurring(self.user, self.court, self.slot.id, self.dates)
+        self.assertNothingBooked()
+        self.assertEqual(Booking.objects.get(slot=taken).user, self.rival)
+
+    def test_insufficient_balance_books_nothing(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(balance=250)
+        with self.assertRaises(InsufficientBalance):
+            book_recurring(self.user, self.court, self.slot.id, self.dates)
+        self.assertFalse(Booking.objects.filter(user=self.user).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 250)
+
+
+@override_settings(LEADERBOARD_CACHE_TTL=0)
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create(userID=f'U970000{i}', username=f'player{i}', email=f'player{i}@example.com')
+            for i in range(3)
+        ]
+
+    def add_activities(self, user, count, days_ago=0):
+        activities = UserActivity.objects.bulk_create([
+            UserActivity(user=user, activity_type='login', ip_address='10.0.0.1') for _ in range(count)
+        ])
+        UserActivity.objects.filter(pk__in=[a.pk for a in activities]).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+
+    def test_daily_ranking_covers_window(self):
+        today = timezone.localdate()
+        UserDailyActivity.objects.bulk_create([
+            UserDailyActivity(user=self.users[0], date=today, count=2),
+            UserDailyActivity(user=self.users[0], date=today - timedelta(days=1), count=2),
+            UserDailyActivity(user=self.users[1], date=today, count=3),
+            UserDailyActivity(user=self.users[2], date=today - timedelta(days=10), count=50),
+        ])
+        ranking = get_top_users(7)
+        self.assertEqual([(row['user__username'], row['activity_count']) for row in ranking], [('player0', 4), ('player1', 3)])
+        self.assertEqual(get_top_users(30, limit=1)[0]['user__username'], 'player2')
+
+    def test_all_time_ranking_uses_user_stats(self):
+        self.add_activities(self.users[0], 2)
+        self.add_activities(self.users[1], 5, days_ago=200)
+        # Chưa có dòng UserStats: chưa vào bảng xếp hạng mọi thời điểm
+        self.assertEqual(get_top_users(None), [])
+        # Dòng UserStats dựng lười khi xem trang chi tiết user
+        get_user_stats(self.users[0])
+        self.assertEqual([row['user__username'] for row in get_top_users(None)], ['player0'])
+        get_user_stats(self.users[1])
+        self.assertEqual(
+            [(row['user__username'], row['activity_count']) for row in get_top_users(None)],
+            [('player1', 5), ('player0', 2)],
+        )
+
+    def test_rebuild_leaderboard_command(self):
+        self.add_activities(self.users[0], 3)
+        self.add_activities(self.users[1], 4, days_ago=2)
+        self.add_activities(self.users[2], 9, days_ago=40)
+        call_command('rebuild_leaderboard', days=7, stdout=StringIO())
+
+        self.assertEqual(
+            {(row.user_id, row.count) for row in UserDailyActivity.objects.all()},
+            {(self.users[0].pk, 3), (self.users[1].pk, 4)},
+        )
+        self.assertEqual([row['user__username'] for row in get_top_users(7)], ['player1', 'player0'])
+        self.assertEqual(get_top_users(None)[0]['user__username'], 'player2')
+
+
+class ActivityArchiveTests(TestCase):
+    def test_rerun_after_crash_does_not_duplicate(self):
+        old = timezone.now() - timedelta(days=200)
+        activities = UserActivity.objects.bulk_create([
+            UserActivity(activity_type='login', ip_address='10.0.0.1') for _ in range(5)
+        ])
+        ids = [activity.pk for activity in activities]
+        UserActivity.objects.filter(pk__in=ids).update(created_at=old)
+
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(ACTIVITY_ARCHIVE_DIR=archive_dir):
+            # Sự cố sau khi đã ghi segment, trước khi xoá các dòng khỏi bảng
+            with mock.patch('home.activity_archive.transaction.atomic', side_effect=RuntimeError('crash')):
+                with self.assertRaises(RuntimeError):
+                    archive_activities(chunk_size=2)
+            self.assertEqual(UserActivity.objects.count(), 5)
+
+            # Chạy lại với ranh giới lô khác
+            self.assertEqual(archive_activities(chunk_size=3), 5)
+            self.assertFalse(UserActivity.objects.exists())
+            self.assertEqual([row['id'] for row in iter_archived_activities()], sorted(ids))
+
+            # Lần archive sau rơi vào cùng khoảng id: gộp vào segment cũ
+            later = UserActivity.objects.create(activity_type='logout', ip_address='10.0.0.1')
+            UserActivity.objects.filter(pk=later.pk).update(created_at=old)
+            archive_activities()
+            self.assertEqual([row['id'] for row in iter_archived_activities()], sorted(ids + [later.pk]))
+
+
+
+class DailyStatsTests(TestCase):
+    def add_page_views(self, day, ips):
+        activities = UserActivity.objects.bulk_create([
+            UserActivity(activity_type='page_view', ip_address=ip) for ip in ips
+        ])
+        UserActivity.objects.filter(pk__in=[a.pk for a in activities]).update(created_at=day_start(day) + timedelta(hours=10))
+
+    def snapshot(self):
+        return list(DailyStats.objects.order_by('date').values('date', *STATS_FIELDS))
+
+    def test_update_is_idempotent(self):
+        today = timezone.localdate()
+        self.add_page_views(today, ['10.0.0.1', '10.0.0.1', '10.0.0.2'])
+
+        stats = update_daily_stats()
+        first = self.snapshot()
+        update_daily_stats()
+
+        self.assertEqual(self.snapshot(), first)
+        self.assertEqual(DailyStats.objects.count(), 1)
+        self.assertEqual((stats.total_visits, stats.unique_visitors), (3, 2))
+
+    def test_watermark_advances_and_resumes(self):
+        today = timezone.localdate()
+        update_daily_stats()
+        self.assertEqual(ProcessingWatermark.get(WATERMARK_NAME), day_start(today))
+
+        # Job dừng 3 ngày: lần chạy sau bù lại các ngày còn thiếu
+        ProcessingWatermark.objects.filter(name=WATERMARK_NAME).update(position=day_start(today - timedelta(days=3)))
+        self.add_page_views(today - timedelta(days=2), ['10.0.0.1'])
+        update_daily_stats()
+
+        self.assertEqual(ProcessingWatermark.get(WATERMARK_NAME), day_start(today))
+        self.assertEqual(
+            list(DailyStats.objects.order_by('date').values_list('date', flat=True)),
+            [today - timedelta(days=n) for n in (3, 2, 1, 0)],
+        )
+        self.assertEqual(DailyStats.objects.get(date=today - timedelta(days=2)).total_visits, 1)
+
+        # Mốc chỉ tiến, không lùi
+        ProcessingWatermark.advance(WATERMARK_NAME, day_start(today - timedelta(days=5)))
+        self.assertEqual(ProcessingWatermark.get(WATERMARK_NAME), day_start(today))
+
+
+class DailyStatsBackfillTests(TransactionTestCase):
+    # Dữ liệu phải được commit để các thread (kết nối riêng) đọc được
+    def test_threaded_backfill_matches_sequential(self):
+        start = timezone.localdate() - timedelta(days=40)
+        for offset in range(0, 40, 3):
+            day = start + timedelta(days=offset)
+            activities = UserActivity.objects.bulk_create([
+                UserActivity(activity_type='page_view', ip_address=f'10.0.0.{n}') for n in range(offset % 5 + 1)
+            ])
+            UserActivity.objects.filter(pk__in=[a.pk for a in activities]).update(
+                created_at=day_start(day) + timedelta(hours=10)
+            )
+        end = start + timedelta(days=40)
+
+        self.assertEqual(backfill_daily_stats(start, end, workers=1), 40)
+        sequential = list(DailyStats.objects.order_by('date').values('date', *STATS_FIELDS))
+        DailyStats.objects.all().delete()
+
+        # Trên SQLite, ghi từ nhiều thread sẽ lỗi "database is locked"
+        self.assertEqual(backfill_daily_stats(start, end, chunk_days=5, workers=4), 40)
+        self.assertEqual(list(DailyStats.objects.order_by('date').values('date', *STATS_FIELDS)), sequential)
+        self.assertEqual(sum(row['total_visits'] for row in sequential), sum(n % 5 + 1 for n in range(0, 40, 3)))
+
+
+class PageViewMigrationTests(TransactionTestCase):
+    migrate_from = [('home', '0016_invoice_card_last_four_invoice_payment_method_and_more')]
+    migrate_to = [('home', '0017_pageview_page_url_unique')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_merges_duplicate_page_urls(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        OldPageView = executor.loader.project_state(self.migrate_from).apps.get_model('home', 'PageView')
+        first = OldPageView.objects.create(page_url='/home/', page_name=None, view_count=3, unique_visitors=2)
+        OldPageView.objects.create(page_url='/home/', page_name='Trang chủ', view_count=4, unique_visitors=5)
+        OldPageView.objects.create(page_url='/courts/', view_count=1)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        NewPageView = executor.loader.project_state(self.migrate_to).apps.get_model('home', 'PageView')
+
+        self.assertEqual(NewPageView.objects.count(), 2)
+        page = NewPageView.objects.get(page_url='/home/')
+        self.assertEqual(
+            (page.pk, page.view_count, page.unique_visitors, page.page_name), (first.pk, 7, 5, 'Trang chủ')
+        )
@@ -0,0 +1,321 @@
+"""
+Hàng đợi ghi trễ (write-behind) cho dữ liệu theo dõi hoạt động.
+
+Middleware chỉ đẩy sự kiện vào hàng đợi trong bộ nhớ; một thread nền gom
+các sự kiện và ghi xuống DB theo lô (mỗi N ms hoặc M sự kiện), nên thời gian
+xử lý request không còn bao gồm các lệnh ghi thống kê.
+
+Các hook định kỳ (flush bộ đếm, heartbeat session, rollup, sketch, UserStats,
+...) chạy trong một thread riêng (PeriodicRunner) ở mọi chế độ theo dõi, kể cả
+'sync'. Khi chạy test (ACTIVITY_TRACKING_BACKGROUND = False) không có thread
+nền: sự kiện được ghi trực tiếp và không flush khi thoát, vì DB test đã bị
+huỷ trước đó.
+"""
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block', 'sync')
+
+
+class TrackingBuffer:
+    """
+    Hàng đợi có giới hạn + thread flush chạy nền.
+
+    Chính sách khi hàng đợi đầy (overflow_policy):
+    - drop_newest: bỏ sự kiện mới
+    - drop_oldest: bỏ sự kiện cũ nhất để nhường chỗ
+    - block: chờ tối đa block_timeout giây, hết thời gian thì bỏ
+    - sync: ghi trực tiếp trong request (backpressure lên client)
+    """
+
+    def __init__(self, writer, maxsize=10000, flush_interval=0.5,
+                 batch_size=200, overflow_policy='drop_newest', block_timeout=0.05):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Invalid overflow policy: {overflow_policy}')
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0  # Bị bỏ do hàng đợi đầy
+        self.written = 0
+        self.failed = 0  # Bị mất do writer lỗi
+        self.last_error = None
+
+    def _count(self, field, amount=1):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def put(self, event):
+        """Đưa một sự kiện vào hàng đợi, áp dụng chính sách khi đầy"""
+        if not is_background_enabled():
+            # Không có thread nền (vd: khi chạy test) thì ghi trực tiếp
+            return self._write([event])
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            self._count('enqueued')
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(event)
+                self._count('enqueued')
+                return True
+            except queue.Full:
+                self._count('dropped')
+                return False
+
+        if self.overflow_policy == 'block':
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+                self._count('enqueued')
+                return True
+            except queue.Full:
+                self._count('dropped')
+                return False
+
+        if self.overflow_policy == 'sync':
+            return self._write([event])
+
+        self._count('dropped')
+        return False
+
+    def flush(self):
+        """Ghi toàn bộ sự kiện đang chờ xuống DB (dùng khi tắt worker)"""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write(batch)
+
+    def stop(self):
+        """Dừng thread nền và flush phần còn lại"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval * 2, 1))
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'pending': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'last_error': self.last_error,
+                'overflow_policy': self.overflow_policy,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='activity-tracking-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        from django.db import close_old_connections
+
+        with self._flush_lock:
+            try:
+                self.writer(batch)
+                self._count('written', len(batch))
+                return True
+            except Exception as e:
+                # Writer không idempotent (bộ đếm trong bộ nhớ đã được cộng một
+                # phần) nên không ghi lại lô; đếm riêng và báo số sự kiện bị mất
+                with self._stats_lock:
+                    self.failed += len(batch)
+                    self.last_error = repr(e)
+                print(f"Activity tracking flush error ({len(batch)} events lost): {e}")
+                return False
+            finally:
+                if threading.current_thread() is self._thread:
+                    close_old_connections()
+
+
+class PeriodicRunner:
+    """Thread nền gọi các hook định kỳ mỗi `interval` giây"""
+
+    def __init__(self, hooks, interval=1.0):
+        self.hooks = hooks
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-tracking-hooks', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.interval * 2, 1))
+
+    def run_once(self):
+        from django.db import close_old_connections
+
+        try:
+            for hook in list(self.hooks):
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"Activity tracking periodic flush error: {e}")
+        finally:
+            if threading.current_thread() is self._thread:
+                close_old_connections()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.run_once()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_shutdown_flushers = []
+_periodic_hooks = []
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def is_background_enabled():
+    return getattr(settings, 'ACTIVITY_TRACKING_BACKGROUND', True)
+
+
+def get_periodic_runner():
+    """Thread chạy hook định kỳ dùng chung của process (chỉ khởi động khi bật chạy nền)"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = PeriodicRunner(
+                    _periodic_hooks,
+                    interval=getattr(settings, 'ACTIVITY_TRACKING_HOOK_INTERVAL_SECONDS', 1),
+                )
+    if is_background_enabled():
+        _runner.ensure_started()
+    return _runner
+
+
+def register_shutdown_flusher(flush):
+    """Đăng ký hàm flush chạy khi tắt worker, sau khi hàng đợi đã được ghi hết"""
+    if flush not in _shutdown_flushers:
+        _shutdown_flushers.append(flush)
+
+
+def register_periodic_hook(hook):
+    """Đăng ký hàm được PeriodicRunner gọi định kỳ (ở mọi chế độ theo dõi)"""
+    if hook not in _periodic_hooks:
+        _periodic_hooks.append(hook)
+    get_periodic_runner()
+
+
+def flush_all():
+    """Dừng buffer, thread hook và chạy mọi hàm flush đã đăng ký"""
+    if _runner is not None:
+        _runner.stop()
+    if _buffer is not None:
+        _buffer.stop()
+    for flush in _shutdown_flushers:
+        try:
+            flush()
+        except Exception as e:
+            print(f"Activity tracking shutdown flush error: {e}")
+
+
+def _flush_at_exit():
+    # Khi chạy test, DB test đã bị huỷ trước lúc thoát: không flush
+    if is_background_enabled():
+        flush_all()
+
+
+atexit.register(_flush_at_exit)
+
+
+def get_tracking_buffer():
+    """Lấy (hoặc khởi tạo) buffer dùng chung của process"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from .activity_tracker import record_tracking_events
+
+                _buffer = TrackingBuffer(
+                    writer=record_tracking_events,
+                    maxsize=getattr(settings, 'ACTIVITY_TRACKING_QUEUE_SIZE', 10000),
+                    flush_interval=getattr(settings, 'ACTIVITY_TRACKING_FLUSH_INTERVAL_MS', 500) / 1000,
+                    batch_size=getattr(settings, 'ACTIVITY_TRACKING_FLUSH_BATCH_SIZE', 200),
+                    overflow_policy=getattr(settings, 'ACTIVITY_TRACKING_OVERFLOW_POLICY', 'drop_newest'),
+                )
+    return _buffer
+
+
+def is_write_behind_enabled():
+    return getattr(settings, 'ACTIVITY_TRACKING_MODE', 'sync') == 'write_behind'
+
+
+def submit_tracking_event(event):
+    """Ghi sự kiện theo chế độ cấu hình: trực tiếp (sync) hoặc qua hàng đợi"""
+    if is_write_behind_enabled():
+        return get_tracking_buffer().put(event)
+
+    from .activity_tracker import record_tracking_events
+    record_tracking_events([event])
+    return True
@@ -18,6 +18,7 @@ urlpatterns = [
     path('edit_court/<int:court_id>/', views.edit_court, name='edit_court'),
     path('detail/', views.detail, name='detail'),
     path('rent_court/<int:court_id>/', views.rent_court, name='rent_court'),
+    path('rent_court/<int:court_id>/recurring/', views.recurring_booking, name='recurring_booking'),
     path('checkout/', views.checkout, name='checkout'),
     path('profile/', views.profile, name='user_profile'),
     path('user_profile_edit/', views.edit_profile, name='user_profile_edit'),
@@ -49,5 +50,6 @@ urlpatterns = [
     path('analytics/', views.analytics_dashboard, name='analytics'),
     path('analytics/api/', views.analytics_api, name='analytics_api'),
     path('analytics/user/<str:user_id>/', views.user_activity_detail, name='user_activity_detail'),
+    path('analytics/export/', views.analytics_export, name='analytics_export'),
 ]
 
@@ -0,0 +1,150 @@
+"""
+Phân tích User-Agent thành (device_type, browser, os) cho thống kê.
+
+Kết quả được ghi nhớ trong một LRU có giới hạn theo chuỗi User-Agent, nên
+khách quay lại chỉ tốn một lần tra dict; tỉ lệ trúng cache xem qua
+get_user_agent_cache_stats().
+
+Bot/crawler được nhận diện bằng BOT_PATTERN cộng các mẫu trong
+ACTIVITY_BOT_DENY_PATTERNS; UA khớp ACTIVITY_BOT_ALLOW_PATTERNS luôn được coi
+là người dùng thật. Với bot, trường browser là họ bot (vd: 'Googlebot').
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+
+UserAgentInfo = namedtuple('UserAgentInfo', ['device_type', 'browser', 'os', 'is_bot'])
+
+# Thứ tự quan trọng: các trình duyệt dựa trên Chromium đều chứa "Chrome",
+# và Chrome chứa "Safari", nên các quy tắc cụ thể hơn phải đứng trước
+BROWSER_RULES = [
+    ('Edge', r'edg(?:e|a|ios)?/'),
+    ('Opera', r'opr/|opera|opt/'),
+    ('Cốc Cốc', r'coc_coc_browser'),
+    ('Samsung Internet', r'samsungbrowser'),
+    ('UC Browser', r'ucbrowser|ucweb'),
+    ('Yandex', r'yabrowser'),
+    ('Vivaldi', r'vivaldi'),
+    ('Zalo', r'zalo'),
+    ('Facebook', r'fban|fbav|fb_iab'),
+    ('Internet Explorer', r'msie |trident/'),
+    ('Firefox', r'firefox/|fxios/'),
+    ('Chrome', r'chrome/|crios/|chromium/'),
+    ('Safari', r'safari/|applewebkit/'),
+]
+
+OS_RULES = [
+    ('Windows', r'windows'),
+    ('Android', r'android'),
+    ('iOS', r'iphone|ipad|ipod'),
+    ('macOS', r'mac os|macintosh'),
+    ('ChromeOS', r'\bcros\b'),
+    ('Linux', r'linux|x11'),
+]
+
+# "bot" phải là trọn một từ (Googlebot, bingbot/2.0...) để không bắt nhầm
+# tên máy có chứa "bot"; các hãng điện thoại như CUBOT được loại trừ riêng
+BOT_DEVICE_BRANDS = ['cubot']
+BOT_PATTERN = (
+    r'\b(?!(?:' + '|'.join(BOT_DEVICE_BRANDS) + r')\b)[a-z]*bot\b|crawl|spider|slurp|facebookexternalhit|'
+    r'mediapartners|headless|phantomjs|lighthouse|pingdom|statuscake|site24x7|uptime-kuma|'
+    r'curl/|wget/|python-requests|python-urllib|aiohttp|httpx|go-http-client|java/|okhttp|libwww|scrapy'
+)
+
+# Họ bot để thống kê riêng lượng truy cập của bot
+BOT_FAMILY_RULES = [
+    ('Googlebot', r'googlebot|google-inspectiontool|adsbot-google|mediapartners'),
+    ('Bingbot', r'bingbot|bingpreview|msnbot'),
+    ('Cốc Cốc bot', r'coccocbot'),
+    ('YandexBot', r'yandex'),
+    ('Baiduspider', r'baiduspider'),
+    ('DuckDuckBot', r'duckduckbot'),
+    ('Applebot', r'applebot'),
+    ('Facebook', r'facebookexternalhit|facebot'),
+    ('SEO crawler', r'ahrefsbot|semrushbot|mj12bot|dotbot|petalbot'),
+    ('Uptime monitor', r'pingdom|uptimerobot|uptime-kuma|statuscake|site24x7'),
+    ('Headless browser', r'headless|phantomjs|lighthouse'),
+    ('HTTP client', r'curl/|wget/|python-|aiohttp|httpx|go-http-client|java/|okhttp|libwww|scrapy'),
+]
+EMPTY_USER_AGENT = 'Empty User-Agent'
+
+
+def _compile_rules(rules):
+    return [(name, re.compile(pattern)) for name, pattern in rules]
+
+
+class UserAgentParser:
+    """Bộ phân tích User-Agent với các regex dựng sẵn và LRU theo chuỗi UA"""
+
+    def __init__(self, cache_size=4096, bot_pattern=BOT_PATTERN, deny_patterns=(),
+                 allow_patterns=(), empty_is_bot=False):
+        self._browsers = _compile_rules(BROWSER_RULES)
+        self._os = _compile_rules(OS_RULES)
+        self._bot_families = _compile_rules(BOT_FAMILY_RULES)
+        self._bot_re = re.compile('|'.join([bot_pattern, *deny_patterns]))
+        self._allow_re = re.compile('|'.join(allow_patterns)) if allow_patterns else None
+        self.empty_is_bot = empty_is_bot
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, user_agent):
+        ua = (user_agent or '').lower()
+
+        if not ua and self.empty_is_bot:
+            return UserAgentInfo('bot', EMPTY_USER_AGENT, 'Other', True)
+        if ua and self._bot_re.search(ua) and not (self._allow_re and self._allow_re.search(ua)):
+            return UserAgentInfo('bot', self._match(self._bot_families, ua, 'Other bot'), self._match(self._os, ua), True)
+
+        if 'ipad' in ua or 'tablet' in ua or ('android' in ua and 'mobile' not in ua):
+            device_type = 'tablet'
+        elif 'mobi' in ua or 'iphone' in ua or 'ipod' in ua or 'android' in ua:
+            device_type = 'mobile'
+        else:
+            device_type = 'desktop'
+
+        return UserAgentInfo(device_type, self._match(self._browsers, ua), self._match(self._os, ua), False)
+
+    @staticmethod
+    def _match(rules, ua, default='Other'):
+        for name, pattern in rules:
+            if pattern.search(ua):
+                return name
+        return default
+
+    def cache_stats(self):
+        info = self.parse.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hit_rate': round(info.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_parser = None
+
+
+def get_user_agent_parser():
+    global _parser
+    if _parser is None:
+        _parser = UserAgentParser(
+            cache_size=getattr(settings, 'USER_AGENT_CACHE_SIZE', 4096),
+            deny_patterns=[p.lower() for p in getattr(settings, 'ACTIVITY_BOT_DENY_PATTERNS', [])],
+            allow_patterns=[p.lower() for p in getattr(settings, 'ACTIVITY_BOT_ALLOW_PATTERNS', [])],
+            empty_is_bot=getattr(settings, 'ACTIVITY_BOT_EMPTY_USER_AGENT', True),
+        )
+    return _parser
+
+
+def parse_user_agent(user_agent):
+    """Trả về UserAgentInfo(device_type, browser, os, is_bot) cho một chuỗi UA"""
+    return get_user_agent_parser().parse(user_agent or '')
+
+
+def get_user_agent_cache_stats():
+    """Thống kê cache phân tích User-Agent (hits, misses, hit_rate...)"""
+    return get_user_agent_parser().cache_stats()
@@ -0,0 +1,294 @@
+"""
+Thống kê theo từng user (UserStats): số hoạt động theo loại, lần đầu/cuối
+xuất hiện và tổng chi tiêu.
+
+Mỗi hoạt động được ghi cũng được cộng vào phần chờ của user đó trong bộ nhớ
+(UserStatsBuffer); định kỳ (USER_STATS_FLUSH_SECONDS) phần chờ được gộp vào
+UserStats, mỗi user một lệnh ghi. Trang chi tiết user của admin chỉ còn đọc
+một dòng theo khoá chính.
+
+Tổng chi tiêu chỉ lấy từ Invoice đã thanh toán: mỗi Invoice 'Paid' được cộng
+vào phần chờ khi transaction ghi nó commit (record_user_spend), và
+rebuild_user_stats() cũng cộng lại đúng các Invoice đó.
+
+rebuild_user_stats() dựng lại từ UserActivity (kèm phần đã archive) và
+Invoice bằng truy vấn gộp có điều kiện, và được gọi tự động khi user chưa có
+dòng thống kê. Khi flush gặp user chưa có dòng, dòng mới chỉ được dựng từ
+bảng UserActivity (không đọc archive trên đường ghi); phần lịch sử đã archive
+trước đó được cộng lại bằng lệnh rebuild_user_stats.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q, Sum
+
+
+STATS_FIELDS = ['counts', 'total_activities', 'first_seen', 'last_seen', 'total_spend', 'updated_at']
+
+
+def _merge_entry(target, counts, first_seen, last_seen, spend):
+    for activity_type, count in counts.items():
+        target['counts'][activity_type] = target['counts'].get(activity_type, 0) + count
+    if first_seen and (target['first_seen'] is None or first_seen < target['first_seen']):
+        target['first_seen'] = first_seen
+    if last_seen and (target['last_seen'] is None or last_seen > target['last_seen']):
+        target['last_seen'] = last_seen
+    target['total_spend'] += spend
+
+
+def _empty_entry():
+    return {'counts': {}, 'first_seen': None, 'last_seen': None, 'total_spend': 0.0}
+
+
+def _stats_row(user_id, entry):
+    from .models import UserStats
+
+    return UserStats(user_id=user_id, total_activities=sum(entry['counts'].values()), **entry)
+
+
+def _apply_user_stats(pending):
+    """Gộp phần chờ của từng user vào UserStats"""
+    from .models import UserStats
+
+    with transaction.atomic():
+        existing = UserStats.objects.select_for_update().in_bulk(list(pending))
+        # User chưa có dòng thống kê: dựng từ dữ liệu gốc (đã gồm phần đang chờ,
+        # vì hoạt động được ghi trước khi cộng vào bộ đệm); user đã bị xoá thì bỏ qua.
+        # Không đọc archive ở đây (xem rebuild_user_stats)
+        missing = _build_entries(set(pending) - set(existing), include_archive=False)
+
+        for user_id, stats in existing.items():
+            entry = {
+                'counts': dict(stats.counts), 'first_seen': stats.first_seen,
+                'last_seen': stats.last_seen, 'total_spend': stats.total_spend,
+            }
+            change = pending[user_id]
+            _merge_entry(entry, change['counts'], change['first_seen'], change['last_seen'], change['total_spend'])
+            for field, value in entry.items():
+                setattr(stats, field, value)
+            stats.total_activities = sum(stats.counts.values())
+            stats.save(update_fields=STATS_FIELDS)
+
+        # Worker khác có thể vừa tạo dòng của cùng user: cả hai đều dựng từ dữ
+        # liệu gốc nên ghi đè là đúng, không để IntegrityError đẩy phần chờ
+        # vào lần flush sau (sẽ bị cộng hai lần)
+        UserStats.objects.bulk_create(
+            [_stats_row(user_id, entry) for user_id, entry in missing.items()],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=STATS_FIELDS,
+        )
+
+
+class UserStatsBuffer:
+    """Thay đổi UserStats đang chờ ghi theo user, flush định kỳ"""
+
+    def __init__(self, apply=_apply_user_stats, flush_interval=5, max_pending=1000):
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.additions = 0
+        self.writes = 0
+
+    def add(self, user_id, activity_type, timestamp, count=1):
+        """Cộng một hoạt động (count = weight) vào phần chờ của user"""
+        self._add(user_id, {activity_type: count}, timestamp, 0.0)
+
+    def add_spend(self, user_id, amount):
+        """Cộng số tiền đã chi (Invoice đã thanh toán) vào phần chờ của user"""
+        self._add(user_id, {}, None, amount)
+
+    def _add(self, user_id, counts, timestamp, spend):
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                entry = self._pending[user_id] = _empty_entry()
+            _merge_entry(entry, counts, timestamp, timestamp, spend)
+            self.additions += 1
+            due = (
+                self.flush_interval <= 0
+                or len(self._pending) >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self.apply(pending)
+            self.writes += len(pending)
+        except Exception:
+            # Gộp lại vào phần đang chờ để lần flush sau ghi tiếp
+            with self._lock:
+                for user_id, change in pending.items():
+                    entry = self._pending.get(user_id)
+                    if entry is None:
+                        entry = self._pending[user_id] = _empty_entry()
+                    _merge_entry(entry, change['counts'], change['first_seen'], change['last_seen'], change['total_spend'])
+            raise
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'additions': self.additions,
+            'writes': self.writes,
+            'pending_users': pending,
+            'flush_interval': self.flush_interval,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_user_stats_buffer():
+    """Bộ đệm UserStats dùng chung của process"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = UserStatsBuffer(
+                    flush_interval=getattr(settings, 'USER_STATS_FLUSH_SECONDS', 5),
+                    max_pending=getattr(settings, 'USER_STATS_MAX_PENDING', 1000),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_buffer.flush_if_due)
+                register_shutdown_flusher(_buffer.flush)
+    return _buffer
+
+
+def record_user_activity(user_id, activity_type, timestamp, count=1):
+    """
+    Ghi nhận một hoạt động của user vào UserStats và bộ đếm theo ngày của
+    bảng xếp hạng (bỏ qua khách vãng lai)
+    """
+    from .leaderboard import record_user_day
+
+    if not user_id:
+        return
+    get_user_stats_buffer().add(user_id, activity_type, timestamp, count)
+    record_user_day(user_id, timestamp, count)
+
+
+def record_user_spend(user_id, amount):
+    """Cộng số tiền của Invoice đã thanh toán vào tổng chi tiêu của user, sau khi transaction commit"""
+    if not user_id or not amount:
+        return
+    transaction.on_commit(lambda: get_user_stats_buffer().add_spend(user_id, amount))
+
+
+def _invoice_saved(sender, instance, created, **kwargs):
+    if created and instance.status == 'Paid':
+        record_user_spend(instance.user_id, instance.amount)
+
+
+def connect_spend_signals():
+    """Cộng Invoice đã thanh toán vào UserStats khi được tạo (bulk_create thì gọi record_user_spend)"""
+    from django.db.models.signals import post_save
+    from .models import Invoice
+
+    post_save.connect(_invoice_saved, sender=Invoice, dispatch_uid='user_stats_invoice_save')
+
+
+def _build_entries(user_ids=None, include_archive=True):
+    """
+    {userID: số liệu} tính từ dữ liệu gốc
+
+    Số hoạt động theo loại và lần đầu/cuối xuất hiện được tính bằng một truy
+    vấn GROUP BY user với SUM(weight) có điều kiện cho từng loại, cộng phần
+    đã archive (nếu include_archive); tổng chi tiêu là tổng các Invoice đã
+    thanh toán.
+    """
+    from .activity_archive import iter_archived_activities
+    from .models import CustomUser, Invoice, UserActivity
+
+    users = CustomUser.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=list(user_ids))
+    entries = {user_id: _empty_entry() for user_id in users.values_list('pk', flat=True)}
+    if not entries:
+        return entries
+
+    activity_types = [key for key, _ in UserActivity.ACTIVITY_TYPES]
+    activities = UserActivity.objects.filter(user__isnull=False)
+    invoices = Invoice.objects.filter(status='Paid')
+    if user_ids is not None:
+        activities = activities.filter(user_id__in=list(entries))
+        invoices = invoices.filter(user_id__in=list(entries))
+
+    aggregates = {
+        f'count_{activity_type}': Sum('weight', filter=Q(activity_type=activity_type))
+        for activity_type in activity_types
+    }
+    for row in activities.values('user_id').annotate(
+        first_seen=Min('created_at'), last_seen=Max('created_at'), **aggregates
+    ).order_by():
+        counts = {
+            activity_type: row[f'count_{activity_type}']
+            for activity_type in activity_types if row[f'count_{activity_type}']
+        }
+        _merge_entry(entries[row['user_id']], counts, row['first_seen'], row['last_seen'], 0.0)
+
+    if include_archive:
+        single_user = next(iter(entries)) if len(entries) == 1 else None
+        for row in iter_archived_activities(user_id=single_user):
+            entry = entries.get(row['user_id'])
+            if entry is not None:
+                _merge_entry(entry, {row['activity_type']: row['weight']}, row['created_at'], row['created_at'], 0.0)
+
+    for row in invoices.values('user_id').annotate(total=Sum('amount')).order_by():
+        if row['user_id'] in entries:
+            entries[row['user_id']]['total_spend'] = row['total'] or 0.0
+    return entries
+
+
+def rebuild_user_stats(user_ids=None):
+    """
+    Dựng lại UserStats từ dữ liệu gốc
+
+    Args:
+        user_ids: Danh sách userID cần dựng lại (None: mọi user)
+
+    Returns:
+        Số dòng UserStats đã ghi
+    """
+    from .models import UserStats
+
+    # Phần chờ trong bộ nhớ đã nằm trong dữ liệu gốc: ghi ra trước để không cộng hai lần
+    get_user_stats_buffer().flush()
+
+    entries = _build_entries(user_ids)
+    with transaction.atomic():
+        UserStats.objects.bulk_create(
+            [_stats_row(user_id, entry) for user_id, entry in entries.items()],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=STATS_FIELDS,
+        )
+    return len(entries)
+
+
+def get_user_stats(user):
+    """UserStats của user (một lần đọc theo khoá chính), dựng lại nếu chưa có"""
+    from .models import UserStats
+
+    stats = UserStats.objects.filter(pk=user.pk).first()
+    if stats is None:
+        rebuild_user_stats([user.pk])
+        stats = UserStats.objects.get(pk=user.pk)
+    return stats
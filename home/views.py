@@ -1,12 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.core.mail import send_mail
-from django.http import HttpResponseForbidden, HttpResponse, JsonResponse
+from django.http import HttpResponseForbidden, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import login, authenticate,logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from .forms import *
 from .models import *
-from .activity_tracker import log_activity, get_analytics_data, get_recent_activities, get_online_users_count, get_user_activity_summary
+from .activity_tracker import log_activity, get_recent_activities, get_online_users_count, get_user_activity_summary
 from django.db.models import Avg, Count, Sum
 from django.db.models.functions import TruncDate
 from django.utils import timezone
@@ -21,7 +21,20 @@ from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.forms import SetPasswordForm
 from django.core.paginator import Paginator
 import os
-from datetime import timedelta
+from datetime import datetime, time, timedelta
+from django.utils.dateparse import parse_date
+from django.conf import settings
+from .activity_archive import recent_activities
+from .activity_export import CONTENT_TYPES, EXPORT_FORMATS, EXPORT_KINDS, iter_export_rows, parse_date_range, stream_export
+from .dashboard import get_dashboard_data
+from .analytics_api import analytics_response, get_analytics_etag, not_modified_response, parse_fields
+from .court_slots import attach_available_slots, booking_end, get_day_slots, get_slot_date, sync_court_slots
+from .availability import find_free_courts, parse_hour
+from .reservations import (
+    InsufficientBalance, SlotUnavailable, book_recurring, get_max_occurrences, hold_slot, move_booking,
+    release_hold, reserve_slot, weekly_dates,
+)
+from django.db import transaction
 
 def auth_user(request):
     register_form = UserRegistrationForm()
@@ -217,6 +230,7 @@ def add_tennis(request):
             form = TennisForm(request.POST, request.FILES)
             if form.is_valid():
                 court = form.save()
+                sync_court_slots(court)
                 if is_ajax:
                     return JsonResponse({'success': True, 'redirect': '/hire/'})
                 messages.success(request, f'Sân tennis "{court.name}" đã được thêm thành công!')
@@ -294,6 +308,8 @@ def edit_court(request, court_id):
         if request.FILES.get('image'):
             court.image = request.FILES['image']
         court.save()
+        court.refresh_from_db(fields=['dateTime'])
+        sync_court_slots(court)
         
         return redirect('property_list')
 
@@ -319,23 +335,24 @@ def about(request):
 
 def property_list(request):
     tennis_courts = Tennis.objects.all()
-    for court in tennis_courts:
-        court.playTime_list = court.playTime.split(', ') if court.playTime else []
     
     return render(request, 'apps/property-list.html', {'tennis_courts': tennis_courts})
 
 
 def search_courts(request):
-    """Tìm kiếm sân tennis theo tên, giá và địa chỉ"""
+    """Tìm kiếm sân tennis theo tên, giá, địa chỉ và khung giờ còn trống"""
     tennis_courts = Tennis.objects.all()
     
     # Lấy các tham số tìm kiếm
     name = request.GET.get('name', '').strip()
     price = request.GET.get('price', '').strip()
     address = request.GET.get('address', '').strip()
+    date = request.GET.get('date', '').strip()
+    start = request.GET.get('start', '').strip()
+    end = request.GET.get('end', '').strip()
     
     # Kiểm tra nếu không có tham số nào được nhập
-    if not name and not price and not address:
+    if not name and not price and not address and not date:
         messages.info(request, 'Vui lòng nhập ít nhất một tiêu chí tìm kiếm.')
         return redirect('property_list')
     
@@ -358,9 +375,23 @@ def search_courts(request):
     if address:
         tennis_courts = tennis_courts.filter(court_address__icontains=address)
     
-    # Thêm playTime_list cho mỗi sân
-    for court in tennis_courts:
-        court.playTime_list = court.playTime.split(', ') if court.playTime else []
+    # Lọc theo ngày/khung giờ còn trống (chỉ mục bitmap theo ngày)
+    if date:
+        try:
+            play_date = parse_date(date)
+        except ValueError:
+            play_date = None
+        if not play_date:
+            messages.error(request, 'Ngày không hợp lệ (định dạng YYYY-MM-DD).')
+            return redirect('property_list')
+        start_time, end_time = parse_hour(start), parse_hour(end)
+        # end_time = 00:00 là nửa đêm cuối ngày (xem availability.hour_mask)
+        if (start and not start_time) or (end and not end_time) or (
+            start_time and end_time and end_time != time(0) and end_time <= start_time
+        ):
+            messages.error(request, 'Khung giờ không hợp lệ.')
+            return redirect('property_list')
+        tennis_courts = tennis_courts.filter(id__in=find_free_courts(play_date, start_time, end_time))
     
     # Tạo thông báo kết quả
     if tennis_courts.exists():
@@ -373,9 +404,22 @@ def search_courts(request):
         'search_name': name,
         'search_price': price,
         'search_address': address,
+        'search_date': date,
+        'search_start': start,
+        'search_end': end,
     })
 
 
+def _requested_slot_date(request):
+    """Ngày xem khung giờ từ ?date=YYYY-MM-DD; None (ngày mặc định của sân) nếu rỗng, sai hoặc đã qua"""
+    try:
+        date = parse_date(request.GET.get('date', '').strip())
+    except ValueError:
+        return None
+    if date is None or date < timezone.localdate():
+        return None
+    return date
+
 def detail(request):
     if not request.user.is_authenticated:  
         messages.error(request, "Redirect to login page.")
@@ -383,16 +427,18 @@ def detail(request):
     court_id = request.GET.get('id', '')  
     court = get_object_or_404(Tennis, id=court_id)  
     
-    if court.playTime:
-        court.playTime_list = court.playTime.split(', ')
-    else:
-        court.playTime_list = []
+    # Các khung giờ của ngày (kèm trạng thái đã đặt/đang giữ): một truy vấn theo (court, date)
+    slot_date = _requested_slot_date(request) or get_slot_date(court)
+    court.slot_list = get_day_slots(court, slot_date, user=request.user)
 
     is_admin = request.user.is_authenticated and request.user.is_admin()
 
     return render(request, "apps/detail.html", {
         'tennis_courts': [court],  
         'is_admin': is_admin,  
+        'max_recurring': get_max_occurrences(),
+        'slot_date': slot_date,
+        'today': timezone.localdate().isoformat(),
     })
 
 @login_required
@@ -403,26 +449,90 @@ def rent_court(request, court_id):
         messages.error(request, "This court is under repair and cannot be booked at the moment.")
         return redirect('property_list')
 
-    booked_times = Booking.objects.filter(tennis_court=court).values_list('play_time', flat=True)
-
     if request.method == 'POST':
-        play_time = request.POST.get('play_time')
+        slot_id = request.POST.get('slot_id')
 
-        if play_time:
-            if play_time in booked_times:
-                messages.error(request, "The selected play time is already booked. Please choose another time.")
+        if slot_id:
+            # Giữ chỗ slot trong lúc thanh toán; người khác thấy slot không còn trống
+            try:
+                hold = hold_slot(request.user, court, slot_id)
+            except SlotUnavailable as e:
+                messages.error(request, str(e))
                 return redirect(f'/detail/?id={court.id}')
             request.session['temp_booking'] = {
                 'court_id': court.id,
-                'play_time': play_time,
+                'slot_id': hold.slot_id,
+                'play_time': hold.slot.label,
             }
             return redirect('checkout')
 
+    slot_date = _requested_slot_date(request) or get_slot_date(court)
+    court.slot_list = get_day_slots(court, slot_date, user=request.user)
     return render(request, 'apps/detail.html', {
-        'court': court,
-        'booked_times': booked_times
+        'tennis_courts': [court],
+        'is_admin': request.user.is_admin(),
+        'max_recurring': get_max_occurrences(),
+        'slot_date': slot_date,
+        'today': timezone.localdate().isoformat(),
     })
 
+@login_required
+def recurring_booking(request, court_id):
+    """
+    Đặt cùng khung giờ cho nhiều ngày: hằng tuần trong `weeks` tuần (bắt đầu
+    từ ngày của slot đã chọn) hoặc các ngày trong `dates` (YYYY-MM-DD, cách
+    nhau bởi dấu phẩy); thanh toán gộp bằng số dư tài khoản
+    """
+    court = get_object_or_404(Tennis, id=court_id)
+    if request.method != 'POST':
+        return redirect(f'/detail/?id={court.id}')
+    if court.status == 'Repairing':
+        messages.error(request, "This court is under repair and cannot be booked at the moment.")
+        return redirect('property_list')
+
+    slot = CourtSlot.objects.filter(court=court, id=request.POST.get('slot_id') or 0).first()
+    if slot is None:
+        messages.error(request, "Please select a play time first.")
+        return redirect(f'/detail/?id={court.id}')
+
+    raw_dates = request.POST.get('dates', '').strip()
+    try:
+        if raw_dates:
+            dates = [parse_date(value.strip()) for value in raw_dates.split(',') if value.strip()]
+            if None in dates:
+                raise ValueError
+        else:
+            weeks = int(request.POST.get('weeks', ''))
+            if not 1 <= weeks <= get_max_occurrences():
+                raise ValueError
+            dates = weekly_dates(slot.date, weeks)
+    except ValueError:
+        messages.error(request, f"Please enter valid dates or a number of weeks (1-{get_max_occurrences()}).")
+        return redirect(f'/detail/?id={court.id}')
+
+    try:
+        bookings = book_recurring(request.user, court, slot.id, dates)
+    except (SlotUnavailable, InsufficientBalance) as e:
+        messages.error(request, str(e))
+        return redirect(f'/detail/?id={court.id}')
+
+    total = court.price * len(bookings)
+    log_activity(request, 'booking', f'Đặt sân {court.name} lúc {slot.label} cho {len(bookings)} ngày', {
+        'court_id': court.id,
+        'court_name': court.name,
+        'play_time': slot.label,
+        'dates': [booking.slot.date.isoformat() for booking in bookings],
+        'amount': total
+    })
+    if total > 0:
+        log_activity(request, 'payment', f'Thanh toán {total} cho {len(bookings)} lượt sân {court.name} via balance', {
+            'amount': total,
+            'payment_method': 'balance',
+            'bookings': len(bookings)
+        })
+    messages.success(request, f"Successfully booked {court.name} at {slot.label} for {len(bookings)} dates.")
+    return redirect('booking')
+
 @login_required
 def checkout(request):
     temp_booking = request.session.get('temp_booking')
@@ -437,21 +547,22 @@ def checkout(request):
     
     # Nếu sân FREE, bỏ qua bước thanh toán và tạo booking trực tiếp
     if court_price == 0:
-        booking = Booking.objects.create(
-            tennis_court=court,
-            user=request.user,
-            play_time=play_time
-        )
-
-        invoice = Invoice.objects.create(
-            user=request.user,
-            booking=booking,
-            amount=0,
-            status='Paid',
-            payment_method='free',
-            card_last_four=None,
-            transaction_id=None
-        )
+        try:
+            with transaction.atomic():
+                booking = reserve_slot(request.user, court, temp_booking.get('slot_id'))
+                invoice = Invoice.objects.create(
+                    user=request.user,
+                    booking=booking,
+                    amount=0,
+                    status='Paid',
+                    payment_method='free',
+                    card_last_four=None,
+                    transaction_id=None
+                )
+        except SlotUnavailable as e:
+            del request.session['temp_booking']
+            messages.error(request, str(e))
+            return redirect(f'/detail/?id={court.id}')
         
         # Ghi lại hoạt động đặt sân miễn phí
         log_activity(request, 'booking', f'Đặt sân miễn phí {court.name} lúc {play_time}', {
@@ -477,6 +588,7 @@ def checkout(request):
 
     if request.method == 'POST':
         if 'cancel' in request.POST:
+            release_hold(request.user, temp_booking.get('slot_id'))
             del request.session['temp_booking']
             messages.warning(request, "Booking cancelled.")
             return redirect(f'/detail/?id={court.id}')
@@ -490,14 +602,9 @@ def checkout(request):
             transaction_id = None
             
             if payment_method == 'balance':
-                # Thanh toán bằng số dư tài khoản
-                if user_balance >= court_price:
-                    request.user.balance -= court_price
-                    request.user.save()
-                    payment_success = True
-                else:
-                    messages.error(request, "Insufficient balance. Please top up your account or choose another payment method.")
-                    return redirect('checkout')
+                # Thanh toán bằng số dư tài khoản: số dư được kiểm tra và trừ
+                # trên dòng user đã khoá, sau khi đã nhận được slot (bên dưới)
+                payment_success = True
             
             elif payment_method == 'credit_card':
                 # Mô phỏng thanh toán thẻ tín dụng
@@ -546,36 +653,51 @@ def checkout(request):
                 payment_success = True
             
             if payment_success:
-                booking = Booking.objects.create(
-                    tennis_court=court,
-                    user=request.user,
-                    play_time=play_time
-                )
-
-                invoice = Invoice.objects.create(
-                    user=request.user,
-                    booking=booking,
-                    amount=court_price,
-                    status='Paid',
-                    payment_method=payment_method,
-                    card_last_four=card_last_four,
-                    transaction_id=transaction_id
-                )
-
-                TransactionHistory.objects.create(
-                    user=request.user,
-                    transaction_type='Payment',
-                    payment_method=payment_method,
-                    amount=court_price
-                )
-                system_account = SystemAccount.objects.first()
-                if system_account:
-                    system_account.add_funds(court.price)
-                RevenueHistory.objects.create(
-                    invoice=invoice,
-                    amount=court.price,
-                    transaction_type='Payment'
-                )
+                # Nhận slot và ghi thanh toán trong một transaction: người đặt
+                # sau cho cùng slot nhận SlotUnavailable và không bị trừ tiền
+                try:
+                    with transaction.atomic():
+                        booking = reserve_slot(request.user, court, temp_booking.get('slot_id'))
+                        if payment_method == 'balance':
+                            payer = CustomUser.objects.select_for_update().get(pk=request.user.pk)
+                            if not payer.deduct(court_price):
+                                raise InsufficientBalance(
+                                    "Insufficient balance. Please top up your account or choose another payment method."
+                                )
+                            request.user.balance = payer.balance
+
+                        invoice = Invoice.objects.create(
+                            user=request.user,
+                            booking=booking,
+                            amount=court_price,
+                            status='Paid',
+                            payment_method=payment_method,
+                            card_last_four=card_last_four,
+                            transaction_id=transaction_id
+                        )
+
+                        TransactionHistory.objects.create(
+                            user=request.user,
+                            transaction_type='Payment',
+                            payment_method=payment_method,
+                            amount=court_price
+                        )
+                        system_account = SystemAccount.objects.first()
+                        if system_account:
+                            system_account.add_funds(court.price)
+                        RevenueHistory.objects.create(
+                            invoice=invoice,
+                            amount=court.price,
+                            transaction_type='Payment'
+                        )
+                except SlotUnavailable as e:
+                    del request.session['temp_booking']
+                    messages.error(request, str(e))
+                    return redirect(f'/detail/?id={court.id}')
+                except InsufficientBalance as e:
+                    # Transaction đã rollback: slot vẫn được giữ chỗ, chọn cách thanh toán khác
+                    messages.error(request, str(e))
+                    return redirect('checkout')
                 
                 # Ghi lại hoạt động đặt sân và thanh toán
                 log_activity(request, 'booking', f'Đặt sân {court.name} lúc {play_time}', {
@@ -1032,30 +1154,22 @@ def all_user_bookings(request):
     if not request.user.is_admin():
         return HttpResponseForbidden("You are not authorized to view this page.")
 
-    bookings = Booking.objects.select_related('tennis_court', 'user').all()
+    bookings = Booking.objects.select_related('tennis_court', 'user', 'slot').all()
 
     if request.method == 'POST':
         booking_id = request.POST.get('booking_id')
         booking = get_object_or_404(Booking, id=booking_id)
 
         if 'edit' in request.POST:
-            new_play_time = request.POST.get('play_time')
-            if Booking.objects.filter(tennis_court=booking.tennis_court, play_time=new_play_time).exists():
-                messages.error(request, "The selected play time is already booked. Please choose another time.")
-            else:
-                booking.play_time = new_play_time
-                booking.save()
+            try:
+                move_booking(booking, request.POST.get('slot_id'))
                 messages.success(request, f"Booking time for {booking.user.username} updated successfully!")
+            except SlotUnavailable as e:
+                messages.error(request, str(e))
 
         elif 'cancel' in request.POST:
+            # Xoá booking là slot trống trở lại
             court = booking.tennis_court
-            play_time_list = court.playTime.split(', ') if court.playTime else []
-
-            if booking.play_time not in play_time_list:
-                play_time_list.append(booking.play_time)
-            
-            court.playTime = ', '.join(play_time_list)
-            court.save()
             user = booking.user
             user.deposit(court.price)
             TransactionHistory.objects.create(
@@ -1081,9 +1195,7 @@ def all_user_bookings(request):
             messages.success(request, f"Booking for {booking.user.username} has been cancelled and refund processed.")
 
         return redirect('bookings')
-    for booking in bookings:
-        if booking.tennis_court.playTime:
-            booking.tennis_court.available_times = booking.tennis_court.playTime.split(', ')
+    bookings = attach_available_slots(bookings)
 
     return render(request, 'apps/all_bookings.html', {'bookings': bookings})
 
@@ -1099,30 +1211,22 @@ def revenue_data(request):
 @login_required
 def my_bookings(request):
     user = request.user
-    bookings = Booking.objects.filter(user=user).select_related('tennis_court')
+    bookings = Booking.objects.filter(user=user).select_related('tennis_court', 'slot')
     transactions = TransactionHistory.objects.filter(user=user)
     if request.method == 'POST':
         booking_id = request.POST.get('booking_id')
         booking = get_object_or_404(Booking, id=booking_id, user=request.user)
 
         if 'edit' in request.POST:
-            new_play_time = request.POST.get('play_time')
-            if Booking.objects.filter(tennis_court=booking.tennis_court, play_time=new_play_time).exists():
-                messages.error(request, "The selected play time is already booked. Please choose another time.")
-            else:
-                booking.play_time = new_play_time
-                booking.save()
+            try:
+                move_booking(booking, request.POST.get('slot_id'))
                 messages.success(request, "Play time updated successfully!")
+            except SlotUnavailable as e:
+                messages.error(request, str(e))
 
         elif 'cancel' in request.POST:
+            # Xoá booking là slot trống trở lại
             court = booking.tennis_court
-            play_time_list = court.playTime.split(', ') if court.playTime else []
-
-            if booking.play_time not in play_time_list:
-                play_time_list.append(booking.play_time)
-            
-            court.playTime = ', '.join(play_time_list)
-            court.save()
             
             user.deposit(court.price)
             TransactionHistory.objects.create(
@@ -1148,9 +1252,7 @@ def my_bookings(request):
             # messages.success(request, 'Booking has been cancelled and refund processed successfully.')
 
         return redirect('booking')
-    for booking in bookings:
-        if booking.tennis_court.playTime:
-            booking.tennis_court.available_times = booking.tennis_court.playTime.split(', ')
+    bookings = attach_available_slots(bookings)
 
     return render(request, 'apps/my_bookings.html', {'bookings': bookings})
 
@@ -1276,22 +1378,12 @@ def add_review(request, court_id):
         messages.error(request, 'You do not allow to rate because you did not rent this court.')
         return redirect(f'/detail/?id={tennis_court.id}')
 
-    try:
-        play_time_parts = booking.play_time.split('-')
-        start_time = play_time_parts[0].strip()
-        end_time = play_time_parts[1].strip()
-
-        start_hour = int(start_time.split(' ')[0])
-        end_hour = int(end_time.split(' ')[0])
-    except (ValueError, IndexError):
+    play_end = booking_end(booking)
+    if play_end is None:
         messages.error(request, 'Invalid play time format. Please contact support.')
         return redirect(f'/detail/?id={tennis_court.id}')
 
-
-    booking_date = booking.tennis_court.dateTime
-    current_time = now()
-
-    if booking_date > current_time.date():
+    if play_end > now():
         messages.error(request, 'Only rating after play time ends.')
         return redirect(f'/detail/?id={tennis_court.id}')
     
@@ -1323,10 +1415,8 @@ def validate_booking_completion(user, court):
     booking = Booking.objects.filter(user=user, tennis_court=court).first()
     if not booking:
         raise ValidationError("You cannot review this court because you have not booked it.")
-    current_time = now()
-    play_time_parts = booking.play_time.split('-')
-    end_hour = int(play_time_parts[1].split(' ')[0])
-    if booking.tennis_court.dateTime == current_time.date() and current_time.hour < end_hour:
+    play_end = booking_end(booking)
+    if play_end is not None and now() < play_end:
         raise ValidationError("You can only review this court after your booking time has ended.")
 
 def admin_required(user):
@@ -1426,74 +1516,12 @@ def analytics_dashboard(request):
     # Lấy số ngày từ query params (mặc định 30 ngày)
     days = int(request.GET.get('days', 30))
     
-    # Lấy dữ liệu thống kê
-    analytics_data = get_analytics_data(days)
-    
-    # Hoạt động gần đây
-    recent_activities = get_recent_activities(50)
-    
-    # Số người online
-    online_users = get_online_users_count()
-    
-    # Thống kê người dùng
-    total_users = CustomUser.objects.count()
-    total_admins = CustomUser.objects.filter(role='admin').count()
-    total_regular_users = CustomUser.objects.filter(role='user').count()
+    # Số liệu thống kê (truy vấn gộp, cache theo days - xem home.dashboard)
+    context = dict(get_dashboard_data(days))
     
-    # Thống kê sân
-    total_courts = Tennis.objects.count()
-    available_courts = Tennis.objects.filter(status='Available').count()
-    repairing_courts = Tennis.objects.filter(status='Repairing').count()
-    
-    # Thống kê đặt sân theo ngày (7 ngày gần nhất)
-    today = timezone.now().date()
-    booking_chart_data = []
-    for i in range(6, -1, -1):
-        date = today - timedelta(days=i)
-        count = UserActivity.objects.filter(
-            activity_type='booking',
-            created_at__date=date
-        ).count()
-        booking_chart_data.append({
-            'date': date.strftime('%d/%m'),
-            'count': count
-        })
-    
-    # Thống kê đăng ký theo ngày (7 ngày gần nhất)
-    register_chart_data = []
-    for i in range(6, -1, -1):
-        date = today - timedelta(days=i)
-        count = CustomUser.objects.filter(date_joined__date=date).count()
-        register_chart_data.append({
-            'date': date.strftime('%d/%m'),
-            'count': count
-        })
-    
-    # Top người dùng hoạt động
-    from django.db.models import Count as DjangoCount
-    top_active_users = UserActivity.objects.filter(
-        user__isnull=False
-    ).values(
-        'user__username', 'user__userID'
-    ).annotate(
-        activity_count=DjangoCount('id')
-    ).order_by('-activity_count')[:10]
-    
-    context = {
-        'analytics_data': analytics_data,
-        'recent_activities': recent_activities,
-        'online_users': online_users,
-        'total_users': total_users,
-        'total_admins': total_admins,
-        'total_regular_users': total_regular_users,
-        'total_courts': total_courts,
-        'available_courts': available_courts,
-        'repairing_courts': repairing_courts,
-        'booking_chart_data': booking_chart_data,
-        'register_chart_data': register_chart_data,
-        'top_active_users': top_active_users,
-        'days': days,
-    }
+    # Hoạt động gần đây và số người online luôn lấy mới
+    context['recent_activities'] = get_recent_activities(50)
+    context['online_users'] = get_online_users_count()
     
     return render(request, 'apps/analytics.html', context)
 
@@ -1505,29 +1533,18 @@ def analytics_api(request):
         return JsonResponse({'error': 'Unauthorized'}, status=403)
     
     days = int(request.GET.get('days', 30))
-    analytics_data = get_analytics_data(days)
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     
-    # Convert QuerySets to serializable format
-    response_data = {
-        'activity_stats': analytics_data['activity_stats'],
-        'daily_stats': [
-            {'date': str(item['date']), 'count': item['count']} 
-            for item in analytics_data['daily_stats']
-        ],
-        'device_stats': analytics_data['device_stats'],
-        'browser_stats': analytics_data['browser_stats'],
-        'active_sessions': analytics_data['active_sessions'],
-        'new_users': analytics_data['new_users'],
-        'total_bookings': analytics_data['total_bookings'],
-        'total_revenue': analytics_data['total_revenue'],
-        'total_page_views': analytics_data['total_page_views'],
-        'top_pages': [
-            {'url': page.page_url, 'name': page.page_name, 'views': page.view_count}
-            for page in analytics_data['top_pages']
-        ],
-    }
+    # Dashboard tự làm mới gửi lại ETag: số liệu chưa đổi thì trả 304
+    etag = get_analytics_etag(days, fields)
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
     
-    return JsonResponse(response_data)
+    return analytics_response(request, days, fields, etag)
 
 
 @login_required 
@@ -1539,7 +1556,25 @@ def user_activity_detail(request, user_id):
     
     user = get_object_or_404(CustomUser, userID=user_id)
     activity_summary = get_user_activity_summary(user)
-    activities = UserActivity.objects.filter(user=user).order_by('-created_at')[:100]
+    
+    # Khi admin chọn khoảng thời gian (?start=YYYY-MM-DD&end=YYYY-MM-DD),
+    # đọc cả dữ liệu đã archive (tối đa ACTIVITY_DETAIL_MAX_ROWS dòng mới nhất,
+    # khoảng dài hơn dùng analytics_export); mặc định xem 100 hoạt động gần nhất
+    try:
+        start = parse_date(request.GET.get('start', ''))
+        end = parse_date(request.GET.get('end', ''))
+    except ValueError:
+        start = end = None
+    range_query = ''
+    if start or end:
+        start_dt = timezone.make_aware(datetime.combine(start, datetime.min.time())) if start else None
+        end_dt = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time())) if end else None
+        activities = recent_activities(
+            start_dt, end_dt, user_id=user.userID, limit=getattr(settings, 'ACTIVITY_DETAIL_MAX_ROWS', 1000)
+        )
+        range_query = f"&start={start or ''}&end={end or ''}"
+    else:
+        activities = UserActivity.objects.filter(user=user).order_by('-created_at')[:100]
     
     # Phân trang
     paginator = Paginator(activities, 20)
@@ -1550,6 +1585,43 @@ def user_activity_detail(request, user_id):
         'target_user': user,
         'activity_summary': activity_summary,
         'activities': page_activities,
+        'range_query': range_query,
     }
     
-    return render(request, 'apps/user_activity_detail.html', context)
\ No newline at end of file
+    return render(request, 'apps/user_activity_detail.html', context)
+
+
+@login_required
+def analytics_export(request):
+    """
+    Xuất hoạt động/phiên truy cập ra CSV hoặc NDJSON theo luồng (chỉ admin)
+
+    Tham số: kind=activities|sessions, format=csv|ndjson, start/end
+    (YYYY-MM-DD), activity_type, user (userID)
+    """
+    if not request.user.is_admin():
+        return HttpResponseForbidden("Bạn không có quyền truy cập trang này.")
+    
+    kind = request.GET.get('kind', 'activities')
+    fmt = request.GET.get('format', 'csv')
+    if kind not in EXPORT_KINDS or fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'Invalid kind or format'}, status=400)
+    try:
+        start_date = parse_date(request.GET.get('start', ''))
+        end_date = parse_date(request.GET.get('end', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date'}, status=400)
+    start, end = parse_date_range(start_date, end_date)
+    
+    rows = iter_export_rows(
+        kind, start, end,
+        activity_type=request.GET.get('activity_type') or None,
+        user_id=request.GET.get('user') or None,
+    )
+    response = StreamingHttpResponse(
+        stream_export(rows, EXPORT_KINDS[kind], fmt),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    filename = f"{kind}_{start_date or 'all'}_{end_date or timezone.localdate()}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
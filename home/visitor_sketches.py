@@ -0,0 +1,165 @@
+"""
+Đếm khách truy cập khác nhau (theo IP) bằng sketch HyperLogLog theo ngày.
+
+Trên đường ghi sự kiện, mỗi lượt xem được thêm vào sketch trong bộ nhớ của
+(ngày, toàn site) và (ngày, route). Sketch theo trang được khoá theo tên route
+Django chứ không theo path, và mọi path không khớp route nào (404, URL do
+scanner dò) dùng chung một sketch OTHER_SCOPE, nên số sketch mỗi ngày bị chặn
+bởi số route của site. Định kỳ (VISITOR_SKETCH_FLUSH_SECONDS)
+các sketch đang chờ được gộp (max từng thanh ghi) vào VisitorSketch trong
+DB; phép gộp có tính giao hoán và lặp lại không đổi kết quả, nên nhiều worker
+cùng ghi hay ghi lại sau lỗi đều an toàn.
+
+count_unique_visitors() gộp các sketch của một khoảng ngày bất kỳ, với sai
+số chuẩn ~1.04/sqrt(2^VISITOR_SKETCH_PRECISION) (mặc định ~1.6%).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .hyperloglog import DEFAULT_PRECISION, HyperLogLog
+
+
+SITE_SCOPE = ''
+OTHER_SCOPE = '(other)'
+
+
+def page_scope(route_name):
+    """Khoá sketch theo trang: tên route, hoặc OTHER_SCOPE với path không có route"""
+    return route_name or OTHER_SCOPE
+
+
+def get_precision():
+    return getattr(settings, 'VISITOR_SKETCH_PRECISION', DEFAULT_PRECISION)
+
+
+def _merge_into_db(pending):
+    """Gộp các sketch đang chờ vào VisitorSketch"""
+    from .models import VisitorSketch
+    from .rollups import mark_rollups_updated
+
+    with transaction.atomic():
+        for (date, page_url), sketch in pending.items():
+            row = VisitorSketch.objects.select_for_update().filter(date=date, page_url=page_url).first()
+            if row is None:
+                VisitorSketch.objects.create(date=date, page_url=page_url, sketch=sketch.to_bytes())
+                continue
+            stored = HyperLogLog.from_bytes(row.sketch)
+            if stored.precision != sketch.precision:
+                # Đổi precision giữa chừng: giữ sketch đã lưu, bỏ phần mới
+                continue
+            row.sketch = stored.merge(sketch).to_bytes()
+            row.save(update_fields=['sketch', 'updated_at'])
+    mark_rollups_updated()
+
+
+class VisitorSketchBuffer:
+    """Sketch HLL đang chờ ghi theo (ngày, scope), flush định kỳ"""
+
+    def __init__(self, apply=_merge_into_db, precision=DEFAULT_PRECISION, flush_interval=30):
+        self.apply = apply
+        self.precision = precision
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.additions = 0
+        self.writes = 0
+
+    def add(self, date, visitor, scope=None):
+        """Thêm visitor vào sketch toàn site của ngày, và của trang (scope) nếu có"""
+        scopes = (SITE_SCOPE,) if not scope else (SITE_SCOPE, scope)
+        with self._lock:
+            for scope in scopes:
+                sketch = self._pending.get((date, scope))
+                if sketch is None:
+                    sketch = self._pending[(date, scope)] = HyperLogLog(self.precision)
+                sketch.add(visitor)
+            self.additions += 1
+
+    def flush_if_due(self):
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self.apply(pending)
+            self.writes += len(pending)
+        except Exception:
+            # Gộp lại vào phần đang chờ để lần flush sau ghi tiếp
+            with self._lock:
+                for key, sketch in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = sketch if current is None else current.merge(sketch)
+            raise
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'additions': self.additions,
+            'writes': self.writes,
+            'pending_sketches': pending,
+            'flush_interval': self.flush_interval,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_visitor_sketch_buffer():
+    """Bộ đệm sketch khách truy cập dùng chung của process"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VisitorSketchBuffer(
+                    precision=get_precision(),
+                    flush_interval=getattr(settings, 'VISITOR_SKETCH_FLUSH_SECONDS', 30),
+                )
+                from .tracking_buffer import register_periodic_hook, register_shutdown_flusher
+                register_periodic_hook(_buffer.flush_if_due)
+                register_shutdown_flusher(_buffer.flush)
+    return _buffer
+
+
+def record_visitor(timestamp, visitor, route_name=None):
+    """
+    Ghi nhận một lượt truy cập của visitor (vd: địa chỉ IP) vào sketch toàn
+    site và sketch của route (page_scope) trong ngày
+    """
+    if not visitor:
+        return
+    get_visitor_sketch_buffer().add(timezone.localtime(timestamp).date(), visitor, page_scope(route_name))
+
+
+def load_sketches(start_date, end_date, page_url=SITE_SCOPE):
+    """{ngày: HyperLogLog} đã lưu cho các ngày trong [start_date, end_date) (page_url: toàn site hoặc page_scope)"""
+    from .models import VisitorSketch
+
+    rows = VisitorSketch.objects.filter(
+        date__gte=start_date, date__lt=end_date, page_url=page_url
+    ).values_list('date', 'sketch')
+    return {date: HyperLogLog.from_bytes(data) for date, data in rows}
+
+
+def count_unique_visitors(start_date, end_date, page_url=SITE_SCOPE):
+    """
+    Ước lượng số khách khác nhau trong [start_date, end_date) (toàn site,
+    hoặc của một route: page_url=page_scope(tên route))
+
+    Returns:
+        (ước lượng, sai số chuẩn tương đối)
+    """
+    sketches = load_sketches(start_date, end_date, page_url).values()
+    union = HyperLogLog.union(sketches, precision=get_precision())
+    return union.count(), union.relative_error
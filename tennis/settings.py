@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -238,3 +239,162 @@ USE_X_FORWARDED_HOST = True
 # Increase timeout for OAuth requests
 SOCIALACCOUNT_HTTP_CLIENT_TIMEOUT = 30
 
+
+# Activity tracking
+# 'sync': ghi trực tiếp trong request; 'write_behind': đẩy vào hàng đợi và ghi theo lô
+ACTIVITY_TRACKING_MODE = 'write_behind'
+ACTIVITY_TRACKING_QUEUE_SIZE = 10000  # Số sự kiện tối đa trong hàng đợi
+ACTIVITY_TRACKING_FLUSH_INTERVAL_MS = 500  # Flush mỗi N ms...
+ACTIVITY_TRACKING_FLUSH_BATCH_SIZE = 200  # ...hoặc khi đủ M sự kiện
+# Khi hàng đợi đầy: 'drop_newest', 'drop_oldest', 'block' hoặc 'sync'
+ACTIVITY_TRACKING_OVERFLOW_POLICY = 'drop_newest'
+# Các hook định kỳ (flush bộ đếm, heartbeat, rollup, ...) chạy trong thread riêng mỗi N giây
+ACTIVITY_TRACKING_HOOK_INTERVAL_SECONDS = 1
+# Tắt thread nền và flush khi thoát khi chạy python manage.py test (DB test bị
+# huỷ trước khi process thoát); test gọi flush() trực tiếp khi cần
+ACTIVITY_TRACKING_BACKGROUND = sys.argv[1:2] != ['test']
+# Lượt xem trang được cộng dồn trong bộ nhớ và ghi xuống DB mỗi N giây
+# (0 = ghi ngay, chính xác tuyệt đối nhưng mỗi lượt xem là một lệnh UPDATE)
+PAGE_VIEW_COUNTER_FLUSH_SECONDS = 5
+PAGE_VIEW_COUNTER_MAX_PENDING = 1000  # Số URL chờ ghi tối đa trước khi flush sớm
+
+# Các path không cần theo dõi (so khớp prefix và đuôi file, không phân biệt hoa thường)
+ACTIVITY_TRACKING_EXCLUDED_PREFIXES = ['/static/', '/media/', '/admin/jsi18n/', '/favicon.ico']
+ACTIVITY_TRACKING_EXCLUDED_EXTENSIONS = ['css', 'js', 'png', 'jpg', 'jpeg', 'gif', 'ico', 'woff', 'woff2', 'ttf', 'svg']
+
+# Tên trang hiển thị trong thống kê, theo tên route trong home/urls.py
+ACTIVITY_TRACKING_PAGE_NAMES = {
+    'home': 'Trang chủ',
+    'about': 'Giới thiệu',
+    'contact': 'Liên hệ',
+    'auth_user': 'Đăng nhập/Đăng ký User',
+    'auth_admin': 'Đăng nhập/Đăng ký Admin',
+    'property_list': 'Danh sách sân tennis',
+    'search_courts': 'Tìm kiếm sân',
+    'detail': 'Chi tiết sân',
+    'rent_court': 'Đặt sân',
+    'checkout': 'Thanh toán',
+    'booking_success': 'Đặt sân thành công',
+    'booking': 'Đặt chỗ của tôi',
+    'bookings': 'Tất cả đặt chỗ',
+    'top_up': 'Nạp tiền',
+    'transaction_history': 'Lịch sử giao dịch',
+    'user_profile': 'Hồ sơ người dùng',
+    'review': 'Đánh giá sân',
+    'report_court': 'Báo cáo sân',
+    'add_tennis': 'Thêm sân mới',
+    'manage_users': 'Quản lý người dùng',
+    'reports': 'Báo cáo admin',
+    'analytics': 'Thống kê hoạt động',
+}
+
+# Chính sách ghi UserActivity cho từng route (key là tên route, hoặc path
+# nếu không có route): 'always', 'counters' (chỉ đếm PageView/VisitorSession),
+# 'never', hoặc xác suất lấy mẫu p trong (0, 1) - dòng được ghi mang weight 1/p
+ACTIVITY_TRACKING_POLICIES = {
+    'home': 0.25,
+    'property_list': 0.5,
+    'detail': 'always',
+    'about': 'always',
+    'contact': 'always',
+}
+ACTIVITY_TRACKING_DEFAULT_POLICY = 'counters'
+
+# Regex dự phòng cho các path không khớp route nào (gộp thành một regex duy nhất)
+ACTIVITY_TRACKING_PAGE_NAME_PATTERNS = {
+    r'^/$': 'Trang chủ',
+    r'^/hire/?$': 'Danh sách sân tennis',
+    r'^/detail/\d+/?$': 'Chi tiết sân',
+}
+ACTIVITY_TRACKING_ROUTE_CACHE_SIZE = 2048  # Số path được ghi nhớ kết quả phân loại
+USER_AGENT_CACHE_SIZE = 4096  # Số chuỗi User-Agent được ghi nhớ kết quả phân tích
+# Chỉ ghi last_activity/page_views của một VisitorSession khi lần ghi trước cũ hơn N giây
+VISITOR_SESSION_HEARTBEAT_SECONDS = 60
+VISITOR_SESSION_MAX_TRACKED = 50000  # Số session giữ trạng thái heartbeat trong bộ nhớ
+
+# Cache dùng cho presence/bộ đếm. LocMemCache chỉ có hiệu lực trong một process;
+# khi chạy nhiều worker, đặt REDIS_URL để các worker dùng chung một cache
+# (RedisCache cần gói redis, có trong requirements.txt)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Presence: user được coi là online trong N giây sau request cuối
+PRESENCE_ONLINE_TIMEOUT = 300
+# last_login chỉ được ghi xuống DB khi giá trị đang lưu cũ hơn N giây
+PRESENCE_PERSIST_INTERVAL = 300
+
+# Lưu trữ UserActivity: giữ N ngày gần nhất trong bảng, phần cũ hơn được chuyển
+# sang file NDJSON nén theo tháng (python manage.py archive_activities [--loop])
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive', 'activities')
+# Mỗi segment archive phủ một khoảng N id cố định (không đổi khi đã có archive)
+ACTIVITY_ARCHIVE_SEGMENT_SIZE = 10000
+# Số hoạt động tối đa trang chi tiết user đọc khi lọc theo khoảng thời gian
+ACTIVITY_DETAIL_MAX_ROWS = 1000
+
+# Bảng thống kê gộp ActivityRollup (theo giờ/ngày): các lượt cộng được gộp
+# trong bộ nhớ và ghi mỗi N giây; dựng lại bằng python manage.py rebuild_rollups
+ACTIVITY_ROLLUP_FLUSH_SECONDS = 5
+ACTIVITY_ROLLUP_MAX_PENDING = 1000
+
+# Cache dữ liệu trang thống kê admin (giây), theo từng giá trị days
+DASHBOARD_CACHE_TTL = 60
+
+# Sketch HyperLogLog đếm khách khác nhau theo ngày/trang: precision p cho
+# 2^p thanh ghi (p=12: 4 KB/sketch, sai số chuẩn ~1.6%); đổi p cần xoá sketch cũ
+VISITOR_SKETCH_PRECISION = 12
+VISITOR_SKETCH_FLUSH_SECONDS = 30
+
+# analytics_api: ETag/304 theo mốc thay đổi số liệu; payload được coi là mới
+# tối đa N giây (cho các số liệu trôi theo thời gian, vd: phiên đang hoạt động)
+ANALYTICS_API_MAX_STALENESS = 60
+
+# Thống kê theo user (UserStats): phần thay đổi được gộp trong bộ nhớ và ghi
+# mỗi N giây; dựng lại bằng python manage.py rebuild_user_stats
+USER_STATS_FLUSH_SECONDS = 5
+USER_STATS_MAX_PENDING = 1000
+
+# Cache bảng xếp hạng user hoạt động (giây); bộ đếm theo ngày được dựng lại
+# bằng python manage.py rebuild_leaderboard
+LEADERBOARD_CACHE_TTL = 60
+
+# Nhận diện bot/crawler trong ActivityTrackingMiddleware: bot chỉ được đếm
+# theo họ bot (ActivityRollup chiều 'bot'), không tạo session/VisitorSession.
+# Các mẫu là regex trên User-Agent (không phân biệt hoa thường)
+ACTIVITY_BOT_DENY_PATTERNS = []  # Coi thêm là bot
+ACTIVITY_BOT_ALLOW_PATTERNS = []  # Luôn coi là người dùng thật
+ACTIVITY_BOT_EMPTY_USER_AGENT = True  # User-Agent rỗng là bot
+
+# Cookie mã khách (đã ký) cho ActivityTrackingMiddleware, thay cho việc tạo
+# session DB cho mọi khách truy cập
+ACTIVITY_VISITOR_COOKIE_NAME = 'vid'
+ACTIVITY_VISITOR_COOKIE_AGE = 365 * 24 * 60 * 60  # 1 năm
+
+# Cache chỉ mục sân trống theo ngày (bitmap giờ của từng sân, giây); bị huỷ
+# khi slot/booking của ngày thay đổi. Việc huỷ chỉ có tác dụng với cache dùng
+# chung (REDIS_URL); với LocMemCache mỗi process giữ bản riêng nên TTL chỉ còn
+# AVAILABILITY_LOCAL_CACHE_TTL giây
+AVAILABILITY_CACHE_TTL = 300
+AVAILABILITY_LOCAL_CACHE_TTL = 5
+
+# Giữ chỗ slot từ lúc chọn giờ tới lúc thanh toán (giây); giữ chỗ hết hạn
+# được xoá mỗi SLOT_HOLD_SWEEP_SECONDS giây bởi thread nền của process web.
+# Đặt SLOT_HOLD_SWEEP_THREAD = False khi chạy riêng
+# python manage.py sweep_slot_holds --loop (hoặc cron)
+SLOT_HOLD_SECONDS = 5 * 60
+SLOT_HOLD_SWEEP_SECONDS = 30
+SLOT_HOLD_SWEEP_THREAD = sys.argv[1:2] != ['test']
+
+# Số ngày tối đa của một lần đặt sân định kỳ (hằng tuần / nhiều ngày)
+RECURRING_BOOKING_MAX_OCCURRENCES = 12